@@ -8,6 +8,10 @@
 - Tự động OCR với EasyOCR (tiếng Việt + Anh)
 - Tự động nhận diện thứ tự trang (theo tên file)
 - Tự động sắp xếp nội dung
+- Nhiều ảnh (>= BATCH_MIN_IMAGES): chia nhóm cho nhiều worker OCR warm chạy
+  song song (scripts/conversion_pool.py), ghép lại đúng thứ tự trang
+- Ít ảnh: dùng OCR server warm nếu đang chạy (scripts/ocr_server.py), không
+  thì OCR in-process như cũ
 - Xuất ra file Word (.docx) + Markdown (.md)
 
 📖 Cách dùng:
@@ -28,6 +32,13 @@ from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Tuple
 import re
+import math
+import importlib.util
+
+# Heavy libraries (docling, python-docx, PIL, cv2 / OCR engines via scripts/) are imported where
+# they are used: with the warm OCR server running, the first result comes back without loading any
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from ocr_server import OCR_SERVER_URL, OcrServerUnavailable, connect
 
 # Fix Windows console encoding
 if sys.platform == 'win32':
@@ -35,19 +46,23 @@ if sys.platform == 'win32':
     sys.stdout = codecs.getwriter('utf-8')(sys.stdout.buffer, 'strict')
     sys.stderr = codecs.getwriter('utf-8')(sys.stderr.buffer, 'strict')
 
-# Import dependencies
-try:
-    from docling.document_converter import DocumentConverter, PdfFormatOption
-    from docling.datamodel.base_models import InputFormat
-    from docling.datamodel.pipeline_options import PdfPipelineOptions, EasyOcrOptions
-    from docx import Document
-    from docx.shared import Pt, Inches
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from PIL import Image
-    DEPS_OK = True
-except ImportError as e:
-    DEPS_OK = False
-    MISSING_DEP = str(e)
+# Dependencies (module -> pip package), checked without importing them
+DEPENDENCIES = {'docling': 'docling', 'PIL': 'pillow', 'docx': 'python-docx'}
+
+# Batched mode: nhiều ảnh -> pool worker warm, mỗi worker giữ converter + model EasyOCR
+THREADS_PER_WORKER = 2  # Torch threads per OCR worker
+OCR_WORKERS = max(1, (os.cpu_count() or 2) // THREADS_PER_WORKER)
+OCR_GROUP_SIZE = 4  # Images per worker task (one convert_all call, pipeline stays hot)
+BATCH_MIN_IMAGES = 3  # Fewer images: OCR in-process (spawning workers costs a model load each)
+IMAGE_TIMEOUT = 300  # Seconds per image before a stuck worker is killed
+
+# Tiền xử lý trước OCR (scripts/image_preprocess.py): deskew, chuẩn hóa chiều cao
+# dòng chữ, nhị phân hóa thích nghi, cắt lề
+PREPROCESS_IMAGES = True
+
+# Pipeline gửi kèm request tới OCR server: kết quả giống hệt build_converter() in-process
+# (table_structure None = mặc định của Docling, tool này không đặt)
+OCR_PIPELINE = {'preprocess': PREPROCESS_IMAGES, 'table_structure': None}
 
 
 def print_banner():
@@ -62,9 +77,10 @@ def print_banner():
 
 def check_dependencies():
     """Kiểm tra dependencies"""
-    if not DEPS_OK:
+    missing = [package for module, package in DEPENDENCIES.items() if importlib.util.find_spec(module) is None]
+    if missing:
         print("❌ Thiếu thư viện cần thiết!")
-        print(f"\n   Lỗi: {MISSING_DEP}\n")
+        print(f"\n   Lỗi: No module named {', '.join(missing)}\n")
         print("🔧 Cài đặt bằng lệnh:")
         print("   cd python")
         print("   .\\venv\\Scripts\\activate")
@@ -113,7 +129,50 @@ def sort_images_by_page(image_paths: List[str]) -> List[Tuple[str, int]]:
     return images_with_pages
 
 
-def ocr_image(image_path: str, converter: DocumentConverter) -> Dict:
+def build_converter():
+    """
+    Converter cho ảnh: Docling EasyOCR vi+en, OCR toàn trang, hoặc tiered (RapidOCR ->
+    EasyOCR cho dòng confidence thấp, scripts/ocr_engines.py) nếu được bật
+    
+    Cùng hàm với OCR server (ocr_server.build_converter) và cùng OCR_PIPELINE; cache OCR
+    (scripts/ocr_cache.py) nằm sau bước tiền xử lý: key theo ảnh đã chuẩn hóa
+    """
+    from ocr_server import build_converter as build_pipeline
+    return build_pipeline(OCR_PIPELINE['preprocess'], OCR_PIPELINE['table_structure'])
+
+
+def engine_label(tiered: bool) -> str:
+    """Tên OCR engine ghi vào kết quả"""
+    if tiered:
+        from ocr_engines import FAST_ENGINE, ACCURATE_ENGINE
+        return f"{FAST_ENGINE} + {ACCURATE_ENGINE} (dòng confidence thấp)"
+    return "Docling + EasyOCR"
+
+
+def local_engine_label() -> str:
+    from ocr_engines import use_tiered
+    return engine_label(use_tiered())
+
+
+def setup_ocr_worker():
+    """Converter bên trong 1 worker process (batched mode)"""
+    try:
+        import torch
+        torch.set_num_threads(THREADS_PER_WORKER)
+    except ImportError:
+        pass
+    return build_converter()
+
+
+def get_confidence(doc_result) -> float:
+    confidence = 0.95  # Default
+    if hasattr(doc_result, 'confidence'):
+        if hasattr(doc_result.confidence, 'mean_grade'):
+            confidence = float(doc_result.confidence.mean_grade.value)
+    return confidence
+
+
+def ocr_image(image_path: str, converter) -> Dict:
     """
     OCR một ảnh
     
@@ -123,6 +182,9 @@ def ocr_image(image_path: str, converter: DocumentConverter) -> Dict:
             'text': str,
             'confidence': float,
             'processing_time': float,
+            'preprocess': dict (step report, None if not preprocessed),
+            'tiers': dict (lines / seconds per OCR tier, None with Docling OCR),
+            'cache': dict (OCR cache hits / saved seconds, None without cache),
             'error': str (if failed)
         }
     """
@@ -132,6 +194,9 @@ def ocr_image(image_path: str, converter: DocumentConverter) -> Dict:
         'text': '',
         'confidence': 0.0,
         'processing_time': 0.0,
+        'preprocess': None,
+        'tiers': None,
+        'cache': None,
         'error': ''
     }
     
@@ -144,15 +209,17 @@ def ocr_image(image_path: str, converter: DocumentConverter) -> Dict:
         text = doc.export_to_markdown()
         
         # Get confidence
-        confidence = 0.95  # Default
-        if hasattr(doc_result, 'confidence'):
-            if hasattr(doc_result.confidence, 'mean_grade'):
-                confidence = float(doc_result.confidence.mean_grade.value)
+        confidence = get_confidence(doc_result)
         
         result['success'] = True
         result['text'] = text.strip()
         result['confidence'] = confidence
+        result['preprocess'] = getattr(doc_result, 'preprocess', None)
+        result['tiers'] = getattr(doc_result, 'tiers', None)
+        result['cache'] = getattr(doc_result, 'cache', None)
         
+    except OcrServerUnavailable:
+        raise
     except Exception as e:
         result['error'] = str(e)
     
@@ -162,14 +229,88 @@ def ocr_image(image_path: str, converter: DocumentConverter) -> Dict:
     return result
 
 
-def create_word_document(pages_data: List[Dict], output_path: str):
+def ocr_group_task(task: Dict, converter) -> Dict:
+    """
+    Worker task: OCR một nhóm ảnh liên tiếp bằng 1 lần convert_all
+    
+    Returns:
+        {'success': True, 'results': [ocr_image-style dict per image, same order]}
+    """
+    results = []
+    last = time.time()
+    for doc_result in converter.convert_all(task['images'], raises_on_error=False):
+        result = {'success': False, 'text': '', 'confidence': 0.0, 'processing_time': 0.0,
+                  'preprocess': getattr(doc_result, 'preprocess', None),
+                  'tiers': getattr(doc_result, 'tiers', None),
+                  'cache': getattr(doc_result, 'cache', None), 'error': ''}
+        try:
+            if doc_result.errors and not doc_result.document.pages:
+                result['error'] = '; '.join(str(getattr(e, 'error_message', e)) for e in doc_result.errors)
+            else:
+                result['success'] = True
+                result['text'] = doc_result.document.export_to_markdown().strip()
+                result['confidence'] = get_confidence(doc_result)
+        except Exception as e:
+            result['error'] = str(e)
+        # Time between consecutive results = this page's share of the group
+        now = time.time()
+        result['processing_time'] = now - last
+        last = now
+        results.append(result)
+    return {'success': True, 'results': results}
+
+
+def ocr_images_batched(sorted_images: List[Tuple[str, int]], on_page) -> Tuple[float, int]:
+    """
+    OCR nhiều ảnh song song trên pool worker warm
+    
+    on_page(index, result) được gọi ngay khi từng ảnh xong (thứ tự bất kỳ);
+    caller ghép lại theo index = thứ tự của sort_images_by_page.
+    
+    Returns:
+        (wall-clock seconds gồm cả khởi động worker, số worker)
+    """
+    from conversion_pool import ConversionPool
+    
+    start_time = time.time()
+    paths = [path for path, _ in sorted_images]
+    group_size = max(1, min(OCR_GROUP_SIZE, math.ceil(len(paths) / OCR_WORKERS)))
+    groups = [list(range(i, min(i + group_size, len(paths)))) for i in range(0, len(paths), group_size)]
+    workers = min(OCR_WORKERS, len(groups))
+    print(f"⚙️ Đang khởi tạo {workers} OCR worker ({THREADS_PER_WORKER} threads mỗi worker), "
+          f"{len(groups)} nhóm x {group_size} ảnh...\n")
+    
+    with ConversionPool(setup_ocr_worker, ocr_group_task, workers) as pool:
+        # Same priority -> FIFO: early pages are dispatched first
+        for indexes in groups:
+            pool.submit({'path': paths[indexes[0]], 'indexes': indexes,
+                         'images': [paths[i] for i in indexes],
+                         'timeout': IMAGE_TIMEOUT * len(indexes)})
+        
+        for task, group_result in pool.run():
+            if group_result.get('success'):
+                for index, result in zip(task['indexes'], group_result['results']):
+                    on_page(index, result)
+            else:
+                # Worker crashed / timed out / failed to start: the whole group failed
+                for index in task['indexes']:
+                    on_page(index, {'success': False, 'text': '', 'confidence': 0.0,
+                                    'processing_time': 0.0, 'error': group_result.get('error', '')})
+    return time.time() - start_time, workers
+
+
+def create_word_document(pages_data: List[Dict], output_path: str, engine: str):
     """
     Tạo file Word từ kết quả OCR
     
     Args:
         pages_data: List of {page_num, text, confidence, image_path}
         output_path: Path to output .docx file
+        engine: OCR engine label (engine_label)
     """
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    
     doc = Document()
     
     # Add title
@@ -180,7 +321,7 @@ def create_word_document(pages_data: List[Dict], output_path: str):
     metadata = doc.add_paragraph()
     metadata.add_run(f"📅 Ngày tạo: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n").italic = True
     metadata.add_run(f"📄 Số trang: {len(pages_data)}\n").italic = True
-    metadata.add_run(f"🤖 OCR Engine: Docling + EasyOCR").italic = True
+    metadata.add_run(f"🤖 OCR Engine: {engine}").italic = True
     
     doc.add_paragraph()  # Spacer
     doc.add_page_break()
@@ -216,13 +357,14 @@ def create_word_document(pages_data: List[Dict], output_path: str):
     doc.save(output_path)
 
 
-def create_markdown_document(pages_data: List[Dict], output_path: str):
+def create_markdown_document(pages_data: List[Dict], output_path: str, engine: str):
     """
     Tạo file Markdown từ kết quả OCR
     
     Args:
         pages_data: List of {page_num, text, confidence, image_path}
         output_path: Path to output .md file
+        engine: OCR engine label (engine_label)
     """
     lines = []
     
@@ -233,7 +375,7 @@ def create_markdown_document(pages_data: List[Dict], output_path: str):
     lines.append("## 📋 Thông tin tài liệu\n")
     lines.append(f"- **Ngày tạo:** {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
     lines.append(f"- **Số trang:** {len(pages_data)}")
-    lines.append(f"- **OCR Engine:** Docling + EasyOCR")
+    lines.append(f"- **OCR Engine:** {engine}")
     lines.append("")
     lines.append("---\n")
     
@@ -263,6 +405,47 @@ def create_markdown_document(pages_data: List[Dict], output_path: str):
         f.write('\n'.join(lines))
 
 
+def report_page(image_path: str, result: Dict):
+    """In kết quả OCR của 1 trang (kích thước ảnh, độ tin cậy, số từ, thời gian)"""
+    # Get image info
+    try:
+        from PIL import Image
+        img = Image.open(image_path)
+        width, height = img.size
+        file_size = os.path.getsize(image_path) / 1024  # KB
+        print(f"    📐 Kích thước: {width}x{height} px ({file_size:.1f} KB)")
+    except:
+        pass
+    
+    if result.get('preprocess'):
+        from image_preprocess import describe
+        print(f"    🧹 Tiền xử lý: {describe(result['preprocess'])}")
+    if result.get('tiers'):
+        from ocr_engines import describe_tiers
+        print(f"    🔀 OCR tiers: {describe_tiers(result['tiers'])}")
+    if result.get('cache') and result['cache']['page_hit']:
+        print(f"    ♻️ Cache: ảnh đã OCR trước đó, bỏ qua nhận dạng (tiết kiệm {result['cache']['saved']:.1f}s)")
+    
+    if result['success']:
+        word_count = len(result['text'].split())
+        char_count = len(result['text'])
+        confidence = result['confidence']
+        
+        # Confidence indicator
+        if confidence >= 0.9:
+            conf_icon = "✅"
+        elif confidence >= 0.7:
+            conf_icon = "⚠️"
+        else:
+            conf_icon = "❌"
+        
+        print(f"    {conf_icon} Thành công! Độ tin cậy: {confidence:.1%}")
+        print(f"    📝 {word_count} từ, {char_count} ký tự")
+        print(f"    ⏱️  Thời gian: {result['processing_time']:.1f}s\n")
+    else:
+        print(f"    ❌ Lỗi: {result['error']}\n")
+
+
 def get_image_files() -> List[str]:
     """
     Nhận danh sách file ảnh từ user input
@@ -352,73 +535,82 @@ def main():
         print("\n⚠️ Đã hủy!")
         return
     
-    # Setup Docling
-    print("\n⚙️ Đang khởi tạo OCR engine...")
-    pipeline_options = PdfPipelineOptions()
-    pipeline_options.do_ocr = True
-    pipeline_options.ocr_options = EasyOcrOptions(
-        lang=['vi', 'en'],
-        force_full_page_ocr=True  # Force OCR toàn trang
-    )
-    
-    converter = DocumentConverter(
-        format_options={
-            InputFormat.IMAGE: PdfFormatOption(pipeline_options=pipeline_options)
-        }
-    )
-    print("   ✅ Sẵn sàng!\n")
+    batched = len(sorted_images) >= BATCH_MIN_IMAGES and OCR_WORKERS > 1
+    
+    # Setup Docling (batched mode: converters are built inside the workers)
+    converter = None
+    if not batched:
+        converter = connect(pipeline=OCR_PIPELINE)
+    if converter is not None:
+        engine = engine_label(converter.status.get('engine') == 'tiered')
+        print(f"\n🔤 OCR engine: {engine}")
+        print(f"\n⚡ Dùng OCR server warm: {OCR_SERVER_URL}\n")
+    else:
+        engine = local_engine_label()
+        print(f"\n🔤 OCR engine: {engine}")
+        if not batched:
+            print("\n⚙️ Đang khởi tạo OCR engine...")
+            converter = build_converter()
+            print("   ✅ Sẵn sàng!\n")
     
     # Process each image
-    pages_data = []
+    results = [None] * len(sorted_images)
     total_time = 0
     
     print("=" * 70)
     print("🚀 BẮT ĐẦU OCR")
     print("=" * 70 + "\n")
     
-    for idx, (image_path, page_num) in enumerate(sorted_images, 1):
-        filename = os.path.basename(image_path)
-        print(f"[{idx}/{len(sorted_images)}] Đang xử lý: {filename}")
+    if batched:
+        finished = 0
         
-        # Get image info
-        try:
-            img = Image.open(image_path)
-            width, height = img.size
-            file_size = os.path.getsize(image_path) / 1024  # KB
-            print(f"    📐 Kích thước: {width}x{height} px ({file_size:.1f} KB)")
-        except:
-            pass
+        def on_page(index, result):
+            nonlocal finished
+            finished += 1
+            results[index] = result
+            image_path, page_num = sorted_images[index]
+            print(f"[{finished}/{len(sorted_images)}] Xong: [{page_num:03d}] {os.path.basename(image_path)}")
+            report_page(image_path, result)
         
-        # OCR
-        result = ocr_image(image_path, converter)
+        wall_time, workers = ocr_images_batched(sorted_images, on_page)
+    else:
+        wall_time = None
+        for idx, (image_path, page_num) in enumerate(sorted_images, 1):
+            filename = os.path.basename(image_path)
+            print(f"[{idx}/{len(sorted_images)}] Đang xử lý: {filename}")
+            
+            # OCR
+            try:
+                results[idx - 1] = ocr_image(image_path, converter)
+            except OcrServerUnavailable:
+                print("    ⚠️ OCR server đã dừng, chuyển sang OCR in-process...")
+                engine = local_engine_label()
+                converter = build_converter()
+                results[idx - 1] = ocr_image(image_path, converter)
+            report_page(image_path, results[idx - 1])
+    
+    from image_preprocess import PreprocessStats
+    from ocr_engines import TierStats
+    from ocr_cache import CacheStats
+    
+    # Reassemble in page order (batched results arrive in any order)
+    pages_data = []
+    preprocess_stats = PreprocessStats()
+    tier_stats = TierStats()
+    cache_stats = CacheStats()
+    for (image_path, page_num), result in zip(sorted_images, results):
         total_time += result['processing_time']
-        
+        preprocess_stats.add(result.get('preprocess'))
+        tier_stats.add(result.get('tiers'))
+        cache_stats.add(result.get('cache'))
         if result['success']:
-            word_count = len(result['text'].split())
-            char_count = len(result['text'])
-            confidence = result['confidence']
-            
-            # Confidence indicator
-            if confidence >= 0.9:
-                conf_icon = "✅"
-            elif confidence >= 0.7:
-                conf_icon = "⚠️"
-            else:
-                conf_icon = "❌"
-            
-            print(f"    {conf_icon} Thành công! Độ tin cậy: {confidence:.1%}")
-            print(f"    📝 {word_count} từ, {char_count} ký tự")
-            print(f"    ⏱️  Thời gian: {result['processing_time']:.1f}s\n")
-            
             pages_data.append({
                 'page_num': page_num,
                 'text': result['text'],
-                'confidence': confidence,
+                'confidence': result['confidence'],
                 'image_path': image_path,
-                'word_count': word_count
+                'word_count': len(result['text'].split())
             })
-        else:
-            print(f"    ❌ Lỗi: {result['error']}\n")
     
     # Summary
     print("=" * 70)
@@ -427,7 +619,19 @@ def main():
     print(f"✅ Thành công:     {len(pages_data)}/{len(sorted_images)} trang")
     print(f"❌ Thất bại:       {len(sorted_images) - len(pages_data)}/{len(sorted_images)} trang")
     print(f"⏱️  Tổng thời gian:  {total_time:.1f}s ({total_time/60:.1f} phút)")
+    if wall_time is not None:
+        print(f"🚀 Song song:       {wall_time:.1f}s thực tế, "
+              f"{len(sorted_images) / max(wall_time, 1e-9) * 60:.1f} trang/phút ({workers} worker)")
     print(f"📝 Tổng số từ:      {sum(p['word_count'] for p in pages_data)} từ")
+    if preprocess_stats.images:
+        for line in preprocess_stats.report():
+            print(f"🧹 Tiền xử lý:      {line}")
+    if tier_stats.images:
+        for line in tier_stats.report():
+            print(f"🔀 OCR tiers:       {line}")
+    if cache_stats.pages:
+        for line in cache_stats.report():
+            print(f"♻️ OCR cache:       {line}")
     
     if not pages_data:
         print("\n⚠️ Không có trang nào được OCR thành công!")
@@ -447,13 +651,13 @@ def main():
     # Word document
     word_path = os.path.join(output_dir, f"OCR_Result_{timestamp}.docx")
     print(f"📄 Đang tạo Word document...")
-    create_word_document(pages_data, word_path)
+    create_word_document(pages_data, word_path, engine)
     print(f"   ✅ {word_path}")
     
     # Markdown document
     md_path = os.path.join(output_dir, f"OCR_Result_{timestamp}.md")
     print(f"📝 Đang tạo Markdown...")
-    create_markdown_document(pages_data, md_path)
+    create_markdown_document(pages_data, md_path, engine)
     print(f"   ✅ {md_path}")
     
     # Final message
@@ -0,0 +1,23 @@
+@echo off
+chcp 65001 >nul
+echo.
+echo ========================================
+echo 🔥 QSM - Warm OCR Server
+echo ========================================
+echo.
+
+cd /d "%~dp0"
+
+if not exist "python\venv\Scripts\python.exe" (
+    echo ❌ Python venv not found!
+    echo Please run: python -m venv python\venv
+    pause
+    exit /b 1
+)
+
+echo 🚀 Loading OCR models once - ocr-quick / ocr-images then skip model loading
+echo.
+
+python\venv\Scripts\python.exe scripts\ocr_server.py
+
+pause
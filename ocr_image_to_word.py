@@ -1,27 +1,17 @@
 ﻿import sys, io
 if sys.platform == "win32":
     sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8")
+import os
 from pathlib import Path
-from docling.document_converter import DocumentConverter, PdfFormatOption
-from docling.datamodel.base_models import InputFormat
-from docling.datamodel.pipeline_options import PdfPipelineOptions, EasyOcrOptions
-from docx import Document
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from docx.shared import Pt, Inches
-from docx.enum.style import WD_STYLE_TYPE
-from PIL import Image
-from reportlab.lib.pagesizes import A4, letter
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
-from reportlab.pdfgen import canvas
-from pypdf import PdfWriter
-from ebooklib import epub
 import time
 import re
 import uuid
 
+# Heavy libraries (docling, python-docx, reportlab, ebooklib, PIL) are imported where they are
+# used: with the warm OCR server running, the first result comes back without loading any of them
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts"))
+from ocr_server import OCR_SERVER_URL, OcrServerUnavailable, connect
+
 FORMATS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff"}
 
 def header():
@@ -30,14 +20,29 @@ def header():
     print("="*70)
 
 def setup():
+    from image_preprocess import PreprocessingConverter
+    from ocr_engines import FAST_ENGINE, ACCURATE_ENGINE, TieredOcrConverter, use_tiered
+    from ocr_cache import cached_converter, open_cache
+    
     print("Setting up OCR...")
+    # Deskew / text-height normalization / binarization / margin crop before OCR,
+    # then the OCR cache (keyed by the normalized image, repeated photos skip recognition)
+    if use_tiered():
+        # RapidOCR reads every line, low-confidence lines are re-read by EasyOCR
+        c = TieredOcrConverter(cache=open_cache())
+        print(f"Ready! ({FAST_ENGINE} -> {ACCURATE_ENGINE})\n")
+        return PreprocessingConverter(cached_converter(c, c.options()))
+    
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, EasyOcrOptions
     opts = PdfPipelineOptions()
     opts.do_ocr = True
     opts.do_table_structure = True
     opts.ocr_options = EasyOcrOptions(lang=["vi","en"], force_full_page_ocr=True)
     c = DocumentConverter(format_options={InputFormat.IMAGE: PdfFormatOption(pipeline_options=opts)})
     print("Ready!\n")
-    return c
+    return PreprocessingConverter(cached_converter(c, opts))
 
 def proc(p, c, o):
     """Process single image and return OCR result"""
@@ -54,6 +59,17 @@ def proc(p, c, o):
         t = time.time()
         r = c.convert(str(p))
         print(f"   Done in {time.time()-t:.1f}s")
+        pre = getattr(r, 'preprocess', None)
+        if pre:
+            from image_preprocess import describe
+            print(f"   Preprocess: {describe(pre)}")
+        tiers = getattr(r, 'tiers', None)
+        if tiers:
+            from ocr_engines import describe_tiers
+            print(f"   OCR tiers: {describe_tiers(tiers)}")
+        cache = getattr(r, 'cache', None)
+        if cache and cache['page_hit']:
+            print(f"   Cache hit: recognition skipped (saved {cache['saved']:.1f}s)")
         txt = r.document.export_to_markdown()
         if not txt.strip():
             print("   [!] No text")
@@ -65,8 +81,13 @@ def proc(p, c, o):
             'path': p,
             'text': txt,
             'word_count': len(txt.split()),
-            'time': time.time() - t
+            'time': time.time() - t,
+            'preprocess': pre,
+            'tiers': tiers,
+            'cache': cache
         }
+    except OcrServerUnavailable:
+        raise
     except Exception as e:
         print(f"   [ERROR] {e}")
         return None
@@ -87,6 +108,8 @@ def sort_files_by_page(files):
 
 def create_merged_document(results, output_dir, doc_name="merged_document"):
     """Create merged Word and Markdown from OCR results"""
+    from docx import Document
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
     
     # Sort results by page number
     sorted_results = sorted(results, key=lambda r: extract_page_number(r['path'].stem))
@@ -162,6 +185,8 @@ def create_merged_document(results, output_dir, doc_name="merged_document"):
 
 def create_pdf_from_images(image_paths, output_path):
     """Create PDF from original images (preserving quality)"""
+    from PIL import Image
+    
     try:
         print(f"\n[*] Creating PDF from original images...")
         
@@ -191,6 +216,12 @@ def create_pdf_from_images(image_paths, output_path):
 
 def create_pdf_from_ocr(results, output_path):
     """Create PDF from OCR text content"""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
+    
     try:
         print(f"\n[*] Creating PDF from OCR text...")
         
@@ -290,6 +321,8 @@ def create_pdf_from_ocr(results, output_path):
 
 def create_epub(results, output_path, book_title="OCR Document", author="QSM OCR"):
     """Create EPUB ebook from OCR results"""
+    from ebooklib import epub
+    
     try:
         print(f"\n[*] Creating EPUB ebook...")
         
@@ -408,7 +441,11 @@ def get_files():
 
 def main():
     header()
-    c = setup()
+    c = connect()
+    if c is not None:
+        print(f"Using warm OCR server at {OCR_SERVER_URL}\n")
+    else:
+        c = setup()
     fs = get_files()
     if not fs:
         print("\n[!] No files")
@@ -426,7 +463,12 @@ def main():
     # Process all files and collect results
     results = []
     for f in fs:
-        result = proc(f, c, o)
+        try:
+            result = proc(f, c, o)
+        except OcrServerUnavailable:
+            print("   [!] OCR server stopped, continuing in-process")
+            c = setup()
+            result = proc(f, c, o)
         if result:
             results.append(result)
     
@@ -434,6 +476,27 @@ def main():
     if results:
         print(f"\n{'='*70}")
         print(f"Successfully OCR'd: {len(results)}/{len(fs)} files")
+        if any(r['preprocess'] for r in results):
+            from image_preprocess import PreprocessStats
+            stats = PreprocessStats()
+            for r in results:
+                stats.add(r['preprocess'])
+            for line in stats.report():
+                print(f"Preprocess: {line}")
+        if any(r['tiers'] for r in results):
+            from ocr_engines import TierStats
+            tier_stats = TierStats()
+            for r in results:
+                tier_stats.add(r['tiers'])
+            for line in tier_stats.report():
+                print(f"OCR tiers: {line}")
+        if any(r['cache'] for r in results):
+            from ocr_cache import CacheStats
+            cache_stats = CacheStats()
+            for r in results:
+                cache_stats.add(r['cache'])
+            for line in cache_stats.report():
+                print(f"OCR cache: {line}")
         
         # Ask if user wants merged document
         print("\nCreate merged document? (y/n): ", end='')
@@ -477,6 +540,7 @@ def main():
         
         # Also save individual files
         print(f"\n[*] Saving individual files...")
+        from docx import Document
         for result in results:
             p = result['path']
             txt = result['text']
@@ -0,0 +1,247 @@
+"""
+Batch Cost Planner (--plan)
+===========================
+
+Ước lượng batch TRƯỚC khi chạy (lên lịch cửa sổ ban đêm), thay cho 20 file
+theo tercile + nhân tay trong test_sample_rag:
+- Kiểm kê file còn phải làm -> features (định dạng, MB, số trang, text layer)
+- Phân tầng (stratum) theo định dạng x nhóm dung lượng x text layer
+- Lấy mẫu trong từng tầng: PDF -> vài trang liên tiếp ở vị trí ngẫu nhiên,
+  file Office -> cả file; convert bằng đúng converter/pipeline options của script
+- Ước lượng tỉ số theo tầng (giây / trang, giây / (1 + MB)) -> tổng giờ,
+  dung lượng output, khoảng tin cậy 90%; tầng không có mẫu dùng cost model
+- Mẫu chạy trên 1 worker warm của ConversionPool (timeout, crash không làm
+  hỏng plan); peak RSS của worker -> bộ nhớ đỉnh cho N worker
+"""
+
+import math
+import os
+import random
+from typing import Callable, Dict, List, Optional, Tuple
+
+from conversion_pool import ConversionPool
+
+PLAN_SAMPLE_BUDGET = 40  # Sampled conversions in total
+PLAN_SAMPLE_PAGES = 3  # Consecutive pages per sampled PDF
+PLAN_MIN_PER_STRATUM = 2  # Needed for a variance estimate
+PLAN_SAMPLE_TIMEOUT = 600  # Seconds; a sample that hangs is killed and counted as failed
+SIZE_BUCKETS_MB = (1, 10, 50)
+CONFIDENCE_Z = 1.645  # 90% two-sided
+UNSAMPLED_RELATIVE_ERROR = 0.5  # Assumed +-50% (1 sigma) for strata estimated by the cost model
+
+
+def size_bucket(size_mb: float) -> str:
+    previous = 0
+    for edge in SIZE_BUCKETS_MB:
+        if size_mb < edge:
+            return f"{previous}-{edge}MB"
+        previous = edge
+    return f">={previous}MB"
+
+
+def stratum_key(features: Dict) -> Tuple:
+    text_layer = None
+    if features["ext"] == '.pdf':
+        text_layer = "text" if features["text_layer"] else "scan"
+    return features["ext"], size_bucket(features["size_mb"]), text_layer
+
+
+def work_units(features: Dict) -> float:
+    """What conversion time scales with: pages for PDFs, 1 + MB for other formats"""
+    if features["ext"] == '.pdf':
+        return float(max(features["pages"], 1))
+    return 1.0 + features["size_mb"]
+
+
+def allocate_samples(strata: Dict[Tuple, List[Dict]], weights: Dict[Tuple, float], budget: int) -> Dict[Tuple, int]:
+    """
+    Samples per stratum, proportional to its predicted share of the work
+
+    Every stratum gets PLAN_MIN_PER_STRATUM (heaviest strata first) while the
+    budget lasts, the rest is spread by weight; never more than its file count.
+    """
+    allocation = {key: 0 for key in strata}
+    remaining = budget
+    for key in sorted(strata, key=lambda k: -weights[k]):
+        take = min(PLAN_MIN_PER_STRATUM, len(strata[key]), remaining)
+        allocation[key] = take
+        remaining -= take
+
+    total_weight = sum(weights.values()) or 1.0
+    while remaining > 0:
+        open_keys = [k for k in strata if allocation[k] < len(strata[k])]
+        if not open_keys:
+            break
+        # Largest weight per sample already taken
+        key = max(open_keys, key=lambda k: weights[k] / total_weight / (allocation[k] + 1))
+        allocation[key] += 1
+        remaining -= 1
+    return allocation
+
+
+def _ratio_estimate(samples: List[Tuple[float, float]], population_units: float,
+                    population_count: int) -> Tuple[float, float]:
+    """
+    Stratified ratio estimator: total = (sum y / sum u) * U
+
+    Returns:
+        (estimated total, variance of the estimate)
+    """
+    n = len(samples)
+    sum_u = sum(u for u, _ in samples)
+    ratio = sum(y for _, y in samples) / sum_u if sum_u else 0.0
+    total = ratio * population_units
+    if n < 2:
+        return total, (UNSAMPLED_RELATIVE_ERROR * total) ** 2
+    mean_u = sum_u / n
+    residual_var = sum((y - ratio * u) ** 2 for u, y in samples) / (n - 1)
+    fpc = max(0.0, 1 - n / population_count) if population_count else 1.0
+    ratio_var = fpc * residual_var / (n * mean_u ** 2)
+    return total, population_units ** 2 * ratio_var
+
+
+def run_plan(inventory: List[Dict], setup_fn: Callable, sample_task_fn: Callable, model, workers: int,
+             budget: int = PLAN_SAMPLE_BUDGET, seed: Optional[int] = None,
+             prepare_fn: Optional[Callable[[Dict], None]] = None,
+             cleanup_fn: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """
+    Sample the inventory on one warm pool worker and project the batch
+
+    Args:
+        inventory: document_features() dicts with a 'path' key, for files still to convert
+        setup_fn / sample_task_fn: the script's ConversionPool functions; sample_task_fn(task,
+            converter) converts task['path'] (only task['page_range'] when set) with the real
+            pipeline options and returns {'success': True, 'bytes': markdown bytes}
+        model: CostModel, for weights and for strata without samples
+        prepare_fn / cleanup_fn: optional parent-side hooks around each task
+            (e.g. LibreOffice upgrade of legacy files)
+
+    Returns:
+        Plan dict (see print_plan)
+    """
+    rng = random.Random(seed)
+    strata = {}
+    for features in inventory:
+        strata.setdefault(stratum_key(features), []).append(features)
+    weights = {key: sum(model.predict(f) for f in items) for key, items in strata.items()}
+    allocation = allocate_samples(strata, weights, budget)
+
+    tasks = []
+    warmed = set()
+    for key, items in sorted(strata.items(), key=lambda kv: -weights[kv[0]]):
+        for features in rng.sample(items, allocation[key]):
+            page_range = None
+            if features["ext"] == '.pdf' and features["pages"] > PLAN_SAMPLE_PAGES:
+                first = rng.randint(1, features["pages"] - PLAN_SAMPLE_PAGES + 1)
+                page_range = (first, first + PLAN_SAMPLE_PAGES - 1)
+            units = (page_range[1] - page_range[0] + 1) if page_range else work_units(features)
+            group = (features["ext"], key[2])
+            if group not in warmed:
+                # First conversion of a pipeline pays for model loading: run it untimed
+                warmed.add(group)
+                tasks.append({"path": features["path"], "stratum": key, "warmup": True,
+                              "page_range": (1, 1) if features["ext"] == '.pdf' else None})
+            tasks.append({"path": features["path"], "stratum": key, "units": units, "page_range": page_range})
+
+    # Single worker, FIFO: warm-ups run right before the samples that need them
+    samples = {key: [] for key in strata}
+    failures = 0
+    with ConversionPool(setup_fn, sample_task_fn, 1) as pool:
+        for task in tasks:
+            task["timeout"] = PLAN_SAMPLE_TIMEOUT
+            if prepare_fn is not None:
+                prepare_fn(task)
+            pool.submit(task)
+
+        for task, result in pool.run():
+            if cleanup_fn is not None:
+                cleanup_fn(task)
+            name = os.path.basename(task["path"])
+            if not result.get("success"):
+                failures += 1
+                print(f"  sample failed: {name}: {result.get('error')}")
+                continue
+            if task.get("warmup"):
+                continue
+            samples[task["stratum"]].append((task["units"], result["elapsed"], result["bytes"]))
+            ext, bucket, text_layer = task["stratum"]
+            page_range = task["page_range"]
+            print(f"  [{ext} {bucket}{' ' + text_layer if text_layer else ''}] {name}"
+                  f"{f' pages {page_range[0]}-{page_range[1]}' if page_range else ''}: {result['elapsed']:.1f}s")
+        peak_rss = pool.peak_rss()
+
+    rows = []
+    for key, items in strata.items():
+        population_units = sum(work_units(f) for f in items)
+        timing_samples = [(u, seconds) for u, seconds, _ in samples[key]]
+        if timing_samples:
+            seconds, seconds_var = _ratio_estimate(timing_samples, population_units, len(items))
+            out_bytes, out_var = _ratio_estimate([(u, b) for u, _, b in samples[key]],
+                                                 population_units, len(items))
+            longest = seconds / population_units * max(work_units(f) for f in items)
+            source = f"{len(timing_samples)} sampled"
+        else:
+            seconds = weights[key]
+            seconds_var = (UNSAMPLED_RELATIVE_ERROR * seconds) ** 2
+            out_bytes, out_var = None, None
+            longest = max(model.predict(f) for f in items)
+            source = "cost model"
+        rows.append({
+            "stratum": key, "files": len(items), "units": population_units,
+            "seconds": seconds, "seconds_var": seconds_var,
+            "output_bytes": out_bytes, "output_var": out_var, "source": source,
+            "longest": longest,
+        })
+
+    # Strata without output samples: bytes per unit of the sampled strata
+    sampled = [r for r in rows if r["output_bytes"] is not None]
+    bytes_per_unit = (sum(r["output_bytes"] for r in sampled) / sum(r["units"] for r in sampled)
+                      if sampled else 0.0)
+    for r in rows:
+        if r["output_bytes"] is None:
+            r["output_bytes"] = bytes_per_unit * r["units"]
+            r["output_var"] = (UNSAMPLED_RELATIVE_ERROR * r["output_bytes"]) ** 2
+
+    total_seconds = sum(r["seconds"] for r in rows)
+    total_sd = math.sqrt(sum(r["seconds_var"] for r in rows))
+    total_bytes = sum(r["output_bytes"] for r in rows)
+    bytes_sd = math.sqrt(sum(r["output_var"] for r in rows))
+    longest = max((r["longest"] for r in rows), default=0.0)
+    return {
+        "files": len(inventory), "workers": workers, "rows": rows, "failures": failures,
+        "worker_seconds": (total_seconds, max(total_seconds - CONFIDENCE_Z * total_sd, 0.0),
+                           total_seconds + CONFIDENCE_Z * total_sd),
+        # Wall clock can't beat the single longest document (unless it is sharded)
+        "wall_seconds": tuple(max(s / max(workers, 1), longest) for s in (
+            total_seconds, max(total_seconds - CONFIDENCE_Z * total_sd, 0.0), total_seconds + CONFIDENCE_Z * total_sd)),
+        "output_bytes": (total_bytes, max(total_bytes - CONFIDENCE_Z * bytes_sd, 0.0),
+                         total_bytes + CONFIDENCE_Z * bytes_sd),
+        "peak_rss": peak_rss,
+    }
+
+
+def print_plan(plan: Dict, parent_rss_mb: float = 300.0):
+    """Projection table + totals with 90% confidence intervals"""
+    print(f"{'stratum':<30}{'files':>7}{'units':>9}{'hours':>9}{'+-90%':>8}  source")
+    for r in sorted(plan["rows"], key=lambda r: -r["seconds"]):
+        ext, bucket, text_layer = r["stratum"]
+        name = f"{ext} {bucket}" + (f" {text_layer}" if text_layer else "")
+        ci = CONFIDENCE_Z * math.sqrt(r["seconds_var"]) / 3600
+        print(f"{name:<30}{r['files']:>7}{r['units']:>9.0f}{r['seconds'] / 3600:>9.2f}{ci:>8.2f}  {r['source']}")
+    print()
+
+    worker_s, worker_lo, worker_hi = plan["worker_seconds"]
+    wall_s, wall_lo, wall_hi = plan["wall_seconds"]
+    out_b, out_lo, out_hi = plan["output_bytes"]
+    print(f"Documents to convert: {plan['files']}" +
+          (f" ({plan['failures']} samples failed)" if plan["failures"] else ""))
+    print(f"Worker time: {worker_s / 3600:.1f} h (90% CI {worker_lo / 3600:.1f} - {worker_hi / 3600:.1f} h)")
+    print(f"Wall clock with {plan['workers']} workers: {wall_s / 3600:.1f} h "
+          f"(90% CI {wall_lo / 3600:.1f} - {wall_hi / 3600:.1f} h)")
+    print(f"Markdown output: {out_b / 1024 ** 2:.0f} MB (90% CI {out_lo / 1024 ** 2:.0f} - {out_hi / 1024 ** 2:.0f} MB)")
+    if plan["peak_rss"]:
+        worker_mb = plan["peak_rss"] / 1024 ** 2
+        print(f"Peak memory: {worker_mb:.0f} MB per worker (sampling worker) -> "
+              f"~{(worker_mb * plan['workers'] + parent_rss_mb) / 1024:.1f} GB for {plan['workers']} workers")
+    else:
+        print("Peak memory: n/a (pip install psutil)")
@@ -4,20 +4,26 @@ Batch RAG Processing for All Documents
 
 Xử lý toàn bộ PDFs trong Documents folder với Docling
 - GPU acceleration
-- Progress tracking with resume capability
+- Process pool: mỗi worker một converter riêng (warm), scale theo số core
+- PDF lớn được chia theo đoạn trang cho nhiều worker, ghép lại theo thứ tự
+- Cost model dự đoán thời gian mỗi file -> việc nặng được phát trước (LJF)
+- Pre-pass text layer từng trang: chỉ full-page OCR các trang scan
+- Timeout cứng mỗi file/shard theo số trang, file treo/crash lặp lại -> quarantine
+- Progress tracking with resume capability (SQLite journal, commit mỗi file)
 - Error handling and logging
 - Output: Markdown files cùng folder với source PDF
 """
 
 import os
 import sys
-import json
 import time
+import argparse
+import threading
 import warnings
 from pathlib import Path
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 # Suppress pin_memory warning from PyTorch
 warnings.filterwarnings('ignore', message='.*pin_memory.*')
@@ -28,20 +34,91 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'python'))
 try:
     from docling.document_converter import DocumentConverter, PdfFormatOption
     from docling.datamodel.base_models import InputFormat
-    from docling.datamodel.pipeline_options import PdfPipelineOptions
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, EasyOcrOptions
     from docling.backend.pypdfium2_backend import PyPdfiumDocumentBackend
 except ImportError:
     print("❌ ERROR: Docling not installed!")
     print("Run: D:\\Work\\Coding\\QSM\\python\\venv\\Scripts\\pip.exe install docling")
     sys.exit(1)
 
+from conversion_pool import INTERACTIVE, ConversionPool
+from document_scanner import scan_documents
+from progress_journal import ProgressJournal
+from pdf_sharding import (should_shard, build_shard_tasks, get_pdf_page_count,
+                          register_sharded_file, record_shard_result)
+from cost_model import CostModel, build_cost_model, document_features, document_timeout
+from text_layer import PageRoutedConverter, summarize_decisions, log_page_decisions
+from streaming_export import STREAM_MIN_PAGES, export_streaming
+from conversion_metrics import StageMetrics, enable_pipeline_timings, export_markdown, measure
+from batch_planner import PLAN_SAMPLE_BUDGET, print_plan, run_plan
+from dedup import DuplicateIndex, canonical_order, get_signature, link_duplicate, load_index, report_near_duplicate
+from interactive_lane import INTERACTIVE_LATENCY_TARGET, InteractiveSpool
+
 # Configuration
 DOCUMENTS_ROOT = r"D:\Work\Coding\archi-query-master\Documents"
-PROGRESS_FILE = r"D:\Work\Coding\QSM\batch_rag_progress.json"
+PROGRESS_FILE = r"D:\Work\Coding\QSM\batch_rag_progress.json"  # Legacy, imported once
+PROGRESS_DB = r"D:\Work\Coding\QSM\batch_rag_progress.db"
 ERROR_LOG = r"D:\Work\Coding\QSM\batch_rag_errors.log"
-MAX_WORKERS = 4  # Parallel processing threads
+EXECUTION_MODE = "process"  # "process" = mỗi worker một converter, "thread" = dùng chung 1 converter
+MAX_WORKERS = 4  # Parallel processing threads (thread mode)
+THREADS_PER_WORKER = 2  # Torch threads per worker process (process mode)
+PROCESS_WORKERS = max(1, (os.cpu_count() or 4) // THREADS_PER_WORKER)
+RECYCLE_AFTER_DOCS = 100  # Replace a worker after this many files/shards (process mode)
+WORKER_RSS_LIMIT_MB = 4096  # Recycle a worker above this RSS; mid-file the file is re-queued
+
+# Hard wall-clock limit per file / shard (process mode): base + per page / MB, and at least
+# DOC_TIMEOUT_FACTOR x the cost model's prediction. The worker is killed on timeout.
+DOC_TIMEOUT_BASE = 120
+DOC_TIMEOUT_PER_PAGE = 20
+DOC_TIMEOUT_PER_MB = 10
+DOC_TIMEOUT_FACTOR = 5
+QUARANTINE_AFTER = 2  # Timeouts / worker crashes before a PDF is skipped by later runs
 SKIP_EXISTING = True  # Skip if .md file already exists
 
+# Page-range sharding (process mode): split big PDFs across workers
+SHARDING_ENABLED = True
+SHARD_MIN_PAGES = 60  # Shard PDFs with >= this many pages
+SHARD_MIN_BYTES = 50 * 1024 * 1024  # ...or >= this many bytes
+SHARD_PAGES = 25  # Pages per shard
+
+# Per-page OCR routing: born-digital pages use their text layer, scanned pages get full OCR
+PAGE_OCR_ROUTING = True
+PAGE_DECISION_LOG = r"D:\Work\Coding\QSM\batch_rag_page_ocr.jsonl"
+# Scanned pages (needs PAGE_OCR_ROUTING): rendered at a DPI normalized to the text height,
+# deskewed, binarized and margin-cropped before OCR (image_preprocess.py) instead of the
+# fixed images_scale; per-step times show up as preprocess_* stages in the metrics
+PREPROCESS_SCANS = True
+
+# Streaming export (opt-in, e.g. 10): PDFs / shards with >= STREAM_MIN_PAGES pages are converted
+# this many pages at a time and appended to the .md, so memory stays flat. The .md then differs
+# from a whole-document export at chunk boundaries (a table spanning two chunks comes out as two
+# tables, see pdf_sharding.py): only turn it on when workers run out of memory. None = whole document
+STREAM_EXPORT_PAGES = None
+PAGE_CHECKPOINTS = True  # Keep streamed pages on disk ({output}.partial/.ckpt) so interrupted PDFs resume mid-file
+
+# Per-stage timings (Docling pipeline profiling): JSONL event per file/shard + Prometheus textfile
+STAGE_METRICS = True
+METRICS_LOG = r"D:\Work\Coding\QSM\batch_rag_metrics.jsonl"
+METRICS_PROM = r"D:\Work\Coding\QSM\batch_rag_documents.prom"  # node_exporter textfile collector dir
+
+# Duplicate elimination before conversion: identical files (SHA-256) and near-duplicates
+# (MinHash of the text layer, perceptual hash of page images for scans) get a link to the
+# canonical copy's .md instead of a conversion; groups go to document_duplicates in PROGRESS_DB.
+# Near-duplicates with another page count / file size are only reported (see dedup.py)
+DEDUP = True
+DEDUP_NEAR = True  # False = exact duplicates only (no text extraction / rendering)
+
+# Interactive lane: single PDFs sent by DoclingService.processDocument (interactive_lane.py)
+# while the batch runs skip the bulk queue - a reserved warm worker in process mode,
+# a dedicated thread on the shared converter in thread mode
+INTERACTIVE_LANE = True
+INTERACTIVE_SPOOL = r"D:\Work\Coding\QSM\interactive_spool"
+RESERVED_INTERACTIVE_WORKERS = 1  # Taken from PROCESS_WORKERS, never given bulk work
+
+# Longest-job-first ordering from the cost model (process mode)
+LONGEST_JOB_FIRST = True
+SAMPLE_RESULTS_FILE = r"D:\Work\Coding\QSM\sample_test_results.json"  # Extra timings for calibration
+
 # Statistics
 stats = {
     "total_files": 0,
@@ -52,36 +129,38 @@ stats = {
     "estimated_time_remaining": 0
 }
 
-def setup_docling_converter():
-    """Setup Docling with Vietnamese OCR optimization"""
-    print("⚙️  Setting up Docling converter...")
-    print("   OCR Engine: EasyOCR (Vietnamese + English)")
-    print("   Mode: CPU (AMD RX 580)")
-    print("   Image Scale: 2.5x (high quality)")
-    print()
-    
+# Per-stage timings of this run (JSONL / Prometheus paths set in main)
+stage_metrics = StageMetrics()
+
+def build_ocr_options(force_full_page_ocr: bool) -> PdfPipelineOptions:
+    """Pipeline options with Vietnamese EasyOCR settings"""
     # Configure pipeline for Vietnamese documents
     pipeline_options = PdfPipelineOptions()
     pipeline_options.do_ocr = True
     pipeline_options.do_table_structure = True
     
     # EasyOCR options for Vietnamese
-    from docling.datamodel.pipeline_options import EasyOcrOptions
     easyocr_options = EasyOcrOptions(
         lang=["vi", "en"],  # Vietnamese + English
         use_gpu=False,  # AMD RX 580 not supported
-        force_full_page_ocr=True,
+        force_full_page_ocr=force_full_page_ocr,
         confidence_threshold=0.5,
-        bitmap_area_threshold=0.05,
+        bitmap_area_threshold=0.05,  # Without forced OCR: only image regions >= 5% of the page
         download_enabled=True
     )
     pipeline_options.ocr_options = easyocr_options
+    return pipeline_options
+
+def build_pdf_converter(force_full_page_ocr: bool) -> DocumentConverter:
+    """Docling PDF converter with Vietnamese EasyOCR settings"""
+    pipeline_options = build_ocr_options(force_full_page_ocr)
     
-    # Image quality
-    pipeline_options.images_scale = 2.5
+    # Image quality (page images are not used by the markdown export; with
+    # PREPROCESS_SCANS scanned pages are rendered by image_preprocess instead)
+    pipeline_options.images_scale = 1.0 if PAGE_OCR_ROUTING and PREPROCESS_SCANS else 2.5
     pipeline_options.generate_page_images = True
     
-    converter = DocumentConverter(
+    return DocumentConverter(
         format_options={
             InputFormat.PDF: PdfFormatOption(
                 pipeline_options=pipeline_options,
@@ -89,35 +168,64 @@ def setup_docling_converter():
             )
         }
     )
+
+def build_scan_converter() -> DocumentConverter:
+    """Image converter for preprocessed scanned pages (full-page OCR)"""
+    return DocumentConverter(
+        format_options={
+            InputFormat.IMAGE: PdfFormatOption(pipeline_options=build_ocr_options(force_full_page_ocr=True))
+        }
+    )
+
+def setup_docling_converter(verbose: bool = True):
+    """Setup Docling with Vietnamese OCR optimization"""
+    if verbose:
+        print("⚙️  Setting up Docling converter...")
+        print("   OCR Engine: EasyOCR (Vietnamese + English)")
+        print("   Mode: CPU (AMD RX 580)")
+        if PAGE_OCR_ROUTING:
+            print("   Full-page OCR: scanned pages only (text-layer pre-pass)")
+        if PAGE_OCR_ROUTING and PREPROCESS_SCANS:
+            print("   Scans: text-height DPI, deskew, binarize, margin crop")
+        else:
+            print("   Image Scale: 2.5x (high quality)")
+        print()
+    
+    if STAGE_METRICS:
+        enable_pipeline_timings()
+    
+    ocr_converter = build_pdf_converter(force_full_page_ocr=True)
+    if PAGE_OCR_ROUTING:
+        converter = PageRoutedConverter(build_pdf_converter(force_full_page_ocr=False), ocr_converter,
+                                        build_scan_converter() if PREPROCESS_SCANS else None)
+    else:
+        converter = ocr_converter
     
-    print("✅ Docling converter ready with Vietnamese OCR optimization")
+    if verbose:
+        print("✅ Docling converter ready with Vietnamese OCR optimization")
     return converter
 
-def load_progress() -> Dict:
-    """Load processing progress from checkpoint"""
-    if os.path.exists(PROGRESS_FILE):
-        try:
-            with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                progress = json.load(f)
-                print(f"📋 Loaded progress: {len(progress['completed'])} files already processed")
-                return progress
-        except Exception as e:
-            print(f"⚠️  Could not load progress: {e}")
-    
-    return {
-        "completed": [],
-        "failed": [],
-        "last_updated": None
-    }
+def setup_worker_converter():
+    """Build the converter inside a worker process (process mode)"""
+    try:
+        import torch
+        torch.set_num_threads(THREADS_PER_WORKER)
+    except ImportError:
+        pass
+    return setup_docling_converter(verbose=False)
 
-def save_progress(progress: Dict):
-    """Save processing progress"""
-    progress["last_updated"] = datetime.now().isoformat()
+def load_progress() -> ProgressJournal:
+    """Open the progress journal (imports the old JSON progress file once)"""
+    progress = ProgressJournal(PROGRESS_DB)
     try:
-        with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(progress, f, indent=2, ensure_ascii=False)
+        imported = progress.import_json(PROGRESS_FILE)
+        if imported:
+            print(f"📋 Imported {imported} entries from {PROGRESS_FILE}")
     except Exception as e:
-        print(f"⚠️  Could not save progress: {e}")
+        print(f"⚠️  Could not import JSON progress: {e}")
+    
+    print(f"📋 Loaded progress: {progress.count('completed')} files already processed")
+    return progress
 
 def log_error(pdf_path: str, error: str):
     """Log processing errors"""
@@ -134,7 +242,121 @@ def get_output_path(pdf_path: str) -> str:
     pdf_file = Path(pdf_path)
     return str(pdf_file.with_suffix('.md'))
 
-def process_single_pdf(pdf_path: str, converter: DocumentConverter, progress: Dict) -> Tuple[bool, str]:
+def convert_to_markdown(pdf_path: str, converter, page_range: Optional[Tuple[int, int]] = None):
+    """
+    Convert a PDF (or one page range of it) to markdown
+    
+    Returns:
+        (markdown, per-page OCR decisions or None without page routing)
+    """
+    if isinstance(converter, PageRoutedConverter):
+        return converter.convert_to_markdown(pdf_path, page_range)
+    
+    if page_range is None:
+        result = converter.convert(pdf_path)
+    else:
+        result = converter.convert(pdf_path, page_range=page_range)
+    return export_markdown(result), None
+
+def write_markdown(pdf_path: str, converter, output_path: str,
+                   page_range: Optional[Tuple[int, int]] = None) -> Optional[List[Dict]]:
+    """
+    Convert a PDF (or page range) into output_path, streaming long ranges chunk by chunk
+    
+    Returns:
+        Per-page OCR decisions (None without page routing)
+    """
+    first, last = page_range or (1, get_pdf_page_count(pdf_path) or 0)
+    if not STREAM_EXPORT_PAGES or last - first + 1 < STREAM_MIN_PAGES:
+        markdown_content, decisions = convert_to_markdown(pdf_path, converter, page_range)
+        # Replace, never write in place: output_path may be a hard link shared with a duplicate (dedup.py)
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(markdown_content)
+        os.replace(tmp_path, output_path)
+        return decisions
+    
+    decisions = []
+    
+    def convert_chunk(chunk_range):
+        nonlocal decisions
+        markdown_content, chunk_decisions = convert_to_markdown(pdf_path, converter, chunk_range)
+        if chunk_decisions is None:
+            decisions = None
+        elif decisions is not None:
+            decisions.extend(chunk_decisions)
+        return markdown_content
+    
+    export_streaming(convert_chunk, output_path, first, last, STREAM_EXPORT_PAGES,
+                     source_path=pdf_path if PAGE_CHECKPOINTS else None)
+    return decisions
+
+def convert_pdf(pdf_path: str, converter, output_path: Optional[str] = None) -> Tuple[float, Optional[List[Dict]]]:
+    """Convert one PDF and write markdown next to it. Returns (elapsed seconds, page decisions)."""
+    start_time = time.time()
+    decisions = write_markdown(pdf_path, converter, output_path or get_output_path(pdf_path))
+    return time.time() - start_time, decisions
+
+def convert_pdf_shard(task: Dict, converter) -> Tuple[float, Optional[List[Dict]]]:
+    """Convert one page range of a PDF into its temporary part file"""
+    start_time = time.time()
+    decisions = write_markdown(task['path'], converter, task['part_path'], task['page_range'])
+    return time.time() - start_time, decisions
+
+def convert_pdf_task(task: Dict, converter) -> Dict:
+    """Worker-side task for ConversionPool (progress is updated by the parent)"""
+    with measure(task['path'], task.get('page_range')) as metrics:
+        if 'page_range' in task:
+            elapsed, decisions = convert_pdf_shard(task, converter)
+        else:
+            elapsed, decisions = convert_pdf(task['path'], converter, task.get('output_path'))
+    output_path = task.get('part_path') or task.get('output_path') or get_output_path(task['path'])
+    return {"success": True, "elapsed": elapsed, "page_decisions": decisions,
+            "metrics": metrics.event("docling", elapsed, output_path)}
+
+def report_page_decisions(pdf_path: str, decisions: Optional[List[Dict]]) -> str:
+    """Log per-page OCR decisions and return the one-line summary"""
+    if not PAGE_OCR_ROUTING:
+        return ""
+    log_page_decisions(PAGE_DECISION_LOG, pdf_path, decisions)
+    return summarize_decisions(decisions)
+
+def build_pdf_tasks(pdf_path: str, shard_state: Dict, model: CostModel) -> List[Dict]:
+    """
+    One task per PDF, or one task per page range for big PDFs
+    
+    Every task carries the predicted seconds for the whole file ('file_predicted')
+    and for its own share of pages ('predicted', used as the dispatch priority).
+    """
+    features = document_features(pdf_path)
+    predicted = model.predict(features)
+    page_count = features['pages'] or None
+    
+    tasks = [{'path': pdf_path}]
+    if SHARDING_ENABLED:
+        size_bytes = int(features['size_mb'] * 1024 * 1024)
+        if should_shard(page_count, size_bytes, SHARD_MIN_PAGES, SHARD_MIN_BYTES, SHARD_PAGES):
+            output_path = get_output_path(pdf_path)
+            tasks = build_shard_tasks(pdf_path, output_path, page_count, SHARD_PAGES)
+            tasks = register_sharded_file(shard_state, pdf_path, output_path, tasks, PAGE_CHECKPOINTS)
+    
+    for task in tasks:
+        task['file_predicted'] = predicted
+        task_features = features
+        if 'page_range' in task:
+            first, last = task['page_range']
+            share = (last - first + 1) / page_count
+            task['predicted'] = predicted * share
+            task_features = dict(features, pages=last - first + 1, size_mb=features['size_mb'] * share)
+        else:
+            task['predicted'] = predicted
+        if LONGEST_JOB_FIRST:
+            task['priority'] = task['predicted']
+        task['timeout'] = document_timeout(task_features, task['predicted'], DOC_TIMEOUT_BASE,
+                                           DOC_TIMEOUT_PER_PAGE, DOC_TIMEOUT_PER_MB, DOC_TIMEOUT_FACTOR)
+    return tasks
+
+def process_single_pdf(pdf_path: str, converter, progress: ProgressJournal) -> Tuple[bool, str]:
     """
     Process a single PDF file
     
@@ -144,59 +366,109 @@ def process_single_pdf(pdf_path: str, converter: DocumentConverter, progress: Di
     pdf_name = os.path.basename(pdf_path)
     
     # Check if already completed
-    if pdf_path in progress['completed']:
+    if progress.is_completed(pdf_path):
         return True, f"Already processed: {pdf_name}"
     
     # Check if output already exists
     output_path = get_output_path(pdf_path)
     if SKIP_EXISTING and os.path.exists(output_path):
-        progress['completed'].append(pdf_path)
+        progress.mark_completed(pdf_path)
         return True, f"Output exists, skipped: {pdf_name}"
     
     try:
-        start_time = time.time()
+        with measure(pdf_path) as metrics:
+            elapsed, decisions = convert_pdf(pdf_path, converter)
+        stage_metrics.add(metrics.event("docling", elapsed, output_path))
         
-        # Convert PDF to markdown
-        result = converter.convert(pdf_path)
+        # Update progress (one committed row per file)
+        progress.mark_completed(pdf_path, elapsed=elapsed)
         
-        # Export to markdown
-        markdown_content = result.document.export_to_markdown()
-        
-        # Save to file (same folder as PDF)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
-        
-        elapsed = time.time() - start_time
-        
-        # Update progress
-        progress['completed'].append(pdf_path)
-        
-        return True, f"✅ Processed {pdf_name} ({elapsed:.1f}s)"
+        pages = report_page_decisions(pdf_path, decisions)
+        return True, f"✅ Processed {pdf_name} ({elapsed:.1f}s)" + (f" - {pages}" if pages else "")
         
     except Exception as e:
         error_msg = str(e)
-        progress['failed'].append(pdf_path)
+        progress.mark_failed(pdf_path, error_msg)
         log_error(pdf_path, error_msg)
         return False, f"❌ Failed {pdf_name}: {error_msg}"
 
+def report_duplicate(pdf_path: str, match: Dict, progress: ProgressJournal) -> bool:
+    """Link a duplicate to its canonical's .md. False if that output is missing."""
+    mode = link_duplicate(pdf_path, match, progress, get_output_path)
+    if mode is None:
+        return False
+    print(f"🔗 Duplicate {os.path.basename(pdf_path)} -> {match['canonical']} "
+          f"({match['detection_type']} {match['score']:.2f}, {mode})")
+    return True
+
+def claim_pdf(pdf: str, signature: Optional[Dict], progress: ProgressJournal, index: DuplicateIndex,
+              counts: Dict) -> bool:
+    """
+    Dedup one PDF against the index (counts: 'linked', 'waiting', 'similar' totals)
+    
+    Returns:
+        True if the PDF has to be converted
+    """
+    if signature is None:
+        return True
+    match = index.claim(pdf, signature)
+    if match is None:
+        return True
+    if not match['link']:
+        # Similar but not safe to share output (other pages / size): converted, reported for review
+        report_near_duplicate(pdf, match, progress)
+        counts['similar'] += 1
+        return True
+    if not match['ready']:
+        counts['waiting'] += 1
+        return False
+    if report_duplicate(pdf, match, progress):
+        counts['linked'] += 1
+        return False
+    # Canonical output is gone: this copy takes its place
+    index.remove(match['canonical'])
+    index.add(pdf, signature)
+    return True
+
+def print_dedup_counts(counts: Dict):
+    print(f"   Duplicates: {counts['linked']} linked, {counts['waiting']} linked once their canonical "
+          f"is converted, {counts['similar']} similar (converted, recorded for review)\n")
+
+def dedup_remaining(remaining: List[str], progress: ProgressJournal, index: DuplicateIndex) -> List[str]:
+    """
+    Dedup stage: keep one canonical per duplicate group
+    
+    The best copy (text layer, then largest file) becomes canonical. Copies of an
+    already converted PDF are linked now, the others wait in the index until
+    their canonical finishes (see resolve in the batch loops).
+    
+    Returns:
+        PDFs to convert, in their original order
+    """
+    print(f"🧬 Checking {len(remaining)} PDFs for duplicates ({len(index)} converted PDFs indexed)...")
+    signatures = {pdf: get_signature(pdf, progress, near=DEDUP_NEAR) for pdf in remaining}
+    convert = {pdf for pdf, signature in signatures.items() if signature is None}
+    counts = {'linked': 0, 'waiting': 0, 'similar': 0}
+    for pdf in canonical_order([p for p in remaining if p not in convert], signatures):
+        if claim_pdf(pdf, signatures[pdf], progress, index, counts):
+            convert.add(pdf)
+    print_dedup_counts(counts)
+    return [pdf for pdf in remaining if pdf in convert]
+
 def find_all_pdfs(root_dir: str) -> List[str]:
     """Find all PDF files recursively"""
     print(f"🔍 Scanning for PDFs in {root_dir}...")
     
-    pdf_files = []
-    for root, dirs, files in os.walk(root_dir):
-        for file in files:
-            if file.lower().endswith('.pdf'):
-                pdf_files.append(os.path.join(root, file))
+    pdf_files = [path for path, _ in scan_documents(root_dir, {'.pdf'})]
     
     print(f"📚 Found {len(pdf_files)} PDF files")
     return pdf_files
 
-def update_stats(pdf_files: List[str], progress: Dict, start_time: float):
+def update_stats(pdf_files: List[str], progress: ProgressJournal, start_time: float):
     """Update and display statistics"""
     stats["total_files"] = len(pdf_files)
-    stats["processed"] = len(progress['completed'])
-    stats["errors"] = len(progress['failed'])
+    stats["errors"] = progress.count('failed')
+    stats["processed"] = progress.count('completed') + stats["errors"]
     stats["skipped"] = stats["processed"] - stats["errors"]
     
     elapsed = time.time() - start_time
@@ -220,15 +492,59 @@ def update_stats(pdf_files: List[str], progress: Dict, start_time: float):
     
     print(f"{'='*80}\n")
 
-def batch_process_pdfs(pdf_files: List[str], converter: DocumentConverter, progress: Dict):
+def interactive_task(request: Dict, model: Optional[CostModel]) -> Dict:
+    """Pool task for one interactive request: whole file, never sharded, result into the spool"""
+    features = document_features(request['path'])
+    predicted = model.predict(features) if model is not None else 0.0
+    return {'path': request['path'], 'lane': INTERACTIVE, 'request': request,
+            'output_path': request['output_path'],
+            'timeout': document_timeout(features, predicted, DOC_TIMEOUT_BASE, DOC_TIMEOUT_PER_PAGE,
+                                        DOC_TIMEOUT_PER_MB, DOC_TIMEOUT_FACTOR)}
+
+def finish_interactive(spool: InteractiveSpool, request: Dict, result: Dict):
+    """Hand the result to the waiting client (the batch journal is not touched)"""
+    if result.get('success'):
+        result['pages'] = (result['metrics']['pages'] if result.get('metrics')
+                           else get_pdf_page_count(request['path']))
+        result['route'] = 'docling'
+    latency = spool.complete(request, result)
+    pdf_name = os.path.basename(request['path'])
+    status = f"{result['elapsed']:.1f}s" if result.get('success') else f"failed: {result['error'][:80]}"
+    late = "" if latency <= INTERACTIVE_LATENCY_TARGET else f" ⚠️ over the {INTERACTIVE_LATENCY_TARGET:.0f}s target"
+    print(f"⚡ Interactive {pdf_name} ({status}), answered {latency:.1f}s after the request{late}")
+
+def start_interactive_spool(on_request, workers: int, reserved: int) -> Optional[InteractiveSpool]:
+    if not INTERACTIVE_LANE:
+        return None
+    spool = InteractiveSpool(INTERACTIVE_SPOOL, on_request,
+                             {"script": "batch_rag_documents", "workers": workers, "reserved": reserved,
+                              "extensions": [".pdf"]}).start()
+    print(f"   ⚡ Interactive lane: {INTERACTIVE_SPOOL} (target {INTERACTIVE_LATENCY_TARGET:.0f}s)\n")
+    return spool
+
+def print_interactive_report(spool: Optional[InteractiveSpool]):
+    if spool is None:
+        return
+    print("⚡ Interactive lane:")
+    for line in spool.report():
+        print(f"   {line}")
+    print()
+
+def batch_process_pdfs(pdf_files: List[str], converter, progress: ProgressJournal,
+                       index: Optional[DuplicateIndex] = None):
     """
     Process PDFs in parallel with progress tracking
     """
     start_time = time.time()
     stats["start_time"] = start_time
     
-    # Filter out already completed
-    remaining = [pdf for pdf in pdf_files if pdf not in progress['completed']]
+    # Filter out already completed / quarantined (no hard timeouts in thread mode)
+    quarantined = progress.quarantined_paths()
+    remaining = [p for p in progress.filter_remaining(pdf_files) if p not in quarantined]
+    
+    already_done = len(pdf_files) - len(remaining)
+    if index is not None and remaining:
+        remaining = dedup_remaining(remaining, progress, index)
     
     if not remaining:
         print("✅ All files already processed!")
@@ -236,43 +552,301 @@ def batch_process_pdfs(pdf_files: List[str], converter: DocumentConverter, progr
     
     print(f"\n🚀 Starting batch processing...")
     print(f"   Total PDFs: {len(pdf_files)}")
-    print(f"   Already done: {len(progress['completed'])}")
+    print(f"   Already done: {already_done}")
+    if len(pdf_files) - len(remaining) > already_done:
+        print(f"   Duplicates: {len(pdf_files) - len(remaining) - already_done}")
     print(f"   Remaining: {len(remaining)}")
     print(f"   Parallel workers: {MAX_WORKERS}")
     print(f"   GPU acceleration: ENABLED\n")
     
-    # Process with thread pool
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submit all tasks
-        future_to_pdf = {
-            executor.submit(process_single_pdf, pdf, converter, progress): pdf
-            for pdf in remaining
-        }
-        
-        # Process results as they complete
-        for future in as_completed(future_to_pdf):
-            pdf_path = future_to_pdf[future]
+    # Copies whose canonical failed: converted one by one after the pool
+    successors = []
+    
+    def resolve(pdf_path: str, success: bool):
+        if index is None:
+            return
+        for dup_path, match in index.resolve(pdf_path, success):
+            if match is None or not report_duplicate(dup_path, match, progress):
+                successors.append(dup_path)
+    
+    # Interactive requests get their own thread on the shared converter (no waiting for bulk threads)
+    interactive_executor = ThreadPoolExecutor(max_workers=1) if INTERACTIVE_LANE else None
+    
+    def convert_interactive(request: Dict):
+        try:
+            elapsed, _ = convert_pdf(request['path'], converter, request['output_path'])
+            result = {"success": True, "elapsed": elapsed, "metrics": None}
+        except Exception as e:
+            result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+        finish_interactive(spool, request, result)
+    
+    spool = None
+    if interactive_executor is not None:
+        spool = start_interactive_spool(lambda request: interactive_executor.submit(convert_interactive, request),
+                                        MAX_WORKERS, 1)
+    
+    try:
+        # Process with thread pool
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            # Submit all tasks
+            future_to_pdf = {
+                executor.submit(process_single_pdf, pdf, converter, progress): pdf
+                for pdf in remaining
+            }
             
+            # Process results as they complete
+            for done, future in enumerate(as_completed(future_to_pdf), 1):
+                pdf_path = future_to_pdf[future]
+                
+                try:
+                    success, message = future.result()
+                    print(message)
+                    resolve(pdf_path, success)
+                    
+                    # Show progress every 10 files (each file is already committed)
+                    if done % 10 == 0:
+                        update_stats(pdf_files, progress, start_time)
+                    
+                except Exception as e:
+                    print(f"❌ Unexpected error processing {os.path.basename(pdf_path)}: {e}")
+                    progress.mark_failed(pdf_path, str(e))
+                    log_error(pdf_path, str(e))
+                    resolve(pdf_path, False)
+        
+        while successors:
+            pdf_path = successors.pop(0)
+            success, message = process_single_pdf(pdf_path, converter, progress)
+            print(message)
+            resolve(pdf_path, success)
+    finally:
+        if spool is not None:
+            spool.stop()
+        if interactive_executor is not None:
+            interactive_executor.shutdown(wait=True)
+    
+    update_stats(pdf_files, progress, start_time)
+    print_interactive_report(spool)
+
+def batch_process_pdfs_multiprocess(pdf_files: List[str], progress: ProgressJournal, model: CostModel,
+                                    index: Optional[DuplicateIndex] = None):
+    """
+    Process PDFs with a pool of worker processes, each holding a warm converter
+    
+    A producer thread filters, dedups and plans (page count, shards, predicted
+    cost) one PDF at a time and submits it right away, so workers start on the
+    first PDFs while the rest are still being read. Pending tasks are dispatched
+    longest-predicted-first so the biggest files (or shards) start early instead
+    of running alone at the end of the batch.
+    """
+    start_time = time.time()
+    stats["start_time"] = start_time
+    
+    quarantined = progress.quarantined_paths()
+    reserved = RESERVED_INTERACTIVE_WORKERS if INTERACTIVE_LANE and PROCESS_WORKERS > 1 else 0
+    print(f"\n🚀 Starting batch processing (process pool)...")
+    print(f"   Total PDFs: {len(pdf_files)}")
+    if quarantined:
+        print(f"   Quarantined (skipped): {len(quarantined)} (see --list-quarantine)")
+    print(f"   Worker processes: {PROCESS_WORKERS} x {THREADS_PER_WORKER} threads"
+          + (f" ({reserved} reserved for interactive requests)" if reserved else "") + "\n")
+    if index is not None:
+        print(f"🧬 Checking PDFs for duplicates as they are queued ({len(index)} converted PDFs indexed)")
+    
+    done = 0
+    remaining = []  # PDFs submitted for conversion (appended by the producer and by failed canonicals)
+    shard_state = {}
+    spool = None
+    with ConversionPool(setup_worker_converter, convert_pdf_task, PROCESS_WORKERS,
+                        max_tasks_per_worker=RECYCLE_AFTER_DOCS, max_rss_mb=WORKER_RSS_LIMIT_MB,
+                        reserved_workers=reserved) as pool:
+        
+        def produce():
+            """Filter already completed / quarantined / existing outputs, dedup, submit"""
+            already_done = 0
+            counts = {'linked': 0, 'waiting': 0, 'similar': 0}
+            predicted_total = 0.0
             try:
-                success, message = future.result()
-                print(message)
+                pending = set(progress.filter_remaining(pdf_files))
+                for pdf in pdf_files:
+                    if pdf not in pending or pdf in quarantined:
+                        already_done += pdf not in quarantined
+                        continue
+                    if SKIP_EXISTING and os.path.exists(get_output_path(pdf)):
+                        progress.mark_completed(pdf)
+                        already_done += 1
+                        continue
+                    if index is not None:
+                        signature = get_signature(pdf, progress, near=DEDUP_NEAR)
+                        if not claim_pdf(pdf, signature, progress, index, counts):
+                            continue
+                    tasks = build_pdf_tasks(pdf, shard_state, model)
+                    predicted_total += tasks[0]['file_predicted']
+                    remaining.append(pdf)
+                    for task in tasks:
+                        pool.submit(task)
+            finally:
+                pool.close_input()
+            
+            print(f"\n   All PDFs queued: {len(remaining)} to convert, {already_done} already done")
+            if index is not None:
+                print_dedup_counts(counts)
+            if shard_state:
+                print(f"   Sharded PDFs: {len(shard_state)} (>= {SHARD_MIN_PAGES} pages "
+                      f"or >= {SHARD_MIN_BYTES // (1024 * 1024)} MB, {SHARD_PAGES} pages/shard)")
+                resumed = sum(len(entry['done']) for entry in list(shard_state.values()))
+                if resumed:
+                    print(f"   📌 Resuming from checkpoints: {resumed} shards already converted")
+            print(f"   Predicted work: {predicted_total/60:.1f} min "
+                  f"(~{predicted_total/60/PROCESS_WORKERS:.1f} min wall with {PROCESS_WORKERS} workers)\n")
+        
+        pool.open_input()
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        
+        spool = start_interactive_spool(lambda request: pool.submit(interactive_task(request, model)),
+                                        PROCESS_WORKERS, reserved)
+        
+        try:
+            # Results stream back as each worker finishes a file (or a shard)
+            for task, result in pool.run():
+                if task.get('lane') == INTERACTIVE:
+                    finish_interactive(spool, task['request'], result)
+                    continue
                 
-                # Save progress every 10 files
-                if stats["processed"] % 10 == 0:
-                    save_progress(progress)
-                    update_stats(pdf_files, progress, start_time)
+                pdf_path = task['path']
+                pdf_name = os.path.basename(pdf_path)
+                
+                if result.get('killed'):
+                    # Timeout / worker crash: retry at the back of the queue until quarantined
+                    # (memory kills were already retried by the pool)
+                    if progress.add_strike(pdf_path, result['error'], QUARANTINE_AFTER):
+                        print(f"🚫 Quarantined {pdf_name} (skipped by later runs until cleared)")
+                        result['error'] += " - quarantined"
+                    elif result['killed'] in ('timeout', 'crash'):
+                        print(f"🔁 Retrying later: {pdf_name}: {result['error']}")
+                        task['priority'] = -1
+                        pool.submit(task)
+                        continue
+                
+                pages = ""
+                if result['success']:
+                    pages = report_page_decisions(pdf_path, result.get('page_decisions'))
+                    stage_metrics.add(result.get('metrics'))
+                
+                if 'page_range' in task:
+                    first, last = task['page_range']
+                    print(f"   [shard {task['shard_index'] + 1}/{task['shard_count']}] {pdf_name} "
+                          f"pages {first}-{last} ({result['elapsed']:.1f}s)" + (f" - {pages}" if pages else ""))
+                    result = record_shard_result(shard_state, task, result)
+                    if result is None:
+                        continue
+                
+                done += 1
+                
+                if result['success']:
+                    progress.mark_completed(pdf_path, elapsed=result['elapsed'])
+                    model.record(pdf_path, task['file_predicted'], result['elapsed'])
+                    print(f"✅ [{done}/{len(remaining)}] Processed {pdf_name} "
+                          f"({result['elapsed']:.1f}s worker time)"
+                          + (f" - {pages}" if pages and 'page_range' not in task else ""))
+                else:
+                    progress.mark_failed(pdf_path, result['error'])
+                    log_error(pdf_path, result['error'])
+                    print(f"❌ [{done}/{len(remaining)}] Failed {pdf_name}: {result['error']}")
                 
-            except Exception as e:
-                print(f"❌ Unexpected error processing {os.path.basename(pdf_path)}: {e}")
-                progress['failed'].append(pdf_path)
-                log_error(pdf_path, str(e))
+                if index is not None:
+                    # Copies waiting for this PDF: link them, or convert one if it failed
+                    for dup_path, match in index.resolve(pdf_path, result['success']):
+                        if match is None or not report_duplicate(dup_path, match, progress):
+                            remaining.append(dup_path)
+                            for dup_task in build_pdf_tasks(dup_path, shard_state, model):
+                                pool.submit(dup_task)
+                
+                # Show progress every 10 files (each file is already committed)
+                if done % 10 == 0:
+                    update_stats(pdf_files, progress, start_time)
+        finally:
+            if spool is not None:
+                spool.stop()
+        
+        producer.join()
     
-    # Final save
-    save_progress(progress)
+    if not remaining:
+        print("✅ All files already processed!")
     update_stats(pdf_files, progress, start_time)
+    print_interactive_report(spool)
+    
+    print("🧠 Worker memory:")
+    for line in pool.memory_report():
+        print(f"   {line}")
+    print()
+
+def plan_sample_task(task: Dict, converter) -> Dict:
+    """Worker-side --plan sample: convert in memory, report markdown bytes"""
+    page_range = tuple(task['page_range']) if task.get('page_range') else None
+    markdown, _ = convert_to_markdown(task['path'], converter, page_range)
+    return {"success": True, "bytes": len(markdown.encode('utf-8'))}
+
+def plan_batch(pdf_files: List[str], progress: ProgressJournal, model: CostModel, workers: int, budget: int):
+    """--plan: sample the remaining PDFs with the real pipeline and project the batch"""
+    print(f"📐 PLAN (dry run, nothing is written to {DOCUMENTS_ROOT})")
+    quarantined = progress.quarantined_paths()
+    remaining = [p for p in progress.filter_remaining(pdf_files) if p not in quarantined]
+    print(f"   {len(remaining)} PDFs still to convert")
+    if not remaining:
+        return
+    
+    inventory = []
+    for pdf_path in remaining:
+        features = document_features(pdf_path)
+        features['path'] = pdf_path
+        inventory.append(features)
+    
+    print(f"   Sampling up to {budget} conversions on 1 worker (stratified by size and text layer)...")
+    plan = run_plan(inventory, setup_worker_converter, plan_sample_task, model, workers, budget)
+    print()
+    print_plan(plan)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Batch RAG processing for the Documents folder")
+    parser.add_argument('--plan', action='store_true',
+                        help="dry run: time a stratified sample and project hours, memory and output size")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"worker count for --plan projections (default {PROCESS_WORKERS})")
+    parser.add_argument('--plan-samples', type=int, default=PLAN_SAMPLE_BUDGET,
+                        help="sampled conversions for --plan")
+    parser.add_argument('--list-quarantine', action='store_true',
+                        help="show PDFs skipped after repeated timeouts / worker crashes")
+    parser.add_argument('--clear-quarantine', nargs='*', metavar='PATH',
+                        help="release quarantined PDFs (all if no path is given)")
+    return parser.parse_args()
+
+def manage_quarantine(args) -> bool:
+    """Handle --list-quarantine / --clear-quarantine. Returns True if the run should stop."""
+    if not args.list_quarantine and args.clear_quarantine is None:
+        return False
+    
+    progress = ProgressJournal(PROGRESS_DB)
+    try:
+        if args.clear_quarantine is not None:
+            cleared = progress.clear_quarantine(args.clear_quarantine or None)
+            print(f"✅ Released {cleared} quarantined PDFs")
+        if args.list_quarantine:
+            entries = progress.list_quarantine()
+            print(f"🚫 Quarantined PDFs: {len(entries)}")
+            for path, strikes, reason, updated_at in entries:
+                print(f"   {path}")
+                print(f"      {strikes} strikes, last: {reason} ({updated_at})")
+    finally:
+        progress.close()
+    return True
 
 def main():
     """Main entry point"""
+    args = parse_args()
+    if manage_quarantine(args):
+        return
+    
     print("="*80)
     print("🚀 BATCH RAG PROCESSING - DOCUMENTS FOLDER")
     print("="*80)
@@ -283,20 +857,31 @@ def main():
         print(f"❌ ERROR: Documents folder not found: {DOCUMENTS_ROOT}")
         return
     
-    # Setup
-    converter = setup_docling_converter()
+    # Setup (process mode: converters are built inside the workers)
+    if STAGE_METRICS:
+        stage_metrics.configure(METRICS_LOG, METRICS_PROM, job="batch_rag_documents")
+    converter = setup_docling_converter() if EXECUTION_MODE == "thread" and not args.plan else None
     progress = load_progress()
+    model = build_cost_model(progress, SAMPLE_RESULTS_FILE) if EXECUTION_MODE == "process" or args.plan else None
     pdf_files = find_all_pdfs(DOCUMENTS_ROOT)
+    index = load_index(progress) if DEDUP and not args.plan else None
     
     if not pdf_files:
         print("❌ No PDF files found!")
         return
     
+    if args.plan:
+        try:
+            plan_batch(pdf_files, progress, model, args.workers or PROCESS_WORKERS, args.plan_samples)
+        finally:
+            progress.close()
+        return
+    
     # Confirm with user
     print(f"\n⚠️  ABOUT TO PROCESS {len(pdf_files)} PDFs (~8 GB)")
     print(f"   Estimated time: 2-6 hours")
     print(f"   Output: Markdown files in same folders as PDFs")
-    print(f"   Progress saved to: {PROGRESS_FILE}")
+    print(f"   Progress saved to: {PROGRESS_DB}")
     print(f"   Errors logged to: {ERROR_LOG}")
     print()
     
@@ -311,7 +896,10 @@ def main():
     print("="*80 + "\n")
     
     try:
-        batch_process_pdfs(pdf_files, converter, progress)
+        if EXECUTION_MODE == "process":
+            batch_process_pdfs_multiprocess(pdf_files, progress, model, index)
+        else:
+            batch_process_pdfs(pdf_files, converter, progress, index)
         
         print("\n" + "="*80)
         print("✅ BATCH PROCESSING COMPLETE!")
@@ -324,6 +912,18 @@ def main():
         print(f"   Total time: {(time.time() - stats['start_time'])/60:.1f} minutes")
         print()
         
+        if STAGE_METRICS:
+            print(f"⏱️  STAGE TIMINGS (worker seconds, events in {METRICS_LOG}):")
+            for line in stage_metrics.report():
+                print(f"   {line}")
+            print()
+        
+        if model is not None:
+            print(f"🎯 COST MODEL (predicted vs actual):")
+            for line in model.accuracy_report():
+                print(f"   {line}")
+            print()
+        
         if stats['errors'] > 0:
             print(f"⚠️  Check error log: {ERROR_LOG}")
         
@@ -333,12 +933,17 @@ def main():
     except KeyboardInterrupt:
         print("\n\n⚠️  INTERRUPTED BY USER")
         print("Progress has been saved. Run again to resume.")
-        save_progress(progress)
+        if PAGE_CHECKPOINTS and STREAM_EXPORT_PAGES:
+            print(f"📌 Long PDFs in progress resume from their last checkpoint ({STREAM_EXPORT_PAGES}-page chunks).")
     
     except Exception as e:
         print(f"\n\n❌ FATAL ERROR: {e}")
-        save_progress(progress)
         raise
+    
+    finally:
+        if STAGE_METRICS:
+            stage_metrics.write_prometheus()
+        progress.close()
 
 if __name__ == "__main__":
     main()
@@ -3,6 +3,7 @@ Batch RAG Simple - Serial Processing (For Testing)
 ===================================================
 
 Chạy tuần tự (không parallel) để dễ debug
+Full-page OCR chỉ cho trang scan (pre-pass text layer, xem text_layer.py)
 """
 
 import os
@@ -28,13 +29,15 @@ except ImportError as e:
     print(f"ERROR: {e}")
     sys.exit(1)
 
+from text_layer import PageRoutedConverter, summarize_decisions
+
 # Config
 DOCUMENTS_ROOT = r"D:\Work\Coding\archi-query-master\Documents"
 PROGRESS_FILE = r"D:\Work\Coding\QSM\batch_simple_progress.json"
 LIMIT = 10  # Process only first 10 for testing
 
-def setup_converter():
-    """Setup với Vietnamese OCR"""
+def build_converter(force_full_page_ocr):
+    """Docling converter với Vietnamese OCR"""
     pipeline_options = PdfPipelineOptions()
     pipeline_options.do_ocr = True
     pipeline_options.do_table_structure = True
@@ -42,7 +45,7 @@ def setup_converter():
     easyocr_options = EasyOcrOptions(
         lang=["vi", "en"],
         use_gpu=False,
-        force_full_page_ocr=True,
+        force_full_page_ocr=force_full_page_ocr,
         confidence_threshold=0.5,
         download_enabled=True
     )
@@ -59,6 +62,10 @@ def setup_converter():
         }
     )
 
+def setup_converter():
+    """Text-layer pages without forced OCR, scanned pages with full-page OCR"""
+    return PageRoutedConverter(build_converter(False), build_converter(True))
+
 def find_pdfs():
     """Find all PDFs"""
     pdfs = []
@@ -96,15 +103,14 @@ def process_pdf(pdf_path, converter, progress):
     start = time.time()
     
     try:
-        result = converter.convert(pdf_path)
-        markdown = result.document.export_to_markdown()
+        markdown, decisions = converter.convert_to_markdown(pdf_path)
         
         with open(output_path, 'w', encoding='utf-8') as f:
             f.write(markdown)
         
         elapsed = time.time() - start
         progress['completed'].append(pdf_path)
-        print(f"  OK - {elapsed:.1f}s - {len(markdown)} chars")
+        print(f"  OK - {elapsed:.1f}s - {len(markdown)} chars - {summarize_decisions(decisions)}")
         return True
         
     except Exception as e:
@@ -6,15 +6,25 @@ Supports:
 - PDF files
 - Microsoft Office: DOCX, XLSX, PPTX, DOC, XLS, PPT
 - Vietnamese OCR optimization with EasyOCR
-- Progress tracking and resume capability
+- Progress tracking and resume capability (SQLite journal, commit mỗi file)
+- Process pool: mỗi worker một converter warm, scan song song cấp file ngay cho worker
+- Incremental runs: manifest (size/mtime/inode/hash) -> chỉ xử lý file mới/đổi
+- Content-addressed cache (file hash + pipeline options), skips identical copies
+- Format router: DOCX/XLSX/PPTX đọc trực tiếp từ XML/openpyxl, không qua Docling
+- DOC/XLS/PPT: nâng cấp lên OOXML bằng pool LibreOffice headless dùng lại instance
+- Timeout cứng mỗi file (theo số trang dự đoán), file treo/crash lặp lại -> quarantine
 - Error handling and logging
 """
 
 import os
 import sys
-import json
 import time
+import argparse
+import shutil
+import tempfile
+import threading
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
@@ -35,11 +45,91 @@ except ImportError as e:
     print("Run: D:\\Work\\Coding\\QSM\\python\\venv\\Scripts\\pip.exe install docling")
     sys.exit(1)
 
+from conversion_cache import ConversionCache, get_file_hash, options_fingerprint
+from progress_journal import ProgressJournal
+from file_manifest import FileManifest, retire_outputs
+from conversion_pool import INTERACTIVE, ConversionPool
+from document_scanner import scan_documents
+from cost_model import build_cost_model, document_features, document_timeout
+from format_router import FormatThroughput, convert_with_router, write_markdown_blocks
+from streaming_export import discard_checkpoint, docling_chunk_converter
+from folder_watcher import FolderWatcher
+from dedup import get_signature, link_duplicate, load_index, report_near_duplicate
+from interactive_lane import INTERACTIVE_LATENCY_TARGET, InteractiveSpool
+from lease_queue import LeaseQueue
+from conversion_metrics import StageMetrics, enable_pipeline_timings, measure
+from batch_planner import PLAN_SAMPLE_BUDGET, print_plan, run_plan
+from libreoffice_pool import LEGACY_TARGETS, LegacyConversionError, LegacyConversionTimeout, LibreOfficePool
+
 # Configuration
 DOCUMENTS_ROOT = r"D:\Work\Coding\archi-query-master\Documents"
-PROGRESS_FILE = r"D:\Work\Coding\QSM\batch_rag_progress.json"
+PROGRESS_FILE = r"D:\Work\Coding\QSM\batch_rag_progress.json"  # Legacy, imported once
+PROGRESS_DB = r"D:\Work\Coding\QSM\batch_rag_progress.db"
 ERROR_LOG = r"D:\Work\Coding\QSM\batch_rag_errors.log"
-SKIP_EXISTING = True
+SKIP_EXISTING = True  # Only used when the conversion cache is disabled
+INCREMENTAL = True  # Diff against the manifest, re-queue changed files, retire deleted ones
+EXECUTION_MODE = "process"  # "process" = worker pool, "sequential" = one converter in this process
+THREADS_PER_WORKER = 2  # Torch threads per worker process
+PROCESS_WORKERS = max(1, (os.cpu_count() or 4) // THREADS_PER_WORKER)
+RECYCLE_AFTER_DOCS = 100  # Replace a worker after this many documents
+WORKER_RSS_LIMIT_MB = 4096  # Recycle a worker above this RSS; mid-document the file is re-queued
+
+# Hard per-document wall-clock limit (process mode): base + per page / MB, and at least
+# DOC_TIMEOUT_FACTOR x the cost model's prediction. The worker is killed on timeout.
+DOC_TIMEOUT_BASE = 120
+DOC_TIMEOUT_PER_PAGE = 20
+DOC_TIMEOUT_PER_MB = 10
+DOC_TIMEOUT_FACTOR = 5
+QUARANTINE_AFTER = 2  # Timeouts / worker crashes before a file is skipped by later runs
+STREAMING_SCAN = True  # Start converting while the directory scan is still running
+SCAN_REPORT_EVERY = 500  # Print running scan totals every N files
+LONGEST_JOB_FIRST = True  # Dispatch documents with the highest predicted cost first
+SAMPLE_RESULTS_FILE = r"D:\Work\Coding\QSM\sample_test_results.json"  # Extra timings for the cost model
+
+# Native DOCX/XLSX/PPTX extractors (no DocumentConverter); PDF and legacy formats use Docling
+NATIVE_FAST_PATHS = True
+
+# Streaming export (opt-in, e.g. 10): PDFs with >= STREAM_MIN_PAGES pages are converted/exported
+# this many pages at a time and appended to the .md, so worker memory doesn't grow with page count.
+# The .md then differs from a whole-document export at chunk boundaries (a table spanning two
+# chunks comes out as two tables, see pdf_sharding.py). None = whole document
+STREAM_EXPORT_PAGES = None
+PAGE_CHECKPOINTS = True  # Keep streamed pages on disk ({output}.partial/.ckpt) so interrupted PDFs resume mid-file
+
+# Legacy .doc/.xls/.ppt: upgrade to OOXML with a bounded pool of headless LibreOffice instances
+LEGACY_VIA_LIBREOFFICE = True
+LIBREOFFICE_INSTANCES = 2  # Max concurrent legacy conversions (instances are reused)
+LIBREOFFICE_TIMEOUT = 180  # Seconds per file before the instance is killed and restarted
+
+# Per-stage timings (Docling pipeline profiling): JSONL event per file + Prometheus textfile
+STAGE_METRICS = True
+METRICS_LOG = r"D:\Work\Coding\QSM\batch_rag_universal_metrics.jsonl"
+METRICS_PROM = r"D:\Work\Coding\QSM\batch_rag_universal.prom"  # node_exporter textfile collector dir
+
+# Watch mode (--watch): new/changed files are queued once size/mtime stay still this long
+WATCH_DEBOUNCE_SECONDS = 3.0
+
+# Interactive lane (process mode): single-document requests (DoclingService.processDocument via
+# interactive_lane.py) skip the bulk queue and get a reserved warm worker while the batch runs
+INTERACTIVE_LANE = True
+INTERACTIVE_SPOOL = r"D:\Work\Coding\QSM\interactive_spool"
+RESERVED_INTERACTIVE_WORKERS = 1  # Taken from PROCESS_WORKERS, never given bulk work
+
+# Multi-node (--distributed QUEUE_DIR): machines mounting the same Documents share split the
+# work through expiring lease files in QUEUE_DIR on the share (lease_queue.py); None = one node
+DISTRIBUTED_QUEUE = None
+DISTRIBUTED_PREFETCH = 2  # Claimed documents per worker not yet started (process mode)
+
+# Duplicate elimination before conversion: exact (SHA-256) and near-duplicate PDFs (MinHash of
+# the text layer, perceptual hash of page images for scans) get a link to the canonical's .md;
+# near-duplicates with another page count / file size are only reported (see dedup.py)
+DEDUP = True
+DEDUP_NEAR = True  # False = exact duplicates only (no PDF text extraction / rendering)
+
+# Conversion cache: key = SHA-256 of file + fingerprint of pipeline options
+USE_CONVERSION_CACHE = True
+CACHE_DIR = r"D:\Work\Coding\QSM\.conversion_cache"
+CACHE_MAX_BYTES = 5 * 1024 ** 3  # 5 GB, LRU eviction above this
 
 # Supported formats
 SUPPORTED_EXTENSIONS = {
@@ -61,10 +151,14 @@ stats = {
     "by_format": {}
 }
 
-def setup_docling_converter():
-    """Setup Docling with Vietnamese OCR optimization"""
-    print("Setting up Docling converter...")
-    
+# Files / MB / seconds per format and route (native vs docling)
+throughput = FormatThroughput()
+
+# Per-stage timings of this run (JSONL / Prometheus paths set in main)
+stage_metrics = StageMetrics()
+
+def build_pipeline_options():
+    """PDF pipeline options (also used to fingerprint cached outputs)"""
     # Vietnamese OCR optimization
     ocr_options = EasyOcrOptions(
         force_full_page_ocr=False,  # Only OCR when needed
@@ -77,6 +171,17 @@ def setup_docling_converter():
         do_table_structure=True,
         ocr_options=ocr_options
     )
+    return pipeline_options
+
+def setup_docling_converter(pipeline_options=None, verbose=True):
+    """Setup Docling with Vietnamese OCR optimization"""
+    if verbose:
+        print("Setting up Docling converter...")
+    
+    if pipeline_options is None:
+        pipeline_options = build_pipeline_options()
+    if STAGE_METRICS:
+        enable_pipeline_timings()
     
     # Create converter with support for all formats
     converter = DocumentConverter(
@@ -89,37 +194,33 @@ def setup_docling_converter():
         }
     )
     
-    print("OK: Docling converter ready (PDF + Office formats)")
-    print("   - PDF: Vietnamese OCR with EasyOCR")
-    print("   - Office: DOCX, XLSX, PPTX, DOC, XLS, PPT")
+    if verbose:
+        print("OK: Docling converter ready (PDF + Office formats)")
+        print("   - PDF: Vietnamese OCR with EasyOCR")
+        print("   - Office: DOCX, XLSX, PPTX, DOC, XLS, PPT")
     return converter
 
-def load_progress():
-    """Load processing progress"""
-    if os.path.exists(PROGRESS_FILE):
-        try:
-            with open(PROGRESS_FILE, 'r', encoding='utf-8') as f:
-                progress = json.load(f)
-                print(f"Loaded progress: {len(progress['completed'])} files already processed")
-                return progress
-        except Exception as e:
-            print(f"WARNING: Could not load progress: {e}")
-    
-    return {
-        "completed": [],
-        "failed": [],
-        "by_format": {},
-        "last_updated": None
-    }
+def setup_worker_converter():
+    """Build the converter inside a worker process (process mode)"""
+    try:
+        import torch
+        torch.set_num_threads(THREADS_PER_WORKER)
+    except ImportError:
+        pass
+    return setup_docling_converter(verbose=False)
 
-def save_progress(progress):
-    """Save processing progress"""
-    progress["last_updated"] = datetime.now().isoformat()
+def load_progress():
+    """Open the progress journal (imports the old JSON progress file once)"""
+    progress = ProgressJournal(PROGRESS_DB)
     try:
-        with open(PROGRESS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(progress, f, indent=2, ensure_ascii=False)
+        imported = progress.import_json(PROGRESS_FILE)
+        if imported:
+            print(f"Imported {imported} entries from {PROGRESS_FILE}")
     except Exception as e:
-        print(f"WARNING: Could not save progress: {e}")
+        print(f"WARNING: Could not import JSON progress: {e}")
+    
+    print(f"Loaded progress: {progress.count('completed')} files already processed")
+    return progress
 
 def log_error(file_path, error):
     """Log processing errors"""
@@ -137,140 +238,727 @@ def get_output_path(file_path):
     return str(file.with_suffix('.md'))
 
 def find_all_documents(root_dir):
-    """Find all supported document files recursively"""
+    """
+    Find all supported document files recursively (full scan before processing)
+    
+    Returns:
+        (entries, by_format, total_size) where entries are (path, stat_result)
+    """
     print(f"Scanning for documents in {root_dir}...")
     
-    documents = []
-    for root, dirs, files in os.walk(root_dir):
-        for file in files:
-            ext = os.path.splitext(file)[1].lower()
-            if ext in SUPPORTED_EXTENSIONS:
-                documents.append(os.path.join(root, file))
+    entries = list(scan_documents(root_dir, SUPPORTED_EXTENSIONS))
     
-    # Count by format
+    # Count by format / size from the stat the scanner already has
     by_format = {}
-    for doc in documents:
-        ext = os.path.splitext(doc)[1].lower()
+    total_size = 0
+    for path, st in entries:
+        ext = os.path.splitext(path)[1].lower()
         by_format[ext] = by_format.get(ext, 0) + 1
+        total_size += st.st_size
     
-    print(f"Found {len(documents)} supported documents:")
+    print(f"Found {len(entries)} supported documents:")
     for ext, count in sorted(by_format.items()):
         print(f"  {ext}: {count} files")
     
-    return documents, by_format
+    return entries, by_format, total_size
+
+def retire_document(path, progress):
+    """Forget a source and remove its generated .md / checkpoint"""
+    progress.forget([path])
+    retired = retire_outputs([path], get_output_path)
+    discard_checkpoint(get_output_path(path))
+    return retired
+
+def iter_pending_documents(entries, progress, scan_totals, live=False, hashes=None):
+    """
+    Filter scanned (path, stat) entries down to the documents that need work
+    
+    Keeps running totals in scan_totals and, when INCREMENTAL, diffs each entry
+    against the manifest: modified sources are dropped from the journal and
+    their stale .md removed, deleted sources are retired once the scan ends.
+    
+    hashes: dict that receives {path: SHA-256} for yielded files the manifest
+    just hashed (added/modified), so the cache lookup and dedup don't read them again.
+    
+    live=True is for watch-folder events, which never end: (path, None) means
+    deleted, manifest changes are persisted per event and completion is looked
+    up per file instead of from the snapshot taken at the start.
+    """
+    manifest = FileManifest(PROGRESS_DB) if INCREMENTAL else None
+    if manifest is not None:
+        manifest.begin()
+    completed = progress.completed_paths()
+    quarantined = progress.quarantined_paths()
+    
+    try:
+        for path, st in entries:
+            if st is None:
+                scan_totals['deleted'] += 1
+                scan_totals['retired'] += retire_document(path, progress)
+                if manifest is not None:
+                    manifest.remove([path])
+                print(f"  DELETED: {os.path.basename(path)} (output retired)")
+                continue
+            
+            ext = os.path.splitext(path)[1].lower()
+            scan_totals['found'] += 1
+            scan_totals['bytes'] += st.st_size
+            scan_totals['by_format'][ext] = scan_totals['by_format'].get(ext, 0) + 1
+            if scan_totals['found'] % SCAN_REPORT_EVERY == 0:
+                print(f"  [scan] {scan_totals['found']} documents found "
+                      f"({scan_totals['bytes']/1024/1024:.0f} MB), {scan_totals['queued']} queued")
+            
+            status = 'modified' if live and manifest is None else None
+            file_hash = None
+            if manifest is not None:
+                status, file_hash = manifest.observe(path, st)
+                scan_totals[status] += 1
+                if live:
+                    manifest.flush()
+            if status == 'modified':
+                retire_document(path, progress)
+                completed.discard(path)
+                if path in quarantined:
+                    # New content gets a fresh chance
+                    progress.clear_quarantine([path])
+                    quarantined.discard(path)
+            
+            if progress.is_completed(path) if live else path in completed:
+                continue
+            if path in quarantined:
+                scan_totals['quarantined'] += 1
+                continue
+            
+            scan_totals['queued'] += 1
+            if hashes is not None and file_hash is not None:
+                hashes[path] = file_hash
+            yield path
+        
+        if manifest is not None and not live:
+            deleted = manifest.finish()
+            progress.forget(deleted)
+            scan_totals['deleted'] = len(deleted)
+            scan_totals['retired'] = retire_outputs(deleted, get_output_path)
+            for path in deleted:
+                discard_checkpoint(get_output_path(path))
+        scan_totals['done'] = True
+    finally:
+        if manifest is not None:
+            manifest.close()
+
+def print_scan_totals(scan_totals):
+    """Final scan / manifest summary"""
+    print(f"Scan: {scan_totals['found']} documents ({scan_totals['bytes']/1024/1024:.0f} MB), "
+          f"{scan_totals['queued']} queued")
+    for ext, count in sorted(scan_totals['by_format'].items()):
+        print(f"  {ext}: {count} files")
+    if INCREMENTAL:
+        print(f"Manifest diff: {scan_totals['added']} added, {scan_totals['modified']} modified, "
+              f"{scan_totals['deleted']} deleted ({scan_totals['retired']} outputs retired), "
+              f"{scan_totals['unchanged']} unchanged")
+    if scan_totals['duplicates']:
+        print(f"Duplicates: {scan_totals['duplicates']} linked to their canonical output "
+              f"(groups in document_duplicates, {PROGRESS_DB})")
+    if scan_totals['other_nodes']:
+        print(f"Other nodes: {scan_totals['other_nodes']} documents already done by other nodes (lease queue)")
+    if scan_totals['quarantined']:
+        print(f"Quarantined (skipped): {scan_totals['quarantined']} files "
+              f"(list with --list-quarantine, retry with --clear-quarantine)")
+
+def skip_leased(scan_totals, hashes, path):
+    """Another node already converted (or gave up on) this document"""
+    hashes.pop(path, None)
+    scan_totals['queued'] -= 1
+    scan_totals['other_nodes'] += 1
+
+def new_scan_totals():
+    return {
+        'found': 0, 'bytes': 0, 'queued': 0, 'by_format': {}, 'done': False, 'cache_hits': 0,
+        'added': 0, 'modified': 0, 'unchanged': 0, 'deleted': 0, 'retired': 0, 'quarantined': 0,
+        'duplicates': 0, 'other_nodes': 0,
+    }
+
+def lookup_cache(file_path, progress, cache, file_hash=None):
+    """
+    Serve a document from the conversion cache if possible
+    
+    Returns:
+        (hit: bool, file_hash)
+    """
+    if cache is None:
+        return False, file_hash
+    
+    file_hash = file_hash or get_file_hash(file_path)
+    markdown_content = cache.get(file_hash)
+    if markdown_content is None:
+        return False, file_hash
+    
+    write_markdown_blocks([markdown_content], get_output_path(file_path))
+    progress.mark_completed(file_path, file_hash, 0.0)
+    return True, file_hash
+
+def report_duplicate(doc_path, match, progress, scan_totals):
+    """Link a duplicate to its canonical's output. False if that output is missing."""
+    mode = link_duplicate(doc_path, match, progress, get_output_path)
+    if mode is None:
+        return False
+    scan_totals['duplicates'] += 1
+    print(f"  DUPLICATE: {os.path.basename(doc_path)} -> {match['canonical']} "
+          f"({match['detection_type']} {match['score']:.2f}, {mode})")
+    return True
+
+def claim_document(doc_path, progress, index, scan_totals, file_hash=None):
+    """
+    Dedup stage before conversion (file_hash: already known SHA-256, e.g. from the manifest)
+    
+    Returns:
+        (convert: bool, file_hash) - convert=False when the document was linked to
+        its canonical's output or waits for the canonical to finish
+    """
+    signature = get_signature(doc_path, progress, near=DEDUP_NEAR, file_hash=file_hash)
+    if signature is None:
+        return True, file_hash
+    match = index.claim(doc_path, signature)
+    if match is None:
+        return True, signature['sha256']
+    if not match['link']:
+        # Similar but not safe to share output (other pages / size): converted, reported for review
+        report_near_duplicate(doc_path, match, progress)
+        print(f"  SIMILAR: {os.path.basename(doc_path)} ~ {os.path.basename(match['canonical'])} "
+              f"({match['detection_type']} {match['score']:.2f}), converted separately")
+        return True, signature['sha256']
+    if not match['ready']:
+        print(f"  DUPLICATE: {os.path.basename(doc_path)} waits for {os.path.basename(match['canonical'])} "
+              f"({match['detection_type']} {match['score']:.2f})")
+        return False, signature['sha256']
+    if report_duplicate(doc_path, match, progress, scan_totals):
+        return False, signature['sha256']
+    # Canonical output is gone: this copy takes its place
+    index.remove(match['canonical'])
+    index.add(doc_path, signature)
+    return True, signature['sha256']
+
+def count_vietnamese_chars(text):
+    """Count Vietnamese characters (for quality check)"""
+    return sum(1 for c in text if '\u00C0' <= c <= '\u1EF9')
+
+def open_office_pool():
+    """LibreOffice pool for legacy formats, or None (they then go straight to Docling)"""
+    if not LEGACY_VIA_LIBREOFFICE:
+        return None
+    try:
+        office_pool = LibreOfficePool(LIBREOFFICE_INSTANCES, LIBREOFFICE_TIMEOUT)
+    except LegacyConversionError as e:
+        print(f"WARNING: {e}, .doc/.xls/.ppt will be sent to Docling directly")
+        return None
+    print(f"LibreOffice pool: {LIBREOFFICE_INSTANCES} instances ({office_pool.mode}), "
+          f"{LIBREOFFICE_TIMEOUT}s per file")
+    if office_pool.mode == "cli":
+        print("WARNING: no Python with the uno module found (LibreOffice's program\\python.exe), "
+              "every legacy file starts a new soffice - slow")
+    return office_pool
 
-def process_single_document(file_path, converter, progress):
+def process_single_document(file_path, converter, progress, cache=None, office_pool=None, file_hash=None):
     """
     Process a single document file
     
+    With a cache, an identical file (any name/location) converted with the
+    same pipeline options is written from the cache without conversion
+    (file_hash: SHA-256 already computed by the manifest / dedup, else hashed here).
+    Legacy binaries are upgraded to OOXML through office_pool first.
+    
     Returns:
         (success: bool, message: str, time_seconds: float)
     """
     file_name = os.path.basename(file_path)
-    ext = os.path.splitext(file_path)[1].lower()
     
     # Check if already completed
-    if file_path in progress['completed']:
+    if progress.is_completed(file_path):
         return True, f"Already processed: {file_name}", 0
     
-    # Check if output already exists
+    # Check if output already exists (no cache: trust any existing .md)
     output_path = get_output_path(file_path)
-    if SKIP_EXISTING and os.path.exists(output_path):
-        progress['completed'].append(file_path)
+    if cache is None and SKIP_EXISTING and os.path.exists(output_path):
+        progress.mark_completed(file_path)
         return True, f"Output exists, skipped: {file_name}", 0
     
     try:
         start_time = time.time()
         
-        # Convert document to markdown
-        result = converter.convert(file_path)
+        hit, file_hash = lookup_cache(file_path, progress, cache, file_hash)
+        if hit:
+            return True, f"CACHE HIT: {file_name}", time.time() - start_time
         
-        # Export to markdown
-        markdown_content = result.document.export_to_markdown()
+        # Convert document to markdown (native extractor or Docling), saved next to the source
+        with measure(file_path) as metrics:
+            if office_pool is not None and os.path.splitext(file_path)[1].lower() in LEGACY_TARGETS:
+                upgraded_path = office_pool.upgrade(file_path)
+                try:
+                    route = "libreoffice+" + convert_with_router(upgraded_path, output_path, converter,
+                                                                 NATIVE_FAST_PATHS, STREAM_EXPORT_PAGES,
+                                                                 PAGE_CHECKPOINTS)
+                finally:
+                    office_pool.discard(upgraded_path)
+            else:
+                route = convert_with_router(file_path, output_path, converter, NATIVE_FAST_PATHS,
+                                            STREAM_EXPORT_PAGES, PAGE_CHECKPOINTS)
+        with open(output_path, 'r', encoding='utf-8') as f:
+            markdown_content = f.read()
         
-        # Save to file (same folder as source)
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
+        if cache is not None:
+            cache.put(file_hash, markdown_content)
         
         elapsed = time.time() - start_time
+        throughput.record(file_path, route, elapsed)
+        stage_metrics.add(metrics.event(route, elapsed, output_path))
         
-        # Update progress
-        progress['completed'].append(file_path)
-        
-        # Track by format
-        if ext not in progress['by_format']:
-            progress['by_format'][ext] = {'success': 0, 'failed': 0}
-        progress['by_format'][ext]['success'] += 1
+        # Update progress (one committed row per file, by_format derives from it)
+        progress.mark_completed(file_path, file_hash, elapsed)
         
-        # Count Vietnamese characters (for quality check)
-        vietnamese_chars = sum(1 for c in markdown_content if '\u00C0' <= c <= '\u1EF9')
+        vietnamese_chars = count_vietnamese_chars(markdown_content)
         
-        return True, f"OK: {file_name} ({elapsed:.1f}s, {len(markdown_content)} chars, {vietnamese_chars} VN chars)", elapsed
+        return True, f"OK: {file_name} ({elapsed:.1f}s, {route}, {len(markdown_content)} chars, {vietnamese_chars} VN chars)", elapsed
         
     except Exception as e:
         error_msg = str(e)
-        progress['failed'].append(file_path)
+        progress.mark_failed(file_path, error_msg)
         log_error(file_path, error_msg)
         
-        # Track by format
-        if ext not in progress['by_format']:
-            progress['by_format'][ext] = {'success': 0, 'failed': 0}
-        progress['by_format'][ext]['failed'] += 1
-        
         return False, f"FAIL: {file_name}: {error_msg[:80]}", 0
 
-def batch_process_documents(documents, converter, progress):
-    """Process documents sequentially with progress tracking"""
+def convert_document_task(task, converter):
+    """Worker-side task for ConversionPool: convert and write the .md"""
+    start_time = time.time()
     
-    # Filter out already completed
-    remaining = [doc for doc in documents if doc not in progress['completed']]
+    if 'upgrade_error' in task:
+        raise LegacyConversionError(task['upgrade_error'])
     
-    if not remaining:
-        print("All files already processed!")
-        return
+    output_path = task.get('output_path') or get_output_path(task['path'])
+    with measure(task['path']) as metrics:
+        route = convert_with_router(task.get('convert_path', task['path']), output_path, converter,
+                                    NATIVE_FAST_PATHS, STREAM_EXPORT_PAGES, PAGE_CHECKPOINTS)
+    if 'convert_path' in task:
+        route = "libreoffice+" + route
+    with open(output_path, 'r', encoding='utf-8') as f:
+        markdown_content = f.read()
+    
+    return {
+        "success": True,
+        "elapsed": time.time() - start_time,
+        "route": route,
+        "chars": len(markdown_content),
+        "vn_chars": count_vietnamese_chars(markdown_content),
+        "metrics": metrics.event(route, time.time() - start_time, output_path),
+    }
+
+def show_progress(start_time, scan_totals):
+    """Periodic progress block (total grows while the scan is still running)"""
+    total_elapsed = time.time() - start_time
+    queued = scan_totals['queued']
+    done = stats["processed"] + scan_totals['cache_hits']
+    avg_time = total_elapsed / max(done, 1)
+    remaining_time = avg_time * max(queued - done, 0)
+    scanning = "" if scan_totals['done'] else " (scan running)"
+    
+    print()
+    print(f"PROGRESS: {done}/{queued}{scanning} ({done/max(queued, 1)*100:.1f}%)")
+    print(f"  Success: {done - stats['errors']}")
+    print(f"  Errors: {stats['errors']}")
+    print(f"  Elapsed: {total_elapsed/60:.1f} min")
+    print(f"  Estimated remaining: {remaining_time/60:.1f} min")
+    print()
+
+def batch_process_documents(entries, converter, progress, cache=None, model=None, office_pool=None,
+                            index=None, leases=None):
+    """Process documents sequentially with progress tracking"""
+    scan_totals = new_scan_totals()
     
     print("\n" + "="*80)
-    print("STARTING BATCH PROCESSING")
+    print("STARTING BATCH PROCESSING (sequential)")
     print("="*80)
-    print(f"Total documents: {len(documents)}")
-    print(f"Already done: {len(progress['completed'])}")
-    print(f"Remaining: {len(remaining)}")
-    print()
     
     start_time = time.time()
     
-    for i, doc_path in enumerate(remaining, 1):
-        print(f"\n[{i}/{len(remaining)}] Processing: {os.path.basename(doc_path)}")
+    hashes = {}  # Manifest SHA-256 of queued files, reused by the cache lookup and dedup
+    pending = iter_pending_documents(entries, progress, scan_totals, hashes=hashes)
+    if leases is not None:
+        pending = leases.claimed(pending, on_skip=lambda path: skip_leased(scan_totals, hashes, path))
+    
+    for doc_path in pending:
+        file_hash = hashes.pop(doc_path, None)
+        if index is not None:
+            convert, file_hash = claim_document(doc_path, progress, index, scan_totals, file_hash)
+            if not convert:
+                continue
+        print(f"\n[{stats['processed'] + 1}/{scan_totals['queued']}] Processing: {os.path.basename(doc_path)}")
         
-        success, message, elapsed = process_single_document(doc_path, converter, progress)
+        predicted = model.predict(document_features(doc_path)) if model is not None else 0
+        success, message, elapsed = process_single_document(doc_path, converter, progress, cache, office_pool,
+                                                             file_hash)
         print(f"  {message}")
+        if index is not None:
+            index.resolve(doc_path, success)  # sequential: nobody is waiting
+        if model is not None and message.startswith("OK:"):
+            model.record(doc_path, predicted, elapsed)
         
         stats["processed"] += 1
         if not success:
             stats["errors"] += 1
         
-        # Save progress every 10 files
+        # Show progress every 10 files (each file is already committed)
         if stats["processed"] % 10 == 0:
-            save_progress(progress)
+            show_progress(start_time, scan_totals)
+    
+    print()
+    print_scan_totals(scan_totals)
+
+def batch_process_documents_multiprocess(entries, progress, cache=None, model=None, office_pool=None,
+                                         watcher=None, index=None, leases=None):
+    """
+    Process documents with a pool of warm converter workers
+    
+    A producer thread walks the (possibly still running) scan, applies the
+    manifest/journal/cache filters and submits work; the main thread handles
+    results as they stream back. With a cost model, each idle worker gets the
+    queued document with the highest predicted time (longest job first).
+    Legacy files are upgraded by the LibreOffice pool on a few parent threads
+    (one per instance) before they are submitted.
+    
+    With a FolderWatcher the producer keeps going after the catch-up scan and
+    feeds settled watch events to the same warm workers until Ctrl+C.
+    
+    With a DuplicateIndex, copies of a document still being converted wait for it
+    and are linked to its output when it finishes (or converted if it fails).
+    
+    With a LeaseQueue (multi-node), the producer only claims a document when the
+    pool has room for it, so other nodes can take everything not yet started.
+    """
+    scan_totals = new_scan_totals()
+    
+    print("\n" + "="*80)
+    print("STARTING BATCH PROCESSING (process pool)")
+    print("="*80)
+    reserved = RESERVED_INTERACTIVE_WORKERS if INTERACTIVE_LANE and PROCESS_WORKERS > 1 else 0
+    print(f"Worker processes: {PROCESS_WORKERS} x {THREADS_PER_WORKER} threads"
+          + (f" ({reserved} reserved for interactive requests)" if reserved else ""))
+    print()
+    
+    start_time = time.time()
+    spool = None
+    
+    with ConversionPool(setup_worker_converter, convert_document_task, PROCESS_WORKERS,
+                        max_tasks_per_worker=RECYCLE_AFTER_DOCS, max_rss_mb=WORKER_RSS_LIMIT_MB,
+                        reserved_workers=reserved) as pool:
+        
+        upgrader = ThreadPoolExecutor(max_workers=LIBREOFFICE_INSTANCES) if office_pool is not None else None
+        
+        def upgrade_and_submit(task):
+            try:
+                task['convert_path'] = office_pool.upgrade(task['path'])
+            except Exception as e:
+                # Reported through the pool like any other failed conversion
+                task['upgrade_error'] = f"LibreOffice upgrade failed: {e}"
+                if isinstance(e, LegacyConversionTimeout):
+                    task['upgrade_killed'] = 'timeout'
+            pool.submit(task)
+        
+        # The pool keeps accepting input until the producer is done and every upgrade is submitted
+        upgrading = {'count': 0, 'producing': True}
+        upgrade_lock = threading.Lock()
+        
+        def close_input_when_idle():
+            """Call under upgrade_lock"""
+            if not upgrading['producing'] and not upgrading['count']:
+                pool.close_input()
+        
+        def run_upgrade(task):
+            try:
+                upgrade_and_submit(task)
+            finally:
+                with upgrade_lock:
+                    upgrading['count'] -= 1
+                    close_input_when_idle()
+        
+        def upgrade_in_background(task):
+            """Legacy file: LibreOffice upgrade on the upgrader threads, then into the pool"""
+            with upgrade_lock:
+                upgrading['count'] += 1
+                pool.open_input()
+            upgrader.submit(run_upgrade, task)
+        
+        hashes = {}  # Manifest SHA-256 of queued files, reused by the cache lookup and dedup
+        
+        def scanned_documents():
+            yield from iter_pending_documents(entries, progress, scan_totals, hashes=hashes)
+            if watcher is not None:
+                print(f"\nCatch-up scan done, watching {DOCUMENTS_ROOT} for new documents ({watcher.backend})")
+                yield from iter_pending_documents(watcher.events(), progress, scan_totals, live=True,
+                                                  hashes=hashes)
+        
+        def pending_documents():
+            if leases is None:
+                return scanned_documents()
+            prefetch = (PROCESS_WORKERS - reserved) * (1 + DISTRIBUTED_PREFETCH)
+            return leases.claimed(scanned_documents(),
+                                  has_capacity=lambda: len(pool.pending) + pool.busy_count() < prefetch,
+                                  on_skip=lambda path: skip_leased(scan_totals, hashes, path))
+        
+        def submit_document(doc_path, file_hash):
+            features = document_features(doc_path)
+            task = {'path': doc_path, 'file_hash': file_hash, 'queued_at': time.time()}
+            task['predicted'] = model.predict(features) if model is not None else 0.0
+            if model is not None and LONGEST_JOB_FIRST:
+                task['priority'] = task['predicted']
+            task['timeout'] = document_timeout(features, task['predicted'], DOC_TIMEOUT_BASE,
+                                               DOC_TIMEOUT_PER_PAGE, DOC_TIMEOUT_PER_MB,
+                                               DOC_TIMEOUT_FACTOR)
+            if office_pool is not None and os.path.splitext(doc_path)[1].lower() in LEGACY_TARGETS:
+                upgrade_in_background(task)
+            else:
+                pool.submit(task)
+        
+        def submit_interactive(request):
+            """Spool thread: one urgent document, ahead of the whole bulk queue"""
+            features = document_features(request['path'])
+            task = {'path': request['path'], 'lane': INTERACTIVE, 'request': request,
+                    'output_path': request['output_path'], 'queued_at': time.time()}
+            task['timeout'] = document_timeout(features, model.predict(features) if model is not None else 0.0,
+                                               DOC_TIMEOUT_BASE, DOC_TIMEOUT_PER_PAGE, DOC_TIMEOUT_PER_MB,
+                                               DOC_TIMEOUT_FACTOR)
+            print(f"  INTERACTIVE: {os.path.basename(request['path'])} queued ahead of {len(pool.pending)} bulk tasks")
+            if office_pool is not None and os.path.splitext(request['path'])[1].lower() in LEGACY_TARGETS:
+                upgrade_and_submit(task)
+            else:
+                pool.submit(task)
+        
+        def finish_interactive(task, result):
+            if 'convert_path' in task:
+                office_pool.discard(task['convert_path'])
+            if result.get('success'):
+                result['pages'] = result['metrics']['pages']
+            latency = spool.complete(task['request'], result)
+            status = (f"OK ({result['elapsed']:.1f}s, {result['route']})" if result.get('success')
+                      else f"FAIL: {result['error'][:80]}")
+            target = "" if latency <= INTERACTIVE_LATENCY_TARGET else f" - over the {INTERACTIVE_LATENCY_TARGET:.0f}s target"
+            print(f"  INTERACTIVE: {os.path.basename(task['path'])} {status}, "
+                  f"answered {latency:.1f}s after the request{target}")
+        
+        def resolve_duplicates(doc_path, success):
+            """Canonical finished: link the copies waiting for it (or convert one if it failed)"""
+            for dup_path, match in index.resolve(doc_path, success):
+                if match is None or not report_duplicate(dup_path, match, progress, scan_totals):
+                    submit_document(dup_path, None)
+        
+        def produce():
+            try:
+                for doc_path in pending_documents():
+                    file_hash = hashes.pop(doc_path, None)
+                    if cache is None and SKIP_EXISTING and os.path.exists(get_output_path(doc_path)):
+                        progress.mark_completed(doc_path)
+                        scan_totals['queued'] -= 1
+                        continue
+                    if index is not None:
+                        convert, file_hash = claim_document(doc_path, progress, index, scan_totals, file_hash)
+                        if not convert:
+                            continue
+                    hit, file_hash = lookup_cache(doc_path, progress, cache, file_hash)
+                    if hit:
+                        scan_totals['cache_hits'] += 1
+                        print(f"  CACHE HIT: {os.path.basename(doc_path)}")
+                        if index is not None:
+                            resolve_duplicates(doc_path, True)
+                        continue
+                    submit_document(doc_path, file_hash)
+            finally:
+                with upgrade_lock:
+                    upgrading['producing'] = False
+                    close_input_when_idle()
+        
+        def handle_result(task, result):
+            """Bulk result: journal, cache, metrics, retries, waiting duplicates"""
+            doc_path = task['path']
+            file_name = os.path.basename(doc_path)
             
-            # Show progress
-            total_elapsed = time.time() - start_time
-            avg_time = total_elapsed / stats["processed"]
-            remaining_time = avg_time * (len(remaining) - i)
+            if result.get('killed') or task.get('upgrade_killed'):
+                # Timeout / worker crash: retry at the back of the queue until quarantined
+                # (memory kills were already retried by the pool, LibreOffice timeouts count per run)
+                if progress.add_strike(doc_path, result['error'], QUARANTINE_AFTER):
+                    print(f"  QUARANTINED: {file_name} (skipped by later runs until cleared)")
+                    result['error'] += " - quarantined"
+                elif result.get('killed') in ('timeout', 'crash'):
+                    print(f"  RETRY LATER: {file_name}: {result['error']}")
+                    task['priority'] = -1
+                    pool.submit(task)
+                    return
             
-            print()
-            print(f"PROGRESS: {stats['processed']}/{len(remaining)} ({stats['processed']/len(remaining)*100:.1f}%)")
-            print(f"  Success: {stats['processed'] - stats['errors']}")
-            print(f"  Errors: {stats['errors']}")
-            print(f"  Elapsed: {total_elapsed/60:.1f} min")
-            print(f"  Estimated remaining: {remaining_time/60:.1f} min")
-            print()
+            stats["processed"] += 1
+            if 'convert_path' in task:
+                office_pool.discard(task['convert_path'])
+            
+            if result['success']:
+                if cache is not None:
+                    with open(get_output_path(doc_path), 'r', encoding='utf-8') as f:
+                        cache.put(task['file_hash'], f.read())
+                progress.mark_completed(doc_path, task['file_hash'], result['elapsed'])
+                throughput.record(doc_path, result['route'], result['elapsed'])
+                stage_metrics.add(result['metrics'])
+                if model is not None:
+                    model.record(doc_path, task['predicted'], result['elapsed'])
+                latency = f", ready {time.time() - task['queued_at']:.1f}s after queueing" if watcher else ""
+                print(f"  OK: {file_name} ({result['elapsed']:.1f}s, {result['route']}, {result['chars']} chars, "
+                      f"{result['vn_chars']} VN chars{latency})")
+            else:
+                stats["errors"] += 1
+                progress.mark_failed(doc_path, result['error'])
+                log_error(doc_path, result['error'])
+                print(f"  FAIL: {file_name}: {result['error'][:80]}")
+            
+            if index is not None:
+                resolve_duplicates(doc_path, result['success'])
+            
+            # Show progress every 10 files (each file is already committed)
+            if stats["processed"] % 10 == 0:
+                show_progress(start_time, scan_totals)
+        
+        pool.open_input()
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        if INTERACTIVE_LANE:
+            spool = InteractiveSpool(INTERACTIVE_SPOOL, submit_interactive,
+                                     {"script": "batch_rag_universal", "workers": PROCESS_WORKERS,
+                                      "reserved": reserved, "extensions": sorted(SUPPORTED_EXTENSIONS)}).start()
+            print(f"Interactive lane: {INTERACTIVE_SPOOL} (target {INTERACTIVE_LATENCY_TARGET:.0f}s)")
+        
+        try:
+            for task, result in pool.run():
+                if task.get('lane') == INTERACTIVE:
+                    finish_interactive(task, result)
+                    continue
+                handle_result(task, result)
+        finally:
+            if spool is not None:
+                spool.stop()
+        
+        producer.join()
+        if upgrader is not None:
+            upgrader.shutdown(wait=True)
+    
+    print()
+    print_scan_totals(scan_totals)
+    if spool is not None:
+        print("INTERACTIVE LANE:")
+        for line in spool.report():
+            print(f"  {line}")
+    print("WORKER MEMORY:")
+    for line in pool.memory_report():
+        print(f"  {line}")
+
+def plan_sample_task(task, converter):
+    """Worker-side --plan sample: convert into the parent's scratch dir, report markdown bytes"""
+    if 'upgrade_error' in task:
+        raise LegacyConversionError(task['upgrade_error'])
+    
+    if task.get('page_range'):
+        markdown = docling_chunk_converter(converter, task['path'])(tuple(task['page_range']))
+        return {"success": True, "bytes": len(markdown.encode('utf-8'))}
+    
+    output_path = os.path.join(task['sample_dir'], f"sample_{os.getpid()}.md")
+    try:
+        convert_with_router(task.get('convert_path', task['path']), output_path, converter,
+                            NATIVE_FAST_PATHS, STREAM_EXPORT_PAGES)
+        return {"success": True, "bytes": os.path.getsize(output_path)}
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+def plan_batch(progress, model, office_pool, workers, budget):
+    """--plan: sample the remaining documents with the real pipeline and project the batch"""
+    print(f"PLAN (dry run, nothing is written to {DOCUMENTS_ROOT})")
+    completed = progress.completed_paths()
+    quarantined = progress.quarantined_paths()
+    inventory = []
+    for path, st in scan_documents(DOCUMENTS_ROOT, SUPPORTED_EXTENSIONS):
+        if path in completed or path in quarantined:
+            continue
+        features = document_features(path, st.st_size)
+        features['path'] = path
+        inventory.append(features)
+    print(f"  {len(inventory)} documents still to convert "
+          f"({len(completed)} done, {len(quarantined)} quarantined)")
+    if not inventory:
+        return
+    
+    # Owned by the parent: a killed sample can't clean up after itself
+    sample_dir = tempfile.mkdtemp(prefix="qsm_plan_")
+    
+    def prepare(task):
+        task['sample_dir'] = sample_dir
+        if office_pool is not None and os.path.splitext(task['path'])[1].lower() in LEGACY_TARGETS:
+            try:
+                task['convert_path'] = office_pool.upgrade(task['path'])
+            except Exception as e:
+                task['upgrade_error'] = f"LibreOffice upgrade failed: {e}"
+    
+    def cleanup(task):
+        if 'convert_path' in task:
+            office_pool.discard(task['convert_path'])
+    
+    print(f"  Sampling up to {budget} conversions on 1 worker (stratified by format, size, text layer)...")
+    try:
+        plan = run_plan(inventory, setup_worker_converter, plan_sample_task, model, workers, budget,
+                        prepare_fn=prepare, cleanup_fn=cleanup)
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+    
+    print()
+    print_plan(plan)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Universal document RAG batch conversion")
+    parser.add_argument('--plan', action='store_true',
+                        help="dry run: time a stratified sample and project hours, memory and output size")
+    parser.add_argument('--workers', type=int, default=None,
+                        help=f"worker count for --plan projections (default {PROCESS_WORKERS})")
+    parser.add_argument('--plan-samples', type=int, default=PLAN_SAMPLE_BUDGET,
+                        help="sampled conversions for --plan")
+    parser.add_argument('--watch', action='store_true',
+                        help="daemon mode: catch up, then convert new/changed documents as they land "
+                             "(no confirmation prompt, runs until Ctrl+C)")
+    parser.add_argument('--distributed', metavar='QUEUE_DIR', default=DISTRIBUTED_QUEUE,
+                        help="multi-node mode: share the work with other machines through lease files "
+                             "in QUEUE_DIR (a folder on the shared filesystem)")
+    parser.add_argument('--list-quarantine', action='store_true',
+                        help="show files skipped after repeated timeouts / worker crashes")
+    parser.add_argument('--clear-quarantine', nargs='*', metavar='PATH',
+                        help="release quarantined files (all if no path is given)")
+    return parser.parse_args()
+
+def manage_quarantine(args):
+    """Handle --list-quarantine / --clear-quarantine. Returns True if the run should stop."""
+    if not args.list_quarantine and args.clear_quarantine is None:
+        return False
     
-    # Final save
-    save_progress(progress)
+    progress = ProgressJournal(PROGRESS_DB)
+    try:
+        if args.clear_quarantine is not None:
+            cleared = progress.clear_quarantine(args.clear_quarantine or None)
+            print(f"Released {cleared} quarantined files")
+        if args.list_quarantine:
+            entries = progress.list_quarantine()
+            print(f"Quarantined files: {len(entries)}")
+            for path, strikes, reason, updated_at in entries:
+                print(f"  {path}")
+                print(f"    {strikes} strikes, last: {reason} ({updated_at})")
+    finally:
+        progress.close()
+    return True
 
 def main():
     """Main entry point"""
+    args = parse_args()
+    if manage_quarantine(args):
+        return
+    
     print("="*80)
     print("UNIVERSAL DOCUMENT RAG - PDF + OFFICE FORMATS")
     print("="*80)
@@ -281,52 +969,132 @@ def main():
         print(f"ERROR: Documents folder not found: {DOCUMENTS_ROOT}")
         return
     
-    # Setup
-    converter = setup_docling_converter()
+    # Setup (process mode: converters are built inside the workers)
+    if STAGE_METRICS:
+        stage_metrics.configure(METRICS_LOG, METRICS_PROM, job="batch_rag_universal")
+    pipeline_options = build_pipeline_options()
+    converter = setup_docling_converter(pipeline_options) if EXECUTION_MODE == "sequential" and not (args.watch or args.plan) else None
     progress = load_progress()
-    documents, by_format = find_all_documents(DOCUMENTS_ROOT)
+    model = build_cost_model(progress, SAMPLE_RESULTS_FILE)
+    office_pool = open_office_pool()
+    index = None
+    if DEDUP and not args.plan:
+        index = load_index(progress)
+        print(f"Dedup: {len(index)} converted documents indexed"
+              f"{'' if DEDUP_NEAR else ' (exact duplicates only)'}")
     
-    if not documents:
-        print("ERROR: No supported documents found!")
+    leases = None
+    if args.distributed and not args.plan:
+        leases = LeaseQueue(args.distributed, DOCUMENTS_ROOT).start()
+        progress.on_record = leases.complete
+        print(f"Distributed: node {leases.node}, lease queue {args.distributed}")
+    
+    if args.plan:
+        try:
+            plan_batch(progress, model, office_pool, args.workers or PROCESS_WORKERS, args.plan_samples)
+        finally:
+            progress.close()
+            if office_pool is not None:
+                office_pool.close()
         return
     
-    stats["total_files"] = len(documents)
-    stats["by_format"] = by_format
+    cache = None
+    if USE_CONVERSION_CACHE:
+        fingerprint = options_fingerprint(pipeline_options, pipeline_options.ocr_options,
+                                          {'native_fast_paths': NATIVE_FAST_PATHS,
+                                           'stream_export_pages': STREAM_EXPORT_PAGES})
+        cache = ConversionCache(CACHE_DIR, fingerprint, CACHE_MAX_BYTES)
+        print(f"Conversion cache: {CACHE_DIR} (options fingerprint {fingerprint})")
     
     # Confirm with user
     print()
-    print(f"WARNING: ABOUT TO PROCESS {len(documents)} DOCUMENTS")
-    total_size = sum(os.path.getsize(d) for d in documents if os.path.exists(d))
-    print(f"  Total size: {total_size/1024/1024:.0f} MB")
+    if STREAMING_SCAN:
+        # Scan runs concurrently with conversion, totals are reported as they grow
+        entries = scan_documents(DOCUMENTS_ROOT, SUPPORTED_EXTENSIONS)
+        print(f"WARNING: ABOUT TO PROCESS ALL SUPPORTED DOCUMENTS IN {DOCUMENTS_ROOT}")
+        print(f"  Scan runs while converting (running totals every {SCAN_REPORT_EVERY} files)")
+    else:
+        entries, by_format, total_size = find_all_documents(DOCUMENTS_ROOT)
+        if not entries:
+            print("ERROR: No supported documents found!")
+            return
+        stats["total_files"] = len(entries)
+        stats["by_format"] = by_format
+        print()
+        print(f"WARNING: ABOUT TO PROCESS {len(entries)} DOCUMENTS")
+        print(f"  Total size: {total_size/1024/1024:.0f} MB")
     print(f"  Output: Markdown files in same folders as source")
-    print(f"  Progress saved to: {PROGRESS_FILE}")
+    print(f"  Progress saved to: {PROGRESS_DB}")
     print(f"  Errors logged to: {ERROR_LOG}")
     print()
     
-    response = input("Continue? (y/n): ")
-    if response.lower() != 'y':
-        print("Cancelled by user")
-        return
+    watcher = None
+    if args.watch:
+        # Started before the catch-up scan so files landing meanwhile are not missed
+        watcher = FolderWatcher(DOCUMENTS_ROOT, SUPPORTED_EXTENSIONS, WATCH_DEBOUNCE_SECONDS).start()
+        print(f"WATCH MODE: {watcher.backend}, {WATCH_DEBOUNCE_SECONDS:.0f}s debounce - Ctrl+C to stop")
+    else:
+        response = input("Continue? (y/n): ")
+        if response.lower() != 'y':
+            print("Cancelled by user")
+            return
     
     # Start processing
     try:
-        batch_process_documents(documents, converter, progress)
+        if watcher is not None:
+            # Always the warm worker pool: models stay loaded between arrivals
+            batch_process_documents_multiprocess(entries, progress, cache, model, office_pool, watcher, index,
+                                                 leases)
+        elif EXECUTION_MODE == "process":
+            batch_process_documents_multiprocess(entries, progress, cache, model, office_pool, index=index,
+                                                 leases=leases)
+        else:
+            batch_process_documents(entries, converter, progress, cache, model, office_pool, index, leases)
         
         print("\n" + "="*80)
         print("BATCH PROCESSING COMPLETE!")
         print("="*80)
         print()
         print("FINAL STATISTICS:")
-        print(f"  Total files: {stats['total_files']}")
         print(f"  Processed: {stats['processed'] - stats['errors']}")
+        if EXECUTION_MODE == "process" and cache is not None:
+            print(f"  From cache: {cache.stats['hits']}")
         print(f"  Errors: {stats['errors']}")
         print()
         
         print("BY FORMAT:")
-        for ext, counts in progress.get('by_format', {}).items():
+        for ext, counts in progress.by_format().items():
             print(f"  {ext}: {counts['success']} success, {counts['failed']} failed")
         print()
         
+        print("THROUGHPUT BY FORMAT (this run, worker seconds):")
+        for line in throughput.report():
+            print(f"  {line}")
+        print()
+        
+        if STAGE_METRICS:
+            print(f"STAGE TIMINGS (worker seconds, events in {METRICS_LOG}):")
+            for line in stage_metrics.report():
+                print(f"  {line}")
+            print()
+        
+        if cache is not None:
+            print(f"CACHE: {cache.summary()}")
+            print()
+        
+        if office_pool is not None:
+            print(f"LIBREOFFICE: {office_pool.summary()}")
+            print()
+        
+        if leases is not None:
+            print(f"LEASE QUEUE: {leases.summary()}")
+            print()
+        
+        print("COST MODEL (predicted vs actual):")
+        for line in model.accuracy_report():
+            print(f"  {line}")
+        print()
+        
         if stats['errors'] > 0:
             print(f"WARNING: Check error log: {ERROR_LOG}")
         
@@ -336,12 +1104,22 @@ def main():
     except KeyboardInterrupt:
         print("\n\nINTERRUPTED BY USER")
         print("Progress has been saved. Run again to resume.")
-        save_progress(progress)
+        if PAGE_CHECKPOINTS and STREAM_EXPORT_PAGES:
+            print(f"Long PDFs in progress resume from their last checkpoint ({STREAM_EXPORT_PAGES}-page chunks).")
     
     except Exception as e:
         print(f"\n\nFATAL ERROR: {e}")
-        save_progress(progress)
         raise
+    
+    finally:
+        if watcher is not None:
+            watcher.stop()
+        if leases is not None:
+            # Unfinished documents go back to the other nodes right away
+            leases.stop()
+        progress.close()
+        if office_pool is not None:
+            office_pool.close()
 
 if __name__ == "__main__":
     main()
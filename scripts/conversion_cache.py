@@ -0,0 +1,159 @@
+"""
+Content-Addressed Conversion Cache
+==================================
+
+Cache kết quả markdown theo:
+- SHA-256 của nội dung file (đổi tên / copy sang thư mục khác vẫn hit)
+- Fingerprint của PdfPipelineOptions / EasyOcrOptions (đổi images_scale,
+  force_full_page_ocr... thì key khác, không dùng nhầm output cũ)
+
+Giới hạn dung lượng, xóa entry ít dùng nhất (LRU theo mtime) khi vượt.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+from typing import Optional
+
+HASH_CHUNK_SIZE = 1024 * 1024  # 1 MB
+
+
+def get_file_hash(filepath: str) -> Optional[str]:
+    """Calculate SHA256 hash of file (same digest as test_batch_100.get_file_hash)"""
+    hash_sha256 = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                hash_sha256.update(chunk)
+        return hash_sha256.hexdigest()
+    except OSError:
+        return None
+
+
+def _options_to_dict(options):
+    """Best-effort serialisation of Docling option objects (pydantic v2/v1 or plain)"""
+    if options is None:
+        return None
+    if hasattr(options, 'model_dump'):
+        return options.model_dump(mode='json')
+    if hasattr(options, 'dict'):
+        return json.loads(options.json())
+    if isinstance(options, dict):
+        return options
+    return repr(options)
+
+
+def options_fingerprint(*options) -> str:
+    """
+    Stable short fingerprint of the pipeline/OCR options + Docling version
+
+    PdfPipelineOptions already embeds its ocr_options, but passing the OCR
+    options separately is harmless and keeps the key explicit.
+    """
+    try:
+        from importlib.metadata import version
+        docling_version = version('docling')
+    except Exception:
+        docling_version = 'unknown'
+
+    payload = {
+        'docling': docling_version,
+        'options': [_options_to_dict(o) for o in options],
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+class ConversionCache:
+    """On-disk markdown cache: <cache_dir>/<hash[:2]>/<hash>-<fingerprint>.md"""
+
+    def __init__(self, cache_dir: str, fingerprint: str, max_bytes: int = 2 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.fingerprint = fingerprint
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _entry_path(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, file_hash[:2], f"{file_hash}-{self.fingerprint}.md")
+
+    def _entries(self):
+        """Yield (path, size, mtime) for every cached entry"""
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.md'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def get(self, file_hash: Optional[str]) -> Optional[str]:
+        """Return cached markdown for this content + options, or None"""
+        if not file_hash:
+            self.stats["misses"] += 1
+            return None
+
+        path = self._entry_path(file_hash)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except OSError:
+            self.stats["misses"] += 1
+            return None
+
+        # Touch for LRU ordering
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.stats["hits"] += 1
+        return content
+
+    def put(self, file_hash: Optional[str], markdown: str):
+        """Store markdown (atomic write), then evict if over the size cap"""
+        if not file_hash:
+            return
+
+        path = self._entry_path(file_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(markdown)
+        os.replace(tmp_path, path)
+
+        self.total_bytes += os.path.getsize(path) - old_size
+        self.stats["stores"] += 1
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete least-recently-used entries until under 90% of the cap"""
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self.total_bytes = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+            self.stats["evicted"] += 1
+
+    def summary(self) -> str:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = self.stats["hits"] / lookups * 100 if lookups else 0
+        return (f"{self.stats['hits']} hits / {lookups} lookups ({hit_rate:.1f}%), "
+                f"{self.stats['stores']} stored, {self.stats['evicted']} evicted, "
+                f"{self.total_bytes / 1024 / 1024:.0f} MB used")
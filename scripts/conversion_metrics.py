@@ -0,0 +1,236 @@
+"""
+Per-Stage Conversion Metrics
+============================
+
+Một con số `elapsed` mỗi file không cho biết thời gian đi vào đâu. Module này:
+- Bật settings.debug.profile_pipeline_timings của Docling -> ConversionResult.timings
+  có thời gian từng stage (page_init = parse + rasterize, ocr, layout,
+  table_structure, page_assemble, reading_order, ...) theo từng trang / batch
+- Đo thêm markdown export, số trang, số ô text do OCR sinh ra, bytes ghi ra
+- Mỗi document (hoặc shard) -> 1 event JSONL; tổng hợp -> Prometheus textfile
+  (node_exporter textfile collector) + bảng tổng kết cuối batch
+Trong worker: `with measure(path) as m:` rồi dùng export_markdown(result) thay cho
+result.document.export_to_markdown(); m.event(...) gửi về parent.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+_active = threading.local()
+
+PROM_WRITE_EVERY = 10  # Rewrite the textfile every N events (and at the end)
+PAGE_SAMPLE_LIMIT = 50000  # Most recent per-page times kept per stage for the p95 column
+
+
+def enable_pipeline_timings() -> bool:
+    """Turn on Docling's per-stage profiling (must run in every worker process)"""
+    try:
+        from docling.datamodel.settings import settings
+        settings.debug.profile_pipeline_timings = True
+        return True
+    except (ImportError, AttributeError):
+        return False
+
+
+def count_ocr_cells(result) -> int:
+    """Text cells produced by OCR (vs. read from the PDF text layer)"""
+    count = 0
+    for page in getattr(result, 'pages', None) or []:
+        parsed = getattr(page, 'parsed_page', None)
+        cells = getattr(parsed, 'textline_cells', None) if parsed is not None else None
+        if cells is None:
+            cells = getattr(page, 'cells', None) or []
+        count += sum(1 for cell in cells if getattr(cell, 'from_ocr', False))
+    return count
+
+
+class DocumentMetrics:
+    """Stage timings of one document (or shard), summed over its Docling conversions"""
+
+    def __init__(self, path: str, page_range: Optional[Tuple[int, int]] = None):
+        self.path = path
+        self.page_range = page_range
+        self.stages = {}  # stage -> seconds
+        self.per_page = {}  # page-scoped stage -> [seconds per page / page batch]
+        self.pages = 0
+        self.ocr_cells = 0
+        self.conversions = 0
+
+    def add_result(self, result, export_seconds: float):
+        self.conversions += 1
+        self.pages += len(getattr(result, 'pages', None) or [])
+        for stage, item in (getattr(result, 'timings', None) or {}).items():
+            times = list(getattr(item, 'times', None) or [])
+            self.stages[stage] = self.stages.get(stage, 0.0) + sum(times)
+            scope = getattr(getattr(item, 'scope', None), 'value', None)
+            if scope == 'page':
+                self.per_page.setdefault(stage, []).extend(round(t, 4) for t in times)
+        self.stages['markdown_export'] = self.stages.get('markdown_export', 0.0) + export_seconds
+        self.ocr_cells += count_ocr_cells(result)
+
+    def event(self, route: str, elapsed: float, output_path: Optional[str] = None) -> Dict:
+        """JSON-serializable record sent back to the parent"""
+        try:
+            bytes_written = os.path.getsize(output_path) if output_path else 0
+        except OSError:
+            bytes_written = 0
+        return {
+            "path": self.path,
+            "page_range": list(self.page_range) if self.page_range else None,
+            "route": route,
+            "elapsed": round(elapsed, 3),
+            "pages": self.pages,
+            "pages_per_sec": round(self.pages / elapsed, 3) if elapsed > 0 and self.pages else None,
+            "ocr_cells": self.ocr_cells,
+            "bytes_written": bytes_written,
+            "stages": {k: round(v, 4) for k, v in self.stages.items()},
+            "per_page": self.per_page,
+        }
+
+
+@contextmanager
+def measure(path: str, page_range: Optional[Tuple[int, int]] = None):
+    """Collect export_markdown() calls made on this thread into one DocumentMetrics"""
+    metrics = DocumentMetrics(path, page_range)
+    previous = getattr(_active, 'current', None)
+    _active.current = metrics
+    try:
+        yield metrics
+    finally:
+        _active.current = previous
+
+
+def export_markdown(result) -> str:
+    """result.document.export_to_markdown(), timed and recorded into the active measure()"""
+    start_time = time.time()
+    markdown = result.document.export_to_markdown()
+    metrics = getattr(_active, 'current', None)
+    if metrics is not None:
+        metrics.add_result(result, time.time() - start_time)
+    return markdown
+
+
+def record_stage(stage: str, seconds: float):
+    """Page-scoped work done outside Docling (e.g. scan preprocessing), recorded into the active measure()"""
+    metrics = getattr(_active, 'current', None)
+    if metrics is not None:
+        metrics.stages[stage] = metrics.stages.get(stage, 0.0) + seconds
+        metrics.per_page.setdefault(stage, []).append(round(seconds, 4))
+
+
+class StageMetrics:
+    """Parent-side aggregate: JSONL event log, Prometheus textfile, summary table"""
+
+    def __init__(self, jsonl_path: Optional[str] = None, prom_path: Optional[str] = None,
+                 job: str = "batch_rag"):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.job = job
+        self.documents = {}  # route -> count
+        self.stages = {}  # stage -> seconds
+        self.page_times = {}  # page-scoped stage -> deque of recent per-page seconds
+        self.pages = 0
+        self.ocr_cells = 0
+        self.bytes_written = 0
+        self.elapsed = 0.0
+        self.events = 0
+        self._lock = threading.Lock()  # thread mode adds from several threads
+
+    def configure(self, jsonl_path: Optional[str], prom_path: Optional[str], job: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        if job:
+            self.job = job
+
+    def add(self, event: Optional[Dict]):
+        if not event:
+            return
+        with self._lock:
+            self._add(event)
+
+    def _add(self, event: Dict):
+        route = event.get("route", "").split(" ")[0] or "unknown"
+        self.documents[route] = self.documents.get(route, 0) + 1
+        for stage, seconds in event.get("stages", {}).items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        for stage, times in event.get("per_page", {}).items():
+            self.page_times.setdefault(stage, deque(maxlen=PAGE_SAMPLE_LIMIT)).extend(times)
+        self.pages += event.get("pages", 0)
+        self.ocr_cells += event.get("ocr_cells", 0)
+        self.bytes_written += event.get("bytes_written", 0)
+        self.elapsed += event.get("elapsed", 0.0)
+        self.events += 1
+
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({"time": datetime.now().isoformat(), **event}, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"WARNING: Could not write metrics log: {e}")
+        if self.events % PROM_WRITE_EVERY == 0:
+            self.write_prometheus()
+
+    def write_prometheus(self):
+        """Atomic rewrite (node_exporter must never read a half-written file)"""
+        if not self.prom_path:
+            return
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in [("job", self.job)] + labels)
+                lines.append(f"{name}{{{label_text}}} {value:.10g}")
+
+        metric("qsm_conversion_documents_total", "counter", "Converted documents/shards by route",
+               [([("route", r)], n) for r, n in sorted(self.documents.items())])
+        metric("qsm_conversion_stage_seconds_total", "counter", "Worker seconds per conversion stage",
+               [([("stage", s)], v) for s, v in sorted(self.stages.items())])
+        metric("qsm_conversion_seconds_total", "counter", "Worker seconds per document, all stages",
+               [([], self.elapsed)])
+        metric("qsm_conversion_pages_total", "counter", "Pages converted by Docling", [([], self.pages)])
+        metric("qsm_conversion_ocr_cells_total", "counter", "Text cells produced by OCR", [([], self.ocr_cells)])
+        metric("qsm_conversion_bytes_written_total", "counter", "Markdown bytes written",
+               [([], self.bytes_written)])
+        metric("qsm_conversion_pages_per_second", "gauge", "Pages per worker second",
+               [([], self.pages / self.elapsed if self.elapsed else 0.0)])
+        metric("qsm_conversion_last_update_timestamp_seconds", "gauge", "Last textfile update",
+               [([], time.time())])
+
+        tmp_path = f"{self.prom_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, self.prom_path)
+        except OSError as e:
+            print(f"WARNING: Could not write Prometheus textfile: {e}")
+
+    def report(self) -> List[str]:
+        """
+        Summary table: where the worker time went, per stage
+
+        Docling's document-level stages (pipeline_total, doc_build) contain the
+        page-level ones, so shares add up to more than 100%.
+        """
+        if not self.events:
+            return ["(no conversions measured)"]
+        lines = [f"{'stage':<22}{'total s':>10}{'share':>8}{'ms/page':>10}{'p95 ms':>10}"]
+        for stage, seconds in sorted(self.stages.items(), key=lambda kv: -kv[1]):
+            share = seconds / self.elapsed if self.elapsed else 0.0
+            per_page = f"{seconds / self.pages * 1000:.0f}" if self.pages else "-"
+            times = sorted(self.page_times.get(stage, []))
+            p95 = f"{times[int(0.95 * (len(times) - 1))] * 1000:.0f}" if times else "-"
+            lines.append(f"{stage:<22}{seconds:>10.1f}{share:>8.0%}{per_page:>10}{p95:>10}")
+        pages_per_sec = self.pages / self.elapsed if self.elapsed else 0.0
+        routes = ", ".join(f"{r}: {n}" for r, n in sorted(self.documents.items()))
+        lines.append(f"{self.events} conversions ({routes}), {self.pages} pages, "
+                     f"{pages_per_sec:.2f} pages/worker-sec, {self.ocr_cells} OCR cells, "
+                     f"{self.bytes_written / 1024 / 1024:.1f} MB written")
+        return lines
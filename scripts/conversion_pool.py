@@ -0,0 +1,403 @@
+"""
+Conversion Worker Pool
+======================
+
+Process pool cho Docling conversion (thay cho ThreadPoolExecutor dùng chung converter):
+- Mỗi worker process tạo DocumentConverter MỘT lần rồi giữ warm
+- Parent giữ hàng đợi chung, phát file cho worker nào đang rảnh
+- Hàng đợi ưu tiên theo task['priority'] (vd. thời gian dự đoán -> việc nặng trước)
+- Kết quả và tiến độ stream về parent qua pipe riêng của từng worker
+- Worker chết giữa chừng -> file đó báo lỗi, worker được khởi động lại
+- Watchdog RSS (psutil): worker được thay mới sau N task hoặc khi vượt trần bộ
+  nhớ (task đang chạy được đưa lại vào hàng đợi); peak RSS từng worker được ghi lại
+- task['timeout'] (giây): quá hạn -> kill worker, báo lỗi, khởi động worker mới
+- Hai làn: task['lane'] == 'interactive' (1 file người dùng đang chờ) luôn được phát
+  trước hàng bulk ở ranh giới document kế tiếp; reserved_workers worker warm chỉ
+  nhận việc interactive nên file khẩn không phải chờ file bulk nào chạy xong
+
+Layout, TableFormer và EasyOCR đều CPU-bound và giữ GIL, nên thread pool chỉ
+dùng được ~1 core. Với process pool mỗi worker có interpreter riêng.
+"""
+
+import os
+import time
+import heapq
+import itertools
+import threading
+import traceback
+import multiprocessing as mp
+from multiprocessing.connection import wait
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Spawn cho mọi nền tảng: fork sau khi torch đã load dễ treo
+MP_CONTEXT = mp.get_context("spawn")
+POLL_INTERVAL = 0.5  # seconds
+MEMORY_SAMPLE_INTERVAL = 2.0  # seconds between RSS samples
+MAX_MEMORY_REQUEUES = 1  # A task that blows the ceiling again after a requeue fails instead
+INTERACTIVE = "interactive"  # task['lane'] for single-document requests someone is waiting on
+
+
+def _worker_loop(worker_id, setup_fn, process_fn, conn):
+    """Worker process: build converter once, then convert tasks until sentinel"""
+    try:
+        converter = setup_fn()
+    except Exception as e:
+        conn.send(("init_failed", f"{type(e).__name__}: {e}"))
+        return
+
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        start_time = time.time()
+        try:
+            result = process_fn(task, converter)
+        except Exception as e:
+            result = {
+                "success": False,
+                "error": f"{type(e).__name__}: {e}",
+                "traceback": traceback.format_exc(),
+            }
+        result.setdefault("elapsed", time.time() - start_time)
+        result["worker_id"] = worker_id
+        conn.send(("done", result))
+
+
+class ConversionPool:
+    """
+    Pool of long-lived conversion worker processes
+
+    setup_fn() -> converter chạy một lần trong mỗi worker.
+    process_fn(task, converter) -> dict chạy cho từng task (task là dict có 'path').
+    Cả hai phải là hàm top-level (pickle được với spawn).
+
+    max_tasks_per_worker: thay worker mới sau N task (None = không giới hạn).
+    max_rss_mb: trần RSS mỗi worker. Vượt khi rảnh -> thay mới; vượt khi đang
+    chạy -> kill, task đưa lại vào hàng đợi (cần psutil).
+    reserved_workers: số worker (nằm trong `workers`) chỉ nhận task làn interactive.
+    """
+
+    def __init__(self, setup_fn, process_fn, workers=None, max_tasks_per_worker=None, max_rss_mb=None,
+                 reserved_workers=0):
+        self.setup_fn = setup_fn
+        self.process_fn = process_fn
+        self.num_workers = workers or os.cpu_count() or 1
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024 if max_rss_mb else None
+        if self.max_rss_bytes and psutil is None:
+            print("WARNING: psutil not installed, worker memory ceiling disabled")
+        self.recycle_stats = {"tasks": 0, "memory": 0, "killed": 0, "requeued": 0, "timeouts": 0}
+        self.retired = []  # (worker_id, completed, peak_rss, reason)
+        self._last_sample = 0.0
+        self.pending = []  # heap of (-priority, seq, task)
+        self.interactive = []  # same, interactive lane (always dispatched first)
+        self.reserved_workers = min(reserved_workers, self.num_workers - 1) if self.num_workers > 1 else 0
+        self._pending_lock = threading.Lock()
+        # Interactive submits wake run() instead of waiting for the next POLL_INTERVAL
+        self._wake_recv, self._wake_send = MP_CONTEXT.Pipe(duplex=False)
+        self._seq = itertools.count()
+        self.accepting = False  # True while a producer (e.g. the scanner) may still submit
+        self.workers = {}
+        self._next_worker_id = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(force=exc_type is not None)
+        return False
+
+    def start(self):
+        """Spawn all worker processes"""
+        for index in range(self.num_workers):
+            self._spawn_worker(reserved=index < self.reserved_workers)
+
+    def _spawn_worker(self, reserved=False):
+        worker_id = self._next_worker_id
+        self._next_worker_id += 1
+
+        # Một pipe riêng cho mỗi worker: worker bị kill không làm kẹt worker khác
+        parent_conn, child_conn = MP_CONTEXT.Pipe()
+        process = MP_CONTEXT.Process(
+            target=_worker_loop,
+            args=(worker_id, self.setup_fn, self.process_fn, child_conn),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+
+        self.workers[worker_id] = {
+            "process": process,
+            "conn": parent_conn,
+            "ready": False,
+            "task": None,
+            "started_at": None,
+            "completed": 0,
+            "rss": 0,
+            "peak_rss": 0,
+            "reserved": reserved,
+        }
+        return worker_id
+
+    def submit(self, task):
+        """
+        Add a task (dict with 'path') to the shared queue (thread-safe)
+
+        Higher task['priority'] is dispatched first; equal priorities keep FIFO order.
+        task['lane'] == INTERACTIVE goes ahead of every bulk task.
+        """
+        interactive = task.get('lane') == INTERACTIVE
+        with self._pending_lock:
+            heapq.heappush(self.interactive if interactive else self.pending,
+                           (-task.get('priority', 0), next(self._seq), task))
+        if interactive:
+            try:
+                self._wake_send.send(None)
+            except OSError:
+                pass
+
+    def open_input(self):
+        """Keep run() alive until close_input(), for producers that submit while running"""
+        self.accepting = True
+
+    def close_input(self):
+        self.accepting = False
+
+    def busy_count(self):
+        return sum(1 for w in self.workers.values() if w["task"] is not None)
+
+    def _dispatch(self):
+        """Hand pending tasks to idle, ready workers (interactive lane first, reserved workers first)"""
+        for worker in sorted(self.workers.values(), key=lambda w: not w["reserved"]):
+            if not (self.interactive or self.pending):
+                return
+            if worker["ready"] and worker["task"] is None:
+                with self._pending_lock:
+                    if self.interactive:
+                        task = heapq.heappop(self.interactive)[2]
+                    elif self.pending and not worker["reserved"]:
+                        task = heapq.heappop(self.pending)[2]
+                    else:
+                        continue
+                worker["task"] = task
+                worker["started_at"] = time.time()
+                worker["conn"].send(task)
+
+    def _check_all_failed(self, reason):
+        if not self.workers:
+            raise RuntimeError(f"All conversion workers failed to start: {reason}")
+        print(f"WARNING: A conversion worker failed to start: {reason}")
+
+    def _sample_memory(self):
+        """Update RSS / peak RSS per worker (process + children)"""
+        if psutil is None:
+            return
+        for worker in self.workers.values():
+            try:
+                proc = psutil.Process(worker["process"].pid)
+                rss = proc.memory_info().rss
+                for child in proc.children(recursive=True):
+                    rss += child.memory_info().rss
+            except (psutil.Error, ValueError):
+                continue
+            worker["rss"] = rss
+            worker["peak_rss"] = max(worker["peak_rss"], rss)
+
+    def _retire_worker(self, worker_id, reason, kill=False):
+        """Remove a worker (graceful stop, or kill) and start a fresh one in its place"""
+        worker = self.workers.pop(worker_id)
+        if kill:
+            worker["process"].kill()
+        else:
+            try:
+                worker["conn"].send(None)
+            except OSError:
+                pass
+        worker["process"].join(timeout=30)
+        if worker["process"].is_alive():
+            worker["process"].kill()
+            worker["process"].join(timeout=5)
+        worker["conn"].close()
+        self.retired.append((worker_id, worker["completed"], worker["peak_rss"], reason))
+        self._spawn_worker(worker["reserved"])
+        return worker
+
+    def _enforce_limits(self):
+        """
+        Recycle workers over their task count or memory ceiling
+
+        Returns:
+            (task, result) failures for tasks that exceeded the ceiling too often
+        """
+        failures = []
+        now = time.time()
+        if now - self._last_sample >= MEMORY_SAMPLE_INTERVAL:
+            self._last_sample = now
+            self._sample_memory()
+
+        for worker_id, worker in list(self.workers.items()):
+            if not worker["ready"]:
+                continue
+            task = worker["task"]
+            if task is not None and task.get("timeout") and now - worker["started_at"] > task["timeout"]:
+                # Hung conversion: only this slot is lost, and only until the timeout
+                self.recycle_stats["timeouts"] += 1
+                self._retire_worker(worker_id, f"timeout after {task['timeout']:.0f}s", kill=True)
+                failures.append((task, {
+                    "success": False,
+                    "error": f"Timed out after {task['timeout']:.0f}s",
+                    "elapsed": now - worker["started_at"],
+                    "worker_id": worker_id,
+                    "killed": "timeout",
+                }))
+                continue
+            over_memory = self.max_rss_bytes and worker["rss"] > self.max_rss_bytes
+            if worker["task"] is None:
+                if over_memory:
+                    self.recycle_stats["memory"] += 1
+                    self._retire_worker(worker_id, f"RSS {worker['rss'] / 1024 ** 2:.0f} MB")
+                elif self.max_tasks_per_worker and worker["completed"] >= self.max_tasks_per_worker:
+                    self.recycle_stats["tasks"] += 1
+                    self._retire_worker(worker_id, f"{worker['completed']} tasks")
+            elif over_memory:
+                # Mid-task: kill now rather than let the node swap, then retry the file
+                task, started_at = worker["task"], worker["started_at"]
+                self.recycle_stats["killed"] += 1
+                self._retire_worker(worker_id, f"RSS {worker['rss'] / 1024 ** 2:.0f} MB mid-task", kill=True)
+                requeues = task.get("memory_requeues", 0)
+                if requeues < MAX_MEMORY_REQUEUES:
+                    task["memory_requeues"] = requeues + 1
+                    self.recycle_stats["requeued"] += 1
+                    self.submit(task)
+                else:
+                    failures.append((task, {
+                        "success": False,
+                        "error": f"Worker memory ceiling exceeded ({worker['rss'] / 1024 ** 2:.0f} MB)",
+                        "elapsed": time.time() - started_at,
+                        "worker_id": worker_id,
+                        "killed": "memory",
+                    }))
+        return failures
+
+    def _memory_rows(self):
+        return list(self.retired) + [
+            (worker_id, w["completed"], w["peak_rss"], "running")
+            for worker_id, w in self.workers.items()
+        ]
+
+    def peak_rss(self):
+        """Highest RSS (bytes) seen on any worker, None without psutil"""
+        if psutil is None:
+            return None
+        return max((r[2] for r in self._memory_rows()), default=0)
+
+    def memory_report(self):
+        """Summary lines: peak RSS per worker and recycle counts"""
+        rows = self._memory_rows()
+        if psutil is None:
+            lines = ["psutil not installed, no RSS data"]
+        else:
+            lines = [f"Peak worker RSS: {self.peak_rss() / 1024 ** 2:.0f} MB"]
+        s = self.recycle_stats
+        lines.append(f"Recycled: {s['tasks']} after task limit, {s['memory']} over memory ceiling, "
+                     f"{s['killed']} killed mid-task ({s['requeued']} tasks requeued), {s['timeouts']} timeouts")
+        for worker_id, completed, peak_rss, reason in sorted(rows):
+            lines.append(f"  worker {worker_id}: {completed} tasks, peak {peak_rss / 1024 ** 2:.0f} MB ({reason})")
+        return lines
+
+    def _handle_dead_worker(self, worker_id):
+        """Drop a dead worker, respawn it and report its in-flight task"""
+        worker = self.workers.pop(worker_id)
+        worker["conn"].close()
+        worker["process"].join(timeout=5)
+        exitcode = worker["process"].exitcode
+        self.retired.append((worker_id, worker["completed"], worker["peak_rss"], f"crashed ({exitcode})"))
+
+        if not worker["ready"]:
+            # Chết khi đang khởi tạo: không respawn vô hạn
+            self._check_all_failed(f"exit code {exitcode}")
+            return None
+
+        self._spawn_worker(worker["reserved"])
+        if worker["task"] is None:
+            return None
+        return worker["task"], {
+            "success": False,
+            "error": f"Worker crashed (exit code {exitcode})",
+            "elapsed": time.time() - worker["started_at"],
+            "worker_id": worker_id,
+            "killed": "crash",
+        }
+
+    def run(self):
+        """
+        Process all submitted tasks
+
+        Yields:
+            (task, result) tuples as soon as each task finishes
+        """
+        while self.accepting or self.pending or self.interactive or self.busy_count():
+            yield from self._enforce_limits()
+            self._dispatch()
+
+            conn_to_worker = {w["conn"]: worker_id for worker_id, w in self.workers.items()}
+            for conn in wait(list(conn_to_worker) + [self._wake_recv], timeout=POLL_INTERVAL):
+                if conn is self._wake_recv:
+                    while self._wake_recv.poll():
+                        self._wake_recv.recv()
+                    self._dispatch()
+                    continue
+                worker_id = conn_to_worker[conn]
+                worker = self.workers[worker_id]
+
+                try:
+                    kind, payload = conn.recv()
+                except (EOFError, OSError):
+                    item = self._handle_dead_worker(worker_id)
+                    if item is not None:
+                        yield item
+                    continue
+
+                if kind == "ready":
+                    worker["ready"] = True
+                elif kind == "init_failed":
+                    self.workers.pop(worker_id)
+                    conn.close()
+                    self._check_all_failed(payload)
+                elif kind == "done":
+                    task = worker["task"]
+                    worker["task"] = None
+                    worker["started_at"] = None
+                    worker["completed"] += 1
+                    yield task, payload
+
+    def close(self, force=False):
+        """Stop all workers (force=True terminates without waiting)"""
+        self._sample_memory()
+        for worker_id, worker in self.workers.items():
+            self.retired.append((worker_id, worker["completed"], worker["peak_rss"], "end of run"))
+        for worker in self.workers.values():
+            if force:
+                worker["process"].terminate()
+            else:
+                try:
+                    worker["conn"].send(None)
+                except OSError:
+                    pass
+        for worker in self.workers.values():
+            worker["process"].join(timeout=5 if force else None)
+            worker["conn"].close()
+        self.workers.clear()
+        self._wake_send.close()
+        self._wake_recv.close()
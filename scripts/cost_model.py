@@ -0,0 +1,208 @@
+"""
+Document Cost Model (Longest-Job-First Scheduling)
+==================================================
+
+Dự đoán thời gian convert mỗi file TRƯỚC khi dispatch để xếp việc nặng lên
+trước (LJF) -> không còn cảnh 3 file scan khổng lồ chạy một mình ở cuối batch.
+
+Features: số trang (pypdfium2), dung lượng, định dạng, có text layer không.
+Model: seconds = a + b * pages + c * MB, hệ số riêng cho mỗi nhóm
+(định dạng, text layer), hiệu chỉnh từ timing đã ghi:
+- 'elapsed' trong progress journal (process_single_document / pool)
+- 'time_seconds' trong sample_test_results.json (test_sample_rag.py)
+"""
+
+import os
+import json
+from typing import Dict, List, Optional, Tuple
+
+from pdf_sharding import get_pdf_page_count
+from text_layer import analyze_pages
+
+# (intercept seconds, seconds/page, seconds/MB) priors, used until calibrated
+DEFAULT_COEFFICIENTS = {
+    ('.pdf', False): (5.0, 6.0, 0.5),   # scanned PDF: full-page OCR dominates
+    ('.pdf', True): (3.0, 1.2, 0.2),    # born-digital PDF
+    ('.docx', None): (1.0, 0.0, 0.8),
+    ('.doc', None): (3.0, 0.0, 1.5),
+    ('.xlsx', None): (1.0, 0.0, 2.0),
+    ('.xls', None): (3.0, 0.0, 3.0),
+    ('.pptx', None): (2.0, 0.0, 0.5),
+    ('.ppt', None): (4.0, 0.0, 1.0),
+}
+FALLBACK_COEFFICIENTS = (3.0, 0.0, 1.0)
+
+MIN_SAMPLES_PER_GROUP = 8
+TEXT_LAYER_SAMPLE_PAGES = 3
+
+
+def has_text_layer(pdf_path: str, sample_pages: int = TEXT_LAYER_SAMPLE_PAGES) -> Optional[bool]:
+    """Cheap check on the first pages' text layer. None if the PDF can't be read."""
+    decisions = analyze_pages(pdf_path, (1, sample_pages))
+    if decisions is None:
+        return None
+    if not decisions:
+        return False
+    return sum(1 for d in decisions if not d["ocr"]) * 2 > len(decisions)
+
+
+def document_features(path: str, size_bytes: Optional[int] = None) -> Dict:
+    """Features used by the cost model (cheap: no rendering)"""
+    ext = os.path.splitext(path)[1].lower()
+    if size_bytes is None:
+        try:
+            size_bytes = os.path.getsize(path)
+        except OSError:
+            size_bytes = 0
+
+    features = {"ext": ext, "size_mb": size_bytes / (1024 * 1024), "pages": 0, "text_layer": None}
+    if ext == '.pdf':
+        features["pages"] = get_pdf_page_count(path) or 0
+        features["text_layer"] = has_text_layer(path)
+        if features["text_layer"] is None:
+            features["text_layer"] = False
+    return features
+
+
+def document_timeout(features: Dict, predicted: float, base: float, per_page: float,
+                     per_mb: float, factor: float) -> float:
+    """
+    Hard wall-clock limit for one conversion
+
+    Scaled by page count (PDF) or size (other formats), and never below
+    `factor` times the model's prediction.
+    """
+    by_size = base + per_page * features["pages"] + per_mb * features["size_mb"]
+    return max(by_size, factor * predicted)
+
+
+def _group(features: Dict) -> Tuple:
+    text_layer = features["text_layer"] if features["ext"] == '.pdf' else None
+    return features["ext"], text_layer
+
+
+def _solve_least_squares(rows: List[Tuple[float, float, float]], targets: List[float]) -> Optional[Tuple]:
+    """
+    Ridge-regularised least squares for y = a + b*pages + c*mb (3x3 normal equations)
+
+    Returns:
+        (a, b, c) clamped to >= 0, or None if the system is degenerate
+    """
+    ridge = 1e-3
+    ata = [[0.0] * 3 for _ in range(3)]
+    aty = [0.0] * 3
+    for row, y in zip(rows, targets):
+        for i in range(3):
+            aty[i] += row[i] * y
+            for j in range(3):
+                ata[i][j] += row[i] * row[j]
+    for i in range(3):
+        ata[i][i] += ridge
+
+    # Gaussian elimination with partial pivoting
+    m = [ata[i] + [aty[i]] for i in range(3)]
+    for col in range(3):
+        pivot = max(range(col, 3), key=lambda r: abs(m[r][col]))
+        if abs(m[pivot][col]) < 1e-12:
+            return None
+        m[col], m[pivot] = m[pivot], m[col]
+        for r in range(3):
+            if r != col:
+                factor = m[r][col] / m[col][col]
+                for k in range(col, 4):
+                    m[r][k] -= factor * m[col][k]
+    return tuple(max(0.0, m[i][3] / m[i][i]) for i in range(3))
+
+
+class CostModel:
+    """Predicts conversion seconds per document and tracks prediction accuracy"""
+
+    def __init__(self):
+        self.coefficients = dict(DEFAULT_COEFFICIENTS)
+        self.calibrated_groups = {}
+        self.observations = []  # (path, predicted, actual)
+
+    def predict(self, features: Dict) -> float:
+        a, b, c = self.coefficients.get(_group(features), FALLBACK_COEFFICIENTS)
+        return a + b * features["pages"] + c * features["size_mb"]
+
+    def calibrate(self, samples: List[Tuple[Dict, float]]):
+        """Fit per-group coefficients from (features, seconds) samples"""
+        groups = {}
+        for features, seconds in samples:
+            if seconds and seconds > 0:
+                groups.setdefault(_group(features), []).append((features, seconds))
+
+        for group, items in groups.items():
+            if len(items) < MIN_SAMPLES_PER_GROUP:
+                continue
+            rows = [(1.0, f["pages"], f["size_mb"]) for f, _ in items]
+            fitted = _solve_least_squares(rows, [s for _, s in items])
+            if fitted is not None:
+                self.coefficients[group] = fitted
+                self.calibrated_groups[group] = len(items)
+
+    def record(self, path: str, predicted: float, actual: float):
+        self.observations.append((path, predicted, actual))
+
+    def accuracy_report(self, worst: int = 5) -> List[str]:
+        """Predicted vs actual summary lines for the end-of-run report"""
+        obs = [o for o in self.observations if o[2] > 0]
+        if not obs:
+            return ["No timed conversions to compare"]
+
+        total_pred = sum(o[1] for o in obs)
+        total_actual = sum(o[2] for o in obs)
+        mape = sum(abs(p - a) / a for _, p, a in obs) / len(obs) * 100
+
+        lines = [
+            f"Documents timed: {len(obs)}",
+            f"Predicted total: {total_pred/60:.1f} min, actual total: {total_actual/60:.1f} min "
+            f"({(total_pred - total_actual) / total_actual * 100:+.0f}%)",
+            f"Mean absolute error: {mape:.0f}% per document",
+        ]
+        if self.calibrated_groups:
+            groups = ", ".join(f"{ext}{'' if tl is None else (' text' if tl else ' scanned')}={n}"
+                               for (ext, tl), n in sorted(self.calibrated_groups.items(), key=str))
+            lines.append(f"Calibrated groups (samples): {groups}")
+        else:
+            lines.append("Model not calibrated yet (using default coefficients)")
+
+        misses = sorted(obs, key=lambda o: abs(o[1] - o[2]), reverse=True)[:worst]
+        for path, predicted, actual in misses:
+            lines.append(f"  {os.path.basename(path)}: predicted {predicted:.1f}s, actual {actual:.1f}s")
+        return lines
+
+
+def load_calibration_samples(progress=None, sample_results_file: Optional[str] = None,
+                             limit: int = 500) -> List[Tuple[Dict, float]]:
+    """
+    Collect (features, seconds) from recorded timings whose source files still exist
+
+    Sources: progress journal 'elapsed' and test_sample_rag 'time_seconds'.
+    """
+    timings = []
+    if progress is not None:
+        timings.extend(progress.recent_timings(limit))
+
+    if sample_results_file and os.path.exists(sample_results_file):
+        try:
+            with open(sample_results_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            timings.extend((r["path"], r["time_seconds"])
+                           for r in data.get("results", []) if r.get("success"))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"WARNING: Could not read {sample_results_file}: {e}")
+
+    samples = []
+    for path, seconds in timings:
+        if os.path.exists(path):
+            samples.append((document_features(path), seconds))
+    return samples
+
+
+def build_cost_model(progress=None, sample_results_file: Optional[str] = None) -> CostModel:
+    """Create a model calibrated from whatever timings are available"""
+    model = CostModel()
+    model.calibrate(load_calibration_samples(progress, sample_results_file))
+    return model
@@ -0,0 +1,394 @@
+"""
+Pre-Conversion Duplicate Detection
+==================================
+
+Cùng một quyết định được lưu ở nhiều thư mục, hoặc scan lại nhiều lần -> mỗi bản
+đều đi qua converter.convert với chi phí đầy đủ. Trước khi convert:
+- Trùng tuyệt đối: SHA-256 nội dung file (cùng digest với ConversionCache)
+- Gần trùng, PDF có text layer: MinHash trên shingle 5 từ của text layer các
+  trang lấy mẫu rải đều cả tài liệu (pypdfium2, không render) + LSH banding,
+  xác nhận Jaccard ước lượng
+- Gần trùng, PDF scan: perceptual hash (DCT) ảnh các trang lấy mẫu rải đều
+File trùng không convert lại: output .md được hard link (hoặc copy) từ output của
+bản gốc (canonical). Gần trùng chỉ được link khi cùng số trang, kích thước file
+lệch <= LINK_SIZE_TOLERANCE và đủ giống (LINK_JACCARD); văn bản theo mẫu, bản
+sửa đổi, khác phụ lục... không đạt -> chỉ báo cáo, vẫn convert riêng.
+Nhóm trùng ghi vào bảng document_duplicates (cùng cấu trúc
+database/schema_organization.sql) trong progress journal; content_match = 1 khi
+output được dùng chung.
+"""
+
+import os
+import re
+import shutil
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+from conversion_cache import get_file_hash
+
+SIGNATURE_VERSION = 2  # Bumped when fingerprints change: older stored signatures are recomputed
+DEDUP_TEXT_PAGES = 30  # Text-layer pages read for MinHash, sampled over the whole document
+SHINGLE_WORDS = 5
+MIN_SHINGLES = 50  # Fewer -> text layer too thin, fall back to page images
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 16  # 16 bands x 8 rows: candidates from ~0.7 Jaccard
+NEAR_DUP_JACCARD = 0.90  # Estimated Jaccard needed to report two PDFs as near-duplicates
+LINK_JACCARD = 0.98  # ...and to serve one from the other's output
+LINK_SIZE_TOLERANCE = 0.10  # Linking also needs file sizes within 10% of the larger one
+PHASH_PAGES = 8  # Page images hashed for scans, sampled over the whole document
+PHASH_MAX_DISTANCE = 6  # Hamming distance (of 64 bits) allowed on every hashed page
+PHASH_RENDER_WIDTH = 256  # Pixels; pHash only looks at a 32x32 thumbnail
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_permutations = None
+
+
+def _minhash_permutations():
+    global _permutations
+    if _permutations is None:
+        import numpy as np
+        rng = np.random.RandomState(20240601)  # fixed: signatures are persisted across runs
+        a = rng.randint(1, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+        b = rng.randint(0, 1 << 32, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+        _permutations = (a, b)
+    return _permutations
+
+
+def minhash(text: str) -> Optional[List[int]]:
+    """MinHash signature of the word 5-shingles, None if the text is too short"""
+    import numpy as np
+
+    words = re.findall(r'\w+', text.lower())
+    shingles = {zlib.crc32(' '.join(words[i:i + SHINGLE_WORDS]).encode('utf-8'))
+                for i in range(len(words) - SHINGLE_WORDS + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    a, b = _minhash_permutations()
+    x = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+    hashes = (np.outer(a, x) + b[:, None]) % np.uint64(_MERSENNE_PRIME)
+    return [int(v) for v in hashes.min(axis=1)]
+
+
+def _dct_matrix(n: int = 32):
+    import numpy as np
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+
+
+def phash(image) -> int:
+    """64-bit DCT perceptual hash of a PIL image"""
+    import numpy as np
+
+    pixels = np.asarray(image.convert('L').resize((32, 32)), dtype=np.float64)
+    dct = _dct_matrix()
+    low = (dct @ pixels @ dct.T)[:8, :8].flatten()
+    median = np.median(low[1:])  # DC term only encodes brightness
+    return int(sum(1 << i for i, v in enumerate(low) if v > median))
+
+
+def sample_pages(count: int, samples: int) -> List[int]:
+    """Page indexes spread over the whole document: first, last and evenly in between"""
+    if count <= samples:
+        return list(range(count))
+    return sorted({round(i * (count - 1) / (samples - 1)) for i in range(samples)})
+
+
+def _pdf_fingerprint(path: str) -> Dict:
+    """Page count + MinHash of the sampled pages' text layer, or their pHashes for scans"""
+    try:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(path)
+    except Exception:
+        return {}
+
+    try:
+        fingerprint = {"pages": len(pdf)}
+        texts = []
+        for index in sample_pages(len(pdf), DEDUP_TEXT_PAGES):
+            page = pdf[index]
+            try:
+                textpage = page.get_textpage()
+                texts.append(textpage.get_text_range())
+                textpage.close()
+            finally:
+                page.close()
+        fingerprint["minhash"] = minhash("\n".join(texts))
+        if fingerprint["minhash"] is None:
+            hashes = []
+            for index in sample_pages(len(pdf), PHASH_PAGES):
+                page = pdf[index]
+                try:
+                    width = page.get_width() or 1.0
+                    bitmap = page.render(scale=PHASH_RENDER_WIDTH / width)
+                    hashes.append(phash(bitmap.to_pil()))
+                finally:
+                    page.close()
+            fingerprint["phash"] = hashes or None
+        return fingerprint
+    except Exception:
+        return {}
+    finally:
+        pdf.close()
+
+
+def document_signature(path: str, size: Optional[int] = None, near: bool = True,
+                       file_hash: Optional[str] = None) -> Optional[Dict]:
+    """
+    Content signature used for duplicate matching (file_hash: SHA-256 if already computed)
+
+    Returns:
+        {'version', 'sha256', 'size', 'near', 'pages', 'minhash', 'phash'} or None if the file can't be read
+    """
+    file_hash = file_hash or get_file_hash(path)
+    if file_hash is None:
+        return None
+    if size is None:
+        size = os.path.getsize(path)
+    signature = {"version": SIGNATURE_VERSION, "sha256": file_hash, "size": size, "near": near,
+                 "pages": 0, "minhash": None, "phash": None}
+    if near and os.path.splitext(path)[1].lower() == '.pdf':
+        signature.update(_pdf_fingerprint(path))
+    return signature
+
+
+def get_signature(path: str, progress, st: Optional[os.stat_result] = None, near: bool = True,
+                  file_hash: Optional[str] = None) -> Optional[Dict]:
+    """document_signature(), reused from the progress journal while size/mtime are unchanged"""
+    try:
+        st = st or os.stat(path)
+    except OSError:
+        return None
+    signature = progress.load_signature(path, st.st_size, st.st_mtime_ns)
+    if signature is None or (near and not signature.get("near")) or signature.get("version") != SIGNATURE_VERSION:
+        signature = document_signature(path, st.st_size, near, file_hash)
+        if signature is not None:
+            progress.save_signature(path, st.st_size, st.st_mtime_ns, signature)
+    return signature
+
+
+def _hash_key(path: str, signature: Dict) -> Tuple[str, str]:
+    # Same bytes under another extension would take another conversion route
+    return os.path.splitext(path)[1].lower(), signature["sha256"]
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def _linkable(signature: Dict, other: Dict, detection_type: str, score: float) -> bool:
+    """Near match close enough to give the duplicate the canonical's markdown"""
+    if detection_type == 'hash':
+        return True
+    if signature.get("version") != SIGNATURE_VERSION or other.get("version") != SIGNATURE_VERSION:
+        return False  # Fingerprint of the first pages only (older run)
+    if signature["pages"] != other["pages"]:
+        return False
+    if abs(signature["size"] - other["size"]) > LINK_SIZE_TOLERANCE * max(signature["size"], other["size"]):
+        return False
+    return detection_type != 'content' or score >= LINK_JACCARD
+
+
+class DuplicateIndex:
+    """
+    Canonical documents seen so far, and duplicates waiting for their canonical
+
+    claim() is called for each document in dispatch order: the first copy becomes
+    the canonical (converted normally), later copies either link right away
+    (canonical already converted) or wait until resolve(canonical, success).
+    Thread-safe (the universal script claims on its producer thread).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signatures = {}  # canonical path -> signature
+        self._ready = set()  # canonicals whose output exists
+        self._by_hash = {}  # (extension, sha256) -> canonical path
+        self._bands = {}  # (band, band values) -> [canonical path]
+        self._by_pages = {}  # page count -> [canonical path with pHashes]
+        self._waiting = {}  # canonical path -> [(duplicate path, match)]
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _band_keys(self, signature: Dict) -> List[Tuple]:
+        values = signature.get("minhash")
+        if not values:
+            return []
+        rows = len(values) // MINHASH_BANDS
+        return [(band, tuple(values[band * rows:(band + 1) * rows])) for band in range(MINHASH_BANDS)]
+
+    def _add(self, path: str, signature: Dict, ready: bool):
+        self._signatures[path] = signature
+        if ready:
+            self._ready.add(path)
+        self._by_hash[_hash_key(path, signature)] = path
+        for key in self._band_keys(signature):
+            self._bands.setdefault(key, []).append(path)
+        if signature.get("phash"):
+            self._by_pages.setdefault(signature["pages"], []).append(path)
+
+    def _remove(self, path: str):
+        signature = self._signatures.pop(path, None)
+        self._ready.discard(path)
+        if signature is None:
+            return
+        if self._by_hash.get(_hash_key(path, signature)) == path:
+            del self._by_hash[_hash_key(path, signature)]
+        for key in self._band_keys(signature):
+            if path in self._bands.get(key, []):
+                self._bands[key].remove(path)
+        if path in self._by_pages.get(signature["pages"], []):
+            self._by_pages[signature["pages"]].remove(path)
+
+    def add(self, path: str, signature: Dict, ready: bool = False):
+        """Register a canonical (ready=True: already converted, e.g. from an earlier run)"""
+        with self._lock:
+            self._remove(path)
+            self._add(path, signature, ready)
+
+    def remove(self, path: str):
+        """Forget a canonical (e.g. its output is gone)"""
+        with self._lock:
+            self._remove(path)
+
+    def _match(self, path: str, signature: Dict) -> Optional[Dict]:
+        def result(canonical, detection_type, score):
+            other = self._signatures[canonical]
+            link = _linkable(signature, other, detection_type, score)
+            return {
+                "canonical": canonical, "detection_type": detection_type, "score": round(score, 4),
+                "hash_match": detection_type == 'hash', "content_match": link, "link": link,
+                "size_diff": abs(signature["size"] - other["size"]),
+            }
+
+        canonical = self._by_hash.get(_hash_key(path, signature))
+        if canonical is not None and canonical != path:
+            return result(canonical, 'hash', 1.0)
+
+        matches = []
+        values = signature.get("minhash")
+        if values:
+            # Any page count: amended versions are still reported, _linkable decides on sharing output
+            candidates = {c for key in self._band_keys(signature) for c in self._bands.get(key, [])}
+            for candidate in candidates - {path}:
+                other = self._signatures[candidate]["minhash"]
+                score = sum(1 for x, y in zip(values, other) if x == y) / len(values)
+                if score >= NEAR_DUP_JACCARD:
+                    matches.append(result(candidate, 'content', score))
+
+        hashes = signature.get("phash")
+        if hashes and not matches:
+            for candidate in self._by_pages.get(signature["pages"], []):
+                other = self._signatures[candidate]["phash"]
+                if candidate == path or len(other) != len(hashes):
+                    continue
+                distances = [_hamming(x, y) for x, y in zip(hashes, other)]
+                if max(distances) <= PHASH_MAX_DISTANCE:
+                    matches.append(result(candidate, 'fuzzy', 1 - sum(distances) / (64 * len(distances))))
+        # Prefer a canonical whose output can be shared, then the closest one
+        return max(matches, key=lambda m: (m["link"], m["score"]), default=None)
+
+    def claim(self, path: str, signature: Dict) -> Optional[Dict]:
+        """
+        Match a document against the canonicals
+
+        Returns:
+            None: no duplicate, the document is now a (pending) canonical - convert it.
+            match dict with link=False: similar only (report_near_duplicate), the
+                document is a canonical of its own - convert it.
+            match dict with ready=True: link to match['canonical'] now.
+            match dict with ready=False: parked until the canonical is resolved.
+        """
+        with self._lock:
+            self._remove(path)  # re-queued (modified) canonical: drop its old signature
+            match = self._match(path, signature)
+            if match is None or not match["link"]:
+                self._add(path, signature, ready=False)
+                return match
+            match["signature"] = signature
+            match["ready"] = match["canonical"] in self._ready
+            if not match["ready"]:
+                self._waiting.setdefault(match["canonical"], []).append((path, match))
+            return match
+
+    def resolve(self, canonical: str, success: bool) -> List[Tuple[str, Dict]]:
+        """
+        Canonical finished: its waiting duplicates, to link (success) or to convert themselves
+
+        On failure the canonical is dropped and the first waiting copy takes its place
+        (returned with match None: convert it); the others keep waiting for that one.
+        """
+        with self._lock:
+            waiting = self._waiting.pop(canonical, [])
+            if success:
+                self._ready.add(canonical)
+                return waiting
+            self._remove(canonical)
+            if not waiting:
+                return []
+            (successor, match), rest = waiting[0], waiting[1:]
+            self._add(successor, match["signature"], ready=False)
+            for _, other in rest:
+                other["canonical"] = successor
+            if rest:
+                self._waiting[successor] = rest
+            return [(successor, None)]
+
+    def waiting_count(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._waiting.values())
+
+
+def load_index(progress) -> DuplicateIndex:
+    """Index preloaded with the stored signatures of already converted documents"""
+    index = DuplicateIndex()
+    for path, signature in progress.completed_signatures():
+        index.add(path, signature, ready=True)
+    return index
+
+
+def link_output(canonical_output: str, duplicate_output: str) -> str:
+    """
+    Hard link the canonical's markdown to the duplicate's output path (copy across volumes)
+
+    Both paths then share one file: every output writer must write a temp file and
+    os.replace() it, never open(output, 'w'), or re-converting one document rewrites the other's .md.
+    """
+    tmp_path = f"{duplicate_output}.{os.getpid()}.tmp"
+    try:
+        os.link(canonical_output, tmp_path)
+        mode = "hard link"
+    except OSError:
+        shutil.copyfile(canonical_output, tmp_path)
+        mode = "copy"
+    os.replace(tmp_path, duplicate_output)
+    return mode
+
+
+def link_duplicate(path: str, match: Dict, progress, output_path_fn: Callable[[str], str]) -> Optional[str]:
+    """
+    Serve a duplicate from its canonical's output and record the pair
+
+    Returns:
+        Link mode, or None if the canonical's output is missing (convert the duplicate instead)
+    """
+    canonical_output = output_path_fn(match["canonical"])
+    if not os.path.exists(canonical_output):
+        return None
+    mode = link_output(canonical_output, output_path_fn(path))
+    progress.mark_completed(path, match["signature"]["sha256"], 0.0)
+    progress.record_duplicate(match["canonical"], path, match["detection_type"], match["score"],
+                              match["hash_match"], match["content_match"], match["size_diff"])
+    return mode
+
+
+def report_near_duplicate(path: str, match: Dict, progress):
+    """Record a similar document that is converted on its own (content_match = 0, for review)"""
+    progress.record_duplicate(match["canonical"], path, match["detection_type"], match["score"],
+                              match["hash_match"], match["content_match"], match["size_diff"])
+
+
+def canonical_order(paths: List[str], signatures: Dict[str, Dict]) -> List[str]:
+    """Dispatch order that makes the best copy canonical: text layer first, then the larger file"""
+    return sorted(paths, key=lambda p: (signatures[p].get("minhash") is None, -signatures[p]["size"], p))
@@ -0,0 +1,155 @@
+"""
+Filesystem Manifest (Incremental Re-ingestion)
+==============================================
+
+Lưu (path, size, mtime, inode, content hash) của mỗi file nguồn vào SQLite.
+Lần chạy sau chỉ so sánh stat với manifest:
+- added:    path mới
+- modified: stat đổi VÀ hash đổi (touch / copy đè cùng nội dung không tính)
+- deleted:  path không còn -> retire output .md
+Chỉ file added/modified mới phải hash lại và convert lại.
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from conversion_cache import get_file_hash
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS manifest (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    file_hash TEXT,
+    seen_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_manifest_hash ON manifest(file_hash);
+"""
+
+
+# os.DirEntry.stat() (scanner) reports st_ino = 0 on Windows while os.stat() (watch events)
+# returns the real file index: the inode would only make the two sources disagree there
+USE_INODE = os.name != 'nt'
+
+
+def stat_signature(st: os.stat_result) -> Tuple[int, int, int]:
+    """(size, mtime_ns, inode) - what we compare between runs (inode 0 on Windows)"""
+    return st.st_size, st.st_mtime_ns, st.st_ino if USE_INODE else 0
+
+
+class FileManifest:
+    """Persisted manifest of source files (stored next to the progress journal)"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def load(self) -> Dict[str, Tuple[int, int, int, Optional[str]]]:
+        """{path: (size, mtime_ns, inode, file_hash)} in one query"""
+        rows = self.conn.execute("SELECT path, size, mtime_ns, inode, file_hash FROM manifest")
+        return {r[0]: (r[1], r[2], r[3], r[4]) for r in rows}
+
+    def begin(self):
+        """Start a streaming diff: load the previous state once"""
+        self._known = self.load()
+        self._seen = set()
+        self._updates = []
+        self._now = datetime.now().isoformat()
+
+    def observe(self, path: str, st: os.stat_result) -> Tuple[str, Optional[str]]:
+        """
+        Classify one scanned file against the manifest
+
+        Returns:
+            (status, file_hash) where status is 'added', 'modified' or 'unchanged'.
+            file_hash is None for unchanged files (they are not re-hashed).
+        """
+        self._seen.add(path)
+        size, mtime_ns, inode = stat_signature(st)
+        previous = self._known.get(path)
+
+        if previous is not None and previous[:3] == (size, mtime_ns, inode):
+            return "unchanged", None
+
+        # Only new/changed stat signatures pay for hashing
+        file_hash = get_file_hash(path)
+        self._updates.append((path, size, mtime_ns, inode, file_hash, self._now))
+        self._known[path] = (size, mtime_ns, inode, file_hash)
+        if len(self._updates) >= 500:
+            self.flush()
+
+        if previous is None:
+            return "added", file_hash
+        if file_hash is not None and file_hash == previous[3]:
+            return "unchanged", file_hash  # touched or copied over, same content
+        return "modified", file_hash
+
+    def flush(self):
+        """Persist observed changes now (watch mode never reaches finish())"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO manifest (path, size, mtime_ns, inode, file_hash, seen_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._updates,
+            )
+        self._updates = []
+
+    def finish(self) -> List[str]:
+        """
+        End the streaming diff: persist updates, drop files that were not seen
+
+        Returns:
+            Deleted source paths
+        """
+        self.flush()
+        deleted = [p for p in self._known if p not in self._seen]
+        self.remove(deleted)
+        return deleted
+
+    def remove(self, paths: Iterable[str]):
+        """Drop deleted sources from the manifest"""
+        with self.conn:
+            self.conn.executemany("DELETE FROM manifest WHERE path = ?", [(p,) for p in paths])
+
+    def diff(self, entries: Iterable[Tuple[str, os.stat_result]]) -> Dict[str, List]:
+        """
+        Compare current files against the manifest and persist the new state
+
+        Args:
+            entries: (path, stat_result) for every supported file found by the scan
+
+        Returns:
+            {'added': [...], 'modified': [...], 'unchanged': [...], 'deleted': [...],
+             'hashes': {path: file_hash}} for added/modified files
+        """
+        changes = {"added": [], "modified": [], "unchanged": [], "deleted": [], "hashes": {}}
+        self.begin()
+        for path, st in entries:
+            status, file_hash = self.observe(path, st)
+            changes[status].append(path)
+            if file_hash is not None:
+                changes["hashes"][path] = file_hash
+        changes["deleted"] = self.finish()
+        return changes
+
+
+def retire_outputs(deleted_paths: List[str], get_output_path: Callable[[str], str]) -> int:
+    """Remove generated markdown for source files that no longer exist"""
+    removed = 0
+    for path in deleted_paths:
+        output_path = get_output_path(path)
+        try:
+            os.remove(output_path)
+            removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,183 @@
+"""
+Watch-Folder Ingestion
+======================
+
+Daemon mode cho batch_rag_universal: thay vì chạy lại cả batch (scan toàn bộ +
+hỏi "Continue?"), theo dõi thư mục Documents và đưa file mới/đổi vào worker ngay:
+- watchdog (inotify trên Linux, ReadDirectoryChangesW trên Windows, có trong
+  python/requirements.txt); không có -> quét định kỳ bằng scan_documents, chu kỳ
+  tự giãn theo thời gian một lần quét (share lớn quét mất vài phút) để việc quét
+  chiếm tối đa POLL_SCAN_SHARE thời gian
+- Debounce: file đang được copy vào share chỉ được đưa đi khi size/mtime đứng
+  yên WATCH_DEBOUNCE_SECONDS và mở đọc được (Windows khóa file đang ghi)
+- File bị xóa / đổi tên đi -> báo để retire output .md
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+
+from document_scanner import scan_documents
+from file_manifest import stat_signature
+
+WATCH_DEBOUNCE_SECONDS = 3.0  # Quiet period before a new/changed file is queued
+WATCH_POLL_INTERVAL = 30.0  # Minimum rescan period when watchdog is not installed
+POLL_SCAN_SHARE = 0.1  # Polling: pause >= scan time / this, so rescans use at most ~10% of the time
+_TICK = 0.5
+
+# Office owner/lock files (~$report.docx) are never documents
+IGNORED_PREFIXES = ("~$", ".~lock")
+
+
+class FolderWatcher:
+    """
+    Stream of settled (path, stat) for new/changed files, (path, None) for deletions
+
+    Start it before the catch-up scan so files landing during the scan are not missed.
+    """
+
+    def __init__(self, root_dir: str, extensions: Iterable[str],
+                 debounce: float = WATCH_DEBOUNCE_SECONDS, poll_interval: float = WATCH_POLL_INTERVAL):
+        self.root_dir = root_dir
+        self.extensions = {e.lower() for e in extensions}
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self._changed = {}  # path -> (last event time, last stat signature or None)
+        self._deleted = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._observer = None
+        self._poller = None
+        self.backend = None
+        self.last_scan_seconds = None  # Polling: duration of the latest rescan
+
+    def _wanted(self, path: str) -> bool:
+        name = os.path.basename(path)
+        return (os.path.splitext(name)[1].lower() in self.extensions
+                and not name.startswith(IGNORED_PREFIXES))
+
+    def _touch(self, path: str):
+        if self._wanted(path):
+            try:
+                signature = stat_signature(os.stat(path))
+            except OSError:
+                signature = None
+            with self._lock:
+                self._changed[path] = (time.time(), signature)
+
+    def _gone(self, path: str):
+        if self._wanted(path):
+            with self._lock:
+                self._changed.pop(path, None)
+            self._deleted.put(path)
+
+    def start(self):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            self.backend = (f"polling, every {self.poll_interval:.0f}s or longer for slow scans "
+                            f"(pip install watchdog for change notifications)")
+            self._poller = threading.Thread(target=self._poll, daemon=True)
+            self._poller.start()
+            return self
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                if event.event_type == "deleted":
+                    watcher._gone(event.src_path)
+                elif event.event_type == "moved":
+                    watcher._gone(event.src_path)
+                    watcher._touch(event.dest_path)
+                elif event.event_type in ("created", "modified", "closed"):
+                    watcher._touch(event.src_path)
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), self.root_dir, recursive=True)
+        self._observer.start()
+        self.backend = f"watchdog ({type(self._observer).__name__})"
+        return self
+
+    def _snapshot(self):
+        start = time.time()
+        snapshot = {path: stat_signature(st) for path, st in scan_documents(self.root_dir, self.extensions)}
+        self.last_scan_seconds = time.time() - start
+        return snapshot
+
+    def poll_pause(self) -> float:
+        """Seconds between rescans: poll_interval, stretched so slow scans stay a small share"""
+        return max(self.poll_interval, (self.last_scan_seconds or 0.0) / POLL_SCAN_SHARE)
+
+    def _poll(self):
+        """Fallback: periodic rescan diffed against the previous snapshot"""
+        known = self._snapshot()
+        while not self._stop.wait(self.poll_pause()):
+            current = self._snapshot()
+            for path, signature in current.items():
+                if known.get(path) != signature:
+                    self._touch(path)
+            for path in known.keys() - current.keys():
+                self._gone(path)
+            known = current
+
+    def _settled(self) -> Iterator[Tuple[str, os.stat_result]]:
+        """Files whose stat did not change during the debounce window"""
+        now = time.time()
+        with self._lock:
+            due = [(p, sig) for p, (t, sig) in self._changed.items() if now - t >= self.debounce]
+        for path, previous in due:
+            try:
+                st = os.stat(path)
+                with open(path, 'rb'):
+                    pass
+            except OSError:
+                # Vanished or still locked by the writer: check again next window
+                with self._lock:
+                    if path in self._changed:
+                        self._changed[path] = (now, previous)
+                continue
+            signature = stat_signature(st)
+            with self._lock:
+                current = self._changed.get(path)
+                if current is None or current[0] > now:
+                    continue  # new event arrived meanwhile
+                if signature != previous or st.st_size == 0:
+                    # Still growing (or empty placeholder): one more quiet window
+                    self._changed[path] = (now, signature)
+                    continue
+                del self._changed[path]
+            yield path, st
+
+    def events(self) -> Iterator[Tuple[str, Optional[os.stat_result]]]:
+        """Blocks until stop(); yields (path, stat) when settled, (path, None) when deleted"""
+        while not self._stop.is_set():
+            while True:
+                try:
+                    yield self._deleted.get_nowait(), None
+                except queue.Empty:
+                    break
+            yield from self._settled()
+            self._stop.wait(_TICK)
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return len(self._changed)
+
+    def stop(self):
+        self._stop.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
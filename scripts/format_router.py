@@ -0,0 +1,439 @@
+"""
+Format Router - Native Office Extractors
+========================================
+
+DOCX/XLSX/PPTX đã có cấu trúc rõ ràng trong XML, không cần đi qua
+DocumentConverter. Router chọn đường xử lý theo định dạng:
+- .xlsx: openpyxl read_only, stream từng dòng -> bảng markdown mỗi sheet
+- .docx: đọc word/document.xml trực tiếp (heading, đoạn, list, bảng, ảnh)
+- .pptx: đọc XML từng slide theo thứ tự trong presentation.xml
+- Còn lại (PDF, định dạng cũ) hoặc file cần layout analysis -> Docling
+Markdown ghi thẳng ra file theo từng khối, giữ cùng dạng với Docling
+(# heading, đoạn cách dòng trống, "- " list, bảng pipe, <!-- image -->).
+"""
+
+import os
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from conversion_metrics import export_markdown
+from pdf_sharding import get_pdf_page_count
+from streaming_export import STREAM_MIN_PAGES, docling_chunk_converter, export_streaming
+
+NATIVE_FORMATS = {'.docx', '.xlsx', '.pptx'}
+
+# DOCX/PPTX that are mostly pictures (scans pasted into Word...) go to Docling
+NATIVE_MIN_TEXT_CHARS = 200
+
+IMAGE_PLACEHOLDER = "<!-- image -->"
+
+NS = {
+    'w': "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
+    'a': "http://schemas.openxmlformats.org/drawingml/2006/main",
+    'p': "http://schemas.openxmlformats.org/presentationml/2006/main",
+    'r': "http://schemas.openxmlformats.org/officeDocument/2006/relationships",
+    'rel': "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+
+
+def _q(prefix: str, tag: str) -> str:
+    return f"{{{NS[prefix]}}}{tag}"
+
+
+class NeedsLayoutAnalysis(Exception):
+    """Raised by a native extractor when the file should go through Docling instead"""
+
+
+def _cell_text(value) -> str:
+    if value is None:
+        return ""
+    return str(value).replace("\r", " ").replace("\n", " ").replace("|", "\\|").strip()
+
+
+def _table_lines(rows: Iterator[List[str]], width: int = 0) -> Iterator[str]:
+    """
+    Pipe table, first row as header (same shape as Docling's markdown tables)
+
+    width: column count known up front (sheet dimension, DOCX/PPTX tblGrid), else the header's
+    """
+    header = True
+    for row in rows:
+        if header:
+            width = max(width, len(row))
+            row = row + [""] * (width - len(row))
+            yield "| " + " | ".join(row) + " |"
+            yield "|" + "|".join("---" for _ in row) + "|"
+            header = False
+            continue
+        row = row + [""] * (width - len(row))
+        yield "| " + " | ".join(row) + " |"
+
+
+# ---------------------------------------------------------------- XLSX
+
+def _sheet_rows(sheet) -> Iterator[List[str]]:
+    """Stream non-empty rows (trailing empty cells dropped)"""
+    for values in sheet.iter_rows(values_only=True):
+        cells = [_cell_text(v) for v in values]
+        while cells and not cells[-1]:
+            cells.pop()
+        if cells:
+            yield cells
+
+
+def iter_xlsx_markdown(path: str) -> Iterator[str]:
+    """One markdown table per non-empty sheet, rows streamed in read-only mode"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            # max_column comes from the sheet's dimension record, so a short title row
+            # in A1 still gets a header as wide as the data below it
+            lines = _table_lines(_sheet_rows(sheet), sheet.max_column or 0)
+            first = next(lines, None)
+            if first is None:
+                continue
+            yield _prepend(first, lines)
+    finally:
+        workbook.close()
+
+
+def _prepend(first: str, lines: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from lines
+
+
+# ---------------------------------------------------------------- DOCX
+
+def _docx_styles(archive: zipfile.ZipFile) -> Tuple[Dict[str, int], set]:
+    """
+    Returns:
+        ({styleId: markdown heading level}, {styleIds of list paragraphs})
+        Title = level 1, Heading N = level N + 1
+    """
+    levels, list_styles = {}, set()
+    try:
+        root = ET.fromstring(archive.read('word/styles.xml'))
+    except KeyError:
+        return levels, list_styles
+    for style in root.iter(_q('w', 'style')):
+        style_id = style.get(_q('w', 'styleId'))
+        name_el = style.find('w:name', NS)
+        name = (name_el.get(_q('w', 'val')) if name_el is not None else style_id or "").lower()
+        if name == "title":
+            levels[style_id] = 1
+        elif name.startswith("heading ") and name[8:].isdigit():
+            levels[style_id] = min(int(name[8:]) + 1, 6)
+        elif name.startswith("list") or style.find('w:pPr/w:numPr', NS) is not None:
+            list_styles.add(style_id)
+    return levels, list_styles
+
+
+def _paragraph_text(paragraph) -> str:
+    parts = []
+    for el in paragraph.iter():
+        if el.tag == _q('w', 't') and el.text:
+            parts.append(el.text)
+        elif el.tag in (_q('w', 'tab'), _q('w', 'br')):
+            parts.append(" ")
+    return "".join(parts).strip()
+
+
+def _has_picture(element) -> bool:
+    return any(el.tag in (_q('w', 'drawing'), _q('w', 'pict')) for el in element.iter())
+
+
+def _grid_width(table, prefix: str) -> int:
+    """Column count from the table grid (w:tblGrid / a:tblGrid), 0 if missing"""
+    return len(table.findall(f'{prefix}:tblGrid/{prefix}:gridCol', NS))
+
+
+def _docx_span(props, tag: str) -> int:
+    el = props.find(f'w:{tag}', NS) if props is not None else None
+    try:
+        return max(int(el.get(_q('w', 'val'))), 0) if el is not None else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def _docx_table_rows(table) -> Iterator[List[str]]:
+    """
+    Rows expanded to the table grid, merged cells repeated in every column / row they cover
+    (as Docling exports them): w:gridSpan, w:vMerge continuations, w:gridBefore/gridAfter
+    """
+    above = {}  # grid column -> text of the cell above, for vertical merges
+    for row in table.findall('w:tr', NS):
+        row_props = row.find('w:trPr', NS)
+        cells = [""] * _docx_span(row_props, 'gridBefore')
+        for cell in row.findall('w:tc', NS):
+            props = cell.find('w:tcPr', NS)
+            column = len(cells)
+            vmerge = props.find('w:vMerge', NS) if props is not None else None
+            if vmerge is not None and vmerge.get(_q('w', 'val')) != 'restart':
+                text = above.get(column, "")
+            else:
+                text = _cell_text(" ".join(filter(None, (_paragraph_text(p) for p in cell.iter(_q('w', 'p'))))))
+            for offset in range(max(_docx_span(props, 'gridSpan'), 1)):
+                cells.append(text)
+                above[column + offset] = text
+        cells += [""] * _docx_span(row_props, 'gridAfter')
+        yield cells
+
+
+def iter_docx_markdown(path: str) -> Iterator[str]:
+    """Walk word/document.xml body in order: headings, paragraphs, lists, tables, pictures"""
+    with zipfile.ZipFile(path) as archive:
+        levels, list_styles = _docx_styles(archive)
+        has_media = any(n.startswith('word/media/') for n in archive.namelist())
+        body = ET.fromstring(archive.read('word/document.xml')).find('w:body', NS)
+
+    text_chars = 0
+    blocks = []
+    for element in body:
+        if element.tag == _q('w', 'p'):
+            text = _paragraph_text(element)
+            if text:
+                text_chars += len(text)
+                props = element.find('w:pPr', NS)
+                style = props.find('w:pStyle', NS) if props is not None else None
+                style_id = style.get(_q('w', 'val')) if style is not None else None
+                if style_id in levels:
+                    blocks.append("#" * levels[style_id] + " " + text)
+                elif style_id in list_styles or (props is not None and props.find('w:numPr', NS) is not None):
+                    blocks.append("- " + text)
+                else:
+                    blocks.append(text)
+            if _has_picture(element):
+                blocks.append(IMAGE_PLACEHOLDER)
+        elif element.tag == _q('w', 'tbl'):
+            table = "\n".join(_table_lines(_docx_table_rows(element), _grid_width(element, 'w')))
+            if table:
+                text_chars += len(table)
+                blocks.append(table)
+
+    if has_media and text_chars < NATIVE_MIN_TEXT_CHARS:
+        raise NeedsLayoutAnalysis("mostly images")
+    yield from _join_list_items(blocks)
+
+
+def _join_list_items(blocks: List[str]) -> Iterator[str]:
+    """Consecutive '- ' items form one list block (no blank line between items)"""
+    items = []
+    for block in blocks:
+        if block.startswith("- "):
+            items.append(block)
+            continue
+        if items:
+            yield "\n".join(items)
+            items = []
+        yield block
+    if items:
+        yield "\n".join(items)
+
+
+# ---------------------------------------------------------------- PPTX
+
+def _slide_paths(archive: zipfile.ZipFile) -> List[str]:
+    """Slide part names in presentation order"""
+    presentation = ET.fromstring(archive.read('ppt/presentation.xml'))
+    rels = ET.fromstring(archive.read('ppt/_rels/presentation.xml.rels'))
+    targets = {r.get('Id'): r.get('Target') for r in rels.findall('rel:Relationship', NS)}
+
+    paths = []
+    for slide_id in presentation.iter(_q('p', 'sldId')):
+        target = targets.get(slide_id.get(_q('r', 'id')))
+        if target:
+            paths.append(posixpath.normpath(posixpath.join('ppt', target)))
+    return paths
+
+
+def _pptx_table_rows(table) -> Iterator[List[str]]:
+    """
+    Rows of an a:tbl; cells covered by a merge (hMerge / vMerge, still present in the XML)
+    repeat the text of the merged cell, as Docling exports them
+    """
+    above = {}  # grid column -> text of the cell above
+    for row in table.findall('a:tr', NS):
+        cells = []
+        for cell in row.findall('a:tc', NS):
+            column = len(cells)
+            if cell.get('hMerge') in ('1', 'true') and cells:
+                text = cells[-1]
+            elif cell.get('vMerge') in ('1', 'true'):
+                text = above.get(column, "")
+            else:
+                text = _cell_text(" ".join(t.text or "" for t in cell.iter(_q('a', 't'))))
+            cells.append(text)
+            above[column] = text
+        yield cells
+
+
+def _pptx_shape_blocks(shape_tree) -> Iterator[Tuple[str, int]]:
+    """(markdown block, text chars) for each shape, in z-order"""
+    for shape in shape_tree:
+        if shape.tag == _q('p', 'grpSp'):
+            yield from _pptx_shape_blocks(shape)
+        elif shape.tag == _q('p', 'pic'):
+            yield IMAGE_PLACEHOLDER, 0
+        elif shape.tag == _q('p', 'graphicFrame'):
+            for table in shape.iter(_q('a', 'tbl')):
+                block = "\n".join(_table_lines(_pptx_table_rows(table), _grid_width(table, 'a')))
+                if block:
+                    yield block, len(block)
+        elif shape.tag == _q('p', 'sp'):
+            placeholder = shape.find('.//p:nvPr/p:ph', NS)
+            kind = placeholder.get('type', 'body') if placeholder is not None else None
+            paragraphs = []
+            for paragraph in shape.iter(_q('a', 'p')):
+                text = "".join(t.text or "" for t in paragraph.iter(_q('a', 't'))).strip()
+                if text:
+                    paragraphs.append(text)
+            if not paragraphs:
+                continue
+            chars = sum(len(p) for p in paragraphs)
+            if kind in ('title', 'ctrTitle'):
+                yield "# " + " ".join(paragraphs), chars
+            elif kind in ('body', 'obj'):
+                yield "\n".join("- " + p for p in paragraphs), chars
+            else:
+                for text in paragraphs:
+                    yield text, len(text)
+
+
+def iter_pptx_markdown(path: str) -> Iterator[str]:
+    """Slides in presentation order: titles, text boxes, bullet bodies, tables, pictures"""
+    blocks = []
+    text_chars = 0
+    with zipfile.ZipFile(path) as archive:
+        has_media = any(n.startswith('ppt/media/') for n in archive.namelist())
+        for slide_path in _slide_paths(archive):
+            tree = ET.fromstring(archive.read(slide_path)).find('.//p:cSld/p:spTree', NS)
+            if tree is None:
+                continue
+            for block, chars in _pptx_shape_blocks(tree):
+                blocks.append(block)
+                text_chars += chars
+
+    if has_media and text_chars < NATIVE_MIN_TEXT_CHARS:
+        raise NeedsLayoutAnalysis("mostly images")
+    yield from blocks
+
+
+NATIVE_EXTRACTORS = {
+    '.xlsx': iter_xlsx_markdown,
+    '.docx': iter_docx_markdown,
+    '.pptx': iter_pptx_markdown,
+}
+
+
+# ---------------------------------------------------------------- Router
+
+def _tmp_path(output_path: str) -> str:
+    return f"{output_path}.{os.getpid()}.tmp"
+
+
+def write_markdown_blocks(blocks: Iterator, output_path: str) -> int:
+    """
+    Write blocks separated by blank lines, streaming to disk
+
+    A block is a string, or an iterator of lines (large sheets are never held
+    in memory as one string).
+
+    Returns:
+        Number of characters written
+    """
+    tmp_path = _tmp_path(output_path)
+    written = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for block in blocks:
+            if written:
+                f.write("\n\n")
+                written += 2
+            if isinstance(block, str):
+                f.write(block)
+                written += len(block)
+                continue
+            for i, line in enumerate(block):
+                if i:
+                    f.write("\n")
+                    written += 1
+                f.write(line)
+                written += len(line)
+    os.replace(tmp_path, output_path)
+    return written
+
+
+def convert_with_router(path: str, output_path: str, converter, native: bool = True,
+                        stream_chunk_pages: Optional[int] = None, checkpoint: bool = False) -> str:
+    """
+    Convert one document through the fastest suitable path and write the .md
+
+    Args:
+        stream_chunk_pages: export long PDFs this many pages at a time
+            (see streaming_export), None = whole-document export
+        checkpoint: keep per-chunk checkpoints of streamed PDFs so an
+            interrupted conversion resumes mid-file
+
+    Returns:
+        The route taken: 'native', 'docling', 'docling (streamed)' or
+        'docling (fallback: ...)' when a native extractor declined the file
+    """
+    ext = os.path.splitext(path)[1].lower()
+    route = "docling"
+
+    if native and ext in NATIVE_EXTRACTORS:
+        try:
+            write_markdown_blocks(NATIVE_EXTRACTORS[ext](path), output_path)
+            return "native"
+        except NeedsLayoutAnalysis as e:
+            route = f"docling (fallback: {e})"
+        except Exception as e:  # corrupt or unusual package: let Docling try
+            route = f"docling (fallback: {type(e).__name__})"
+        finally:
+            if os.path.exists(_tmp_path(output_path)):
+                os.remove(_tmp_path(output_path))
+
+    if stream_chunk_pages and ext == '.pdf':
+        page_count = get_pdf_page_count(path)
+        if page_count and page_count >= STREAM_MIN_PAGES:
+            export_streaming(docling_chunk_converter(converter, path), output_path,
+                             1, page_count, stream_chunk_pages, source_path=path if checkpoint else None)
+            return "docling (streamed)"
+
+    result = converter.convert(path)
+    markdown_content = export_markdown(result)
+    del result
+    write_markdown_blocks([markdown_content], output_path)
+    return route
+
+
+class FormatThroughput:
+    """Per-format, per-route throughput (files, MB, seconds) for the run summary"""
+
+    def __init__(self):
+        self.rows = {}  # (ext, route) -> [files, bytes, seconds]
+
+    def record(self, path: str, route: str, elapsed: float, size_bytes: Optional[int] = None):
+        if size_bytes is None:
+            try:
+                size_bytes = os.path.getsize(path)
+            except OSError:
+                size_bytes = 0
+        key = (os.path.splitext(path)[1].lower(), route.split(" ")[0])
+        row = self.rows.setdefault(key, [0, 0, 0.0])
+        row[0] += 1
+        row[1] += size_bytes
+        row[2] += elapsed
+
+    def report(self) -> List[str]:
+        if not self.rows:
+            return ["No conversions timed"]
+        lines = [f"{'format':<7} {'route':<8} {'files':>6} {'MB':>9} {'seconds':>9} {'files/s':>8} {'MB/s':>7}"]
+        for (ext, route), (files, size, seconds) in sorted(self.rows.items()):
+            seconds = max(seconds, 1e-6)
+            lines.append(f"{ext:<7} {route:<8} {files:>6} {size/1024/1024:>9.1f} {seconds:>9.1f} "
+                         f"{files/seconds:>8.2f} {size/1024/1024/seconds:>7.2f}")
+        return lines
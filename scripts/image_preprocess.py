@@ -0,0 +1,437 @@
+"""
+Image Preprocessing Before OCR
+==============================
+
+Ảnh chụp điện thoại / scan đi thẳng vào EasyOCR: ảnh 4000px tốn thời gian
+nhận dạng vô ích, trang nghiêng sinh thêm box detection. Các bước (NumPy,
+OpenCV nếu có):
+- analyze:   trên ảnh thu nhỏ: góc nghiêng bằng projection profile (vector hóa
+             trên tọa độ điểm mực) + chiều cao dòng chữ (median)
+- normalize: đưa chiều cao dòng chữ về TARGET_TEXT_HEIGHT px thay vì scale cố
+             định; không tìm được dòng -> chỉ giới hạn MAX_SIDE
+- deskew:    xoay lại nếu góc nghiêng >= SKEW_MIN_DEGREES
+- binarize:  ngưỡng thích nghi theo trung bình cục bộ (ảnh chụp ánh sáng không đều)
+- crop:      cắt lề trắng (giữ MARGIN_PAD)
+Mỗi bước được đo thời gian; PreprocessStats tổng hợp cho bảng cuối.
+
+PDF scan: render_scan_page() render trang ở DPI tính từ chiều cao dòng chữ
+(thay cho images_scale cố định) rồi chạy các bước trên.
+"""
+
+import os
+import time
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+TARGET_TEXT_HEIGHT = 32  # px, median text-line height handed to OCR
+MIN_SCALE = 0.25
+MAX_SCALE = 3.0
+MAX_SIDE = 3500  # Longest side when no text lines are found
+SCALE_TOLERANCE = 0.15  # |scale - 1| below this: leave the size alone
+MAX_SKEW_DEGREES = 10.0
+SKEW_MIN_DEGREES = 0.3  # Smaller estimated skew is not worth a rotation
+ANALYSIS_SIDE = 1200  # Skew / line-height analysis runs on a copy this big
+MAX_ANALYSIS_POINTS = 200000
+BINARIZE_WINDOW = 0.03  # Local window, fraction of the shorter side
+BINARIZE_OFFSET = 12  # Gray levels below the local mean that count as ink
+MARGIN_PAD = 0.02  # Kept around the ink bounding box, fraction of the side
+
+# PDF scans: render DPI chosen from the text height at ANALYSIS_DPI
+ANALYSIS_DPI = 72
+MIN_RENDER_DPI = 150
+MAX_RENDER_DPI = 400
+
+STEPS = ("analyze", "normalize", "deskew", "binarize", "crop")
+
+
+def to_gray(image) -> np.ndarray:
+    """PIL image or ndarray (gray / RGB / RGBA) -> uint8 gray ndarray"""
+    if not isinstance(image, np.ndarray):
+        return np.asarray(image.convert("L"), dtype=np.uint8)
+    if image.ndim == 2:
+        return image.astype(np.uint8, copy=False)
+    rgb = image[..., :3].astype(np.float32)
+    return (rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)).astype(np.uint8)
+
+
+def resize(gray: np.ndarray, scale: float) -> np.ndarray:
+    height, width = gray.shape
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    if cv2 is not None:
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC)
+    from PIL import Image
+    return np.asarray(Image.fromarray(gray).resize(size, Image.LANCZOS if scale < 1 else Image.BICUBIC))
+
+
+def rotate(gray: np.ndarray, degrees: float) -> np.ndarray:
+    """Counter-clockwise rotation about the centre, white fill, same size"""
+    height, width = gray.shape
+    if cv2 is not None:
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), degrees, 1.0)
+        return cv2.warpAffine(gray, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=255)
+    from PIL import Image
+    return np.asarray(Image.fromarray(gray).rotate(degrees, resample=Image.BILINEAR, fillcolor=255))
+
+
+def adaptive_binarize(gray: np.ndarray, window: Optional[int] = None, offset: int = BINARIZE_OFFSET) -> np.ndarray:
+    """Pixel is ink (0) if darker than its local mean minus offset, else paper (255)"""
+    if window is None:
+        window = max(15, int(min(gray.shape) * BINARIZE_WINDOW))
+    window |= 1
+    if cv2 is not None:
+        return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY, window, offset)
+
+    # Local mean from an integral image (edge-padded window)
+    half = window // 2
+    padded = np.pad(gray, half, mode='edge').astype(np.int32)
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.int32)
+    np.cumsum(np.cumsum(padded, axis=0), axis=1, out=integral[1:, 1:])
+    total = (integral[window:, window:] - integral[:-window, window:]
+             - integral[window:, :-window] + integral[:-window, :-window])
+    local_mean = total / (window * window)
+    return np.where(gray < local_mean - offset, 0, 255).astype(np.uint8)
+
+
+def estimate_skew(ink: np.ndarray) -> float:
+    """
+    Skew in degrees (positive = lines fall to the right) from an ink mask
+
+    Projection profile: shear the ink points by each candidate angle and keep
+    the angle whose row histogram is the most peaked (text lines aligned).
+    """
+    ys, xs = np.nonzero(ink)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > MAX_ANALYSIS_POINTS:
+        pick = np.random.default_rng(0).choice(len(ys), MAX_ANALYSIS_POINTS, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    ys = ys.astype(np.float32)
+    xs = xs.astype(np.float32)
+
+    def score(degrees: float) -> float:
+        rows = np.round(ys - xs * np.tan(np.radians(degrees))).astype(np.int64)
+        histogram = np.bincount(rows - rows.min())
+        return float(np.dot(histogram, histogram))
+
+    coarse = np.arange(-MAX_SKEW_DEGREES, MAX_SKEW_DEGREES + 1e-6, 1.0)
+    best = max(coarse, key=score)
+    fine = np.arange(best - 1.0, best + 1.0 + 1e-6, 0.1)
+    return float(max(fine, key=score))
+
+
+def text_line_height(ink: np.ndarray) -> Optional[float]:
+    """Median height (px) of the text lines in a deskewed ink mask, None if too few lines"""
+    profile = ink.sum(axis=1)
+    if profile.max() == 0:
+        return None
+    rows = profile > max(2, 0.05 * profile.max())
+    # Run lengths of consecutive text rows
+    edges = np.diff(np.concatenate(([0], rows.astype(np.int8), [0])))
+    starts = np.nonzero(edges == 1)[0]
+    ends = np.nonzero(edges == -1)[0]
+    heights = ends - starts
+    heights = heights[heights >= 3]
+    if len(heights) < 3:
+        return None
+    return float(np.median(heights))
+
+
+def ink_bounds(ink: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """(top, bottom, left, right) of the ink, ignoring speckle rows/columns"""
+    rows = np.nonzero(ink.sum(axis=1) > max(2, ink.shape[1] * 0.002))[0]
+    cols = np.nonzero(ink.sum(axis=0) > max(2, ink.shape[0] * 0.002))[0]
+    if len(rows) == 0 or len(cols) == 0:
+        return None
+    return int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1
+
+
+def analyze(gray: np.ndarray) -> Dict:
+    """Skew and text-line height, measured on a downsampled copy"""
+    factor = min(1.0, ANALYSIS_SIDE / max(gray.shape))
+    small = resize(gray, factor) if factor < 1.0 else gray
+    ink = adaptive_binarize(small) == 0
+    skew = estimate_skew(ink)
+    if abs(skew) >= SKEW_MIN_DEGREES:
+        ink = rotate(np.where(ink, 0, 255).astype(np.uint8), skew) < 128
+    line_height = text_line_height(ink)
+    return {"skew": skew, "line_height": line_height / factor if line_height else None}
+
+
+def normalize_scale(line_height: Optional[float], shape: Tuple[int, int]) -> float:
+    if line_height:
+        scale = min(max(TARGET_TEXT_HEIGHT / line_height, MIN_SCALE), MAX_SCALE)
+    else:
+        scale = min(1.0, MAX_SIDE / max(shape))
+    return 1.0 if abs(scale - 1.0) < SCALE_TOLERANCE else scale
+
+
+def preprocess(image, deskew: bool = True, normalize: bool = True, binarize: bool = True,
+               crop: bool = True) -> Tuple[np.ndarray, Dict]:
+    """
+    Run the enabled steps on one image
+
+    Returns:
+        (uint8 gray ndarray ready for OCR, report: per-step seconds in 'steps',
+         skew degrees, scale, line_height, size_in / size_out (w, h))
+    """
+    gray = to_gray(image)
+    report = {"steps": {}, "skew": 0.0, "scale": 1.0, "line_height": None,
+              "size_in": [gray.shape[1], gray.shape[0]]}
+
+    if deskew or normalize:
+        start = time.perf_counter()
+        analysis = analyze(gray)
+        report["steps"]["analyze"] = time.perf_counter() - start
+
+    # Resize before rotating: phone photos mostly shrink, so the rotation runs on fewer pixels
+    if normalize:
+        start = time.perf_counter()
+        scale = normalize_scale(analysis["line_height"], gray.shape)
+        if scale != 1.0:
+            gray = resize(gray, scale)
+        report["scale"] = round(scale, 3)
+        report["line_height"] = round(analysis["line_height"], 1) if analysis["line_height"] else None
+        report["steps"]["normalize"] = time.perf_counter() - start
+
+    if deskew:
+        start = time.perf_counter()
+        if abs(analysis["skew"]) >= SKEW_MIN_DEGREES:
+            gray = rotate(gray, analysis["skew"])
+            report["skew"] = round(analysis["skew"], 2)
+        report["steps"]["deskew"] = time.perf_counter() - start
+
+    ink = None
+    if binarize:
+        start = time.perf_counter()
+        gray = adaptive_binarize(gray)
+        ink = gray == 0
+        report["steps"]["binarize"] = time.perf_counter() - start
+
+    if crop:
+        start = time.perf_counter()
+        bounds = ink_bounds(ink if ink is not None else adaptive_binarize(gray) == 0)
+        if bounds is not None:
+            top, bottom, left, right = bounds
+            pad_y, pad_x = int(gray.shape[0] * MARGIN_PAD), int(gray.shape[1] * MARGIN_PAD)
+            gray = gray[max(0, top - pad_y):bottom + pad_y, max(0, left - pad_x):right + pad_x]
+        report["steps"]["crop"] = time.perf_counter() - start
+
+    report["size_out"] = [gray.shape[1], gray.shape[0]]
+    return np.ascontiguousarray(gray), report
+
+
+def save_png(gray: np.ndarray, out_dir: Optional[str] = None) -> str:
+    fd, path = tempfile.mkstemp(suffix=".png", dir=out_dir)
+    os.close(fd)
+    if cv2 is not None:
+        cv2.imwrite(path, gray)
+    else:
+        from PIL import Image
+        Image.fromarray(gray).save(path)
+    return path
+
+
+def preprocess_file(image_path: str, out_dir: Optional[str] = None, **steps) -> Tuple[str, Dict]:
+    """
+    Preprocess an image file into a temporary PNG (caller deletes it)
+
+    Phone photos are turned upright from their EXIF orientation first.
+    """
+    from PIL import Image, ImageOps
+
+    start = time.perf_counter()
+    with Image.open(image_path) as img:
+        img = ImageOps.exif_transpose(img)
+        gray = to_gray(img)
+    load_seconds = time.perf_counter() - start
+    processed, report = preprocess(gray, **steps)
+    report["steps"]["load"] = load_seconds
+    return save_png(processed, out_dir), report
+
+
+def render_scan_page(pdf, index: int) -> Tuple[np.ndarray, Dict]:
+    """
+    Render one page of an open pypdfium2 document at a text-height-normalized DPI, then preprocess
+
+    A quick ANALYSIS_DPI render measures the text lines; the page is rendered
+    once at the DPI that brings them to TARGET_TEXT_HEIGHT (MIN..MAX_RENDER_DPI).
+    """
+    page = pdf[index]
+    try:
+        start = time.perf_counter()
+        preview = to_gray(page.render(scale=ANALYSIS_DPI / 72, grayscale=True).to_pil())
+        line_height = analyze(preview)["line_height"]
+        dpi = ANALYSIS_DPI * TARGET_TEXT_HEIGHT / line_height if line_height else 300
+        dpi = min(max(dpi, MIN_RENDER_DPI), MAX_RENDER_DPI)
+        gray = to_gray(page.render(scale=dpi / 72, grayscale=True).to_pil())
+        render_seconds = time.perf_counter() - start
+    finally:
+        page.close()
+    # Size already normalized by the render DPI
+    processed, report = preprocess(gray, normalize=False)
+    report["steps"]["render"] = render_seconds
+    report["dpi"] = round(dpi)
+    report["line_height"] = round(line_height * dpi / ANALYSIS_DPI, 1) if line_height else None
+    return processed, report
+
+
+def describe(report: Dict) -> str:
+    """One log line for an image"""
+    parts = []
+    if report.get("skew"):
+        parts.append(f"deskew {report['skew']:+.1f}°")
+    if report.get("dpi"):
+        parts.append(f"{report['dpi']} dpi")
+    elif report.get("scale", 1.0) != 1.0:
+        parts.append(f"scale x{report['scale']:.2f}")
+    (w_in, h_in), (w_out, h_out) = report["size_in"], report["size_out"]
+    parts.append(f"{w_in}x{h_in} -> {w_out}x{h_out} px")
+    parts.append(f"{sum(report['steps'].values()) * 1000:.0f} ms")
+    return ", ".join(parts)
+
+
+class PreprocessStats:
+    """Totals over a run: seconds per step, rotations, rescales, pixels saved"""
+
+    def __init__(self):
+        self.images = 0
+        self.steps = {}
+        self.rotated = 0
+        self.downscaled = 0
+        self.upscaled = 0
+        self.pixels_in = 0
+        self.pixels_out = 0
+
+    def add(self, report: Optional[Dict]):
+        if not report:
+            return
+        self.images += 1
+        for step, seconds in report["steps"].items():
+            self.steps[step] = self.steps.get(step, 0.0) + seconds
+        self.rotated += bool(report.get("skew"))
+        self.downscaled += report.get("scale", 1.0) < 1.0
+        self.upscaled += report.get("scale", 1.0) > 1.0
+        self.pixels_in += report["size_in"][0] * report["size_in"][1]
+        self.pixels_out += report["size_out"][0] * report["size_out"][1]
+
+    def report(self) -> List[str]:
+        if not self.images:
+            return ["no images preprocessed"]
+        total = sum(self.steps.values())
+        timing = ", ".join(f"{step} {self.steps[step] / self.images * 1000:.0f}"
+                           for step in ("load", "render") + STEPS if step in self.steps)
+        change = (self.pixels_out / self.pixels_in - 1) * 100 if self.pixels_in else 0.0
+        return [f"{self.images} images, {total:.1f}s total ({timing} ms/image)",
+                f"{self.rotated} deskewed, {self.downscaled} downscaled, {self.upscaled} upscaled, "
+                f"pixels to OCR {change:+.0f}%"]
+
+
+class ReportedResult:
+    """
+    A converter result plus per-image reports (preprocess, cache, tiers)
+
+    Docling's ConversionResult is a pydantic model that rejects unknown
+    attributes, so reports ride on this wrapper; everything else is read
+    through to the wrapped result.
+    """
+
+    def __init__(self, result, **reports):
+        self.result = result
+        self.__dict__.update(reports)
+
+    def __getattr__(self, name):
+        if name == "result":
+            raise AttributeError(name)
+        return getattr(self.result, name)
+
+
+def with_reports(result, **reports):
+    """Attach reports to a result without mutating it (one wrapper per result)"""
+    if isinstance(result, ReportedResult):
+        result.__dict__.update(reports)
+        return result
+    return ReportedResult(result, **reports)
+
+
+class FailedResult:
+    """Result for an image that failed before OCR: errors set, no pages"""
+
+    def __init__(self, error: str):
+        self.errors = [error]
+        self.pages = {}
+        self.document = self
+
+    def export_to_markdown(self) -> str:
+        return ""
+
+
+class PreprocessingConverter:
+    """
+    DocumentConverter wrapper for image files: preprocess, then convert the cleaned PNG
+
+    Results carry the step report as result.preprocess (ReportedResult); totals go to self.stats.
+    """
+
+    def __init__(self, converter, stats: Optional[PreprocessStats] = None, **steps):
+        self.converter = converter
+        self.stats = stats or PreprocessStats()
+        self.steps = steps
+
+    def convert(self, image_path, **kwargs):
+        clean_path, report = preprocess_file(str(image_path), **self.steps)
+        try:
+            result = self.converter.convert(clean_path, **kwargs)
+        finally:
+            os.remove(clean_path)
+        self.stats.add(report)
+        return with_reports(result, preprocess=report)
+
+    def convert_all(self, image_paths, raises_on_error: bool = True, **kwargs):
+        image_paths = list(image_paths)
+        fed = []  # Index into image_paths of each path handed to the inner converter
+        failed = {}  # Index -> error, images whose preprocessing failed (never reach OCR)
+        reports = {}
+        clean_paths = []
+
+        def cleaned():
+            # Lazily, so each image is preprocessed right before Docling reaches it
+            for index, image_path in enumerate(image_paths):
+                try:
+                    clean_path, report = preprocess_file(str(image_path), **self.steps)
+                except Exception as e:
+                    if raises_on_error:
+                        raise
+                    failed[index] = f"Preprocessing failed: {type(e).__name__}: {e}"
+                    continue
+                clean_paths.append(clean_path)
+                reports[index] = report
+                fed.append(index)
+                yield clean_path
+
+        def failures_before(limit):
+            # Failed images are yielded in input order, between the OCR results around them
+            for index in sorted(i for i in failed if i < limit):
+                yield FailedResult(failed.pop(index))
+
+        try:
+            for position, result in enumerate(self.converter.convert_all(cleaned(), raises_on_error=raises_on_error,
+                                                                         **kwargs)):
+                index = fed[position]
+                yield from failures_before(index)
+                self.stats.add(reports[index])
+                yield with_reports(result, preprocess=reports[index])
+            yield from failures_before(len(image_paths))
+        finally:
+            for clean_path in clean_paths:
+                try:
+                    os.remove(clean_path)
+                except OSError:
+                    pass
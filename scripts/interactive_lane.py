@@ -0,0 +1,261 @@
+"""
+Interactive Lane (Spool Directory)
+==================================
+
+Khi một batch backfill đang chạy, người dùng import 1 file khẩn (DoclingService.
+processDocument) không nên phải chờ sau hàng nghìn file bulk:
+- Batch script mở spool: requests/ (client thả file JSON vào), results/ (kết quả)
+  và scheduler.json (heartbeat: còn nhận việc không, bao nhiêu worker warm)
+- Request được submit vào làn interactive của ConversionPool (reserved warm
+  worker, đi trước hàng bulk ở ranh giới document kế tiếp)
+- Đo latency từ lúc client gửi tới lúc có kết quả, so với INTERACTIVE_LATENCY_TARGET
+
+Client (không import docling, khởi động nhanh):
+    python interactive_lane.py file.pdf   -> JSON dạng DoclingResult trên stdout
+Exit code 2 = không có batch nào đang nhận việc, hoặc batch không xử lý loại file
+này; exit code 1 = batch convert lỗi (timeout, quarantine, worker crash). Cả hai
+-> caller tự convert như cũ.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+INTERACTIVE_SPOOL = r"D:\Work\Coding\QSM\interactive_spool"
+INTERACTIVE_LATENCY_TARGET = 5.0  # Seconds from request to result (e.g. a 1-page PDF during a backfill)
+SPOOL_POLL_INTERVAL = 0.1  # Seconds between requests/ scans (server) and results/ checks (client)
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_STALE = 10.0  # A heartbeat older than this = no scheduler running
+CLIENT_TIMEOUT = 600.0
+
+EXIT_CONVERSION_FAILED = 1  # Batch timeout / quarantine / worker crash: the caller converts it itself
+EXIT_NO_SCHEDULER = 2
+
+
+def _spool_paths(spool_dir: str) -> Dict[str, str]:
+    return {
+        "requests": os.path.join(spool_dir, "requests"),
+        "results": os.path.join(spool_dir, "results"),
+        "heartbeat": os.path.join(spool_dir, "scheduler.json"),
+    }
+
+
+def _write_json_atomic(path: str, data: Dict):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def scheduler_status(spool_dir: str = INTERACTIVE_SPOOL) -> Optional[Dict]:
+    """Heartbeat of the running batch, None if no scheduler accepts interactive work"""
+    try:
+        with open(_spool_paths(spool_dir)["heartbeat"], 'r', encoding='utf-8') as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if time.time() - status.get("updated_at", 0) > HEARTBEAT_STALE:
+        return None
+    return status
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))] if ordered else 0.0
+
+
+class InteractiveSpool:
+    """
+    Server side, run by the batch script next to its ConversionPool
+
+    on_request(request) is called on the spool thread for each new request
+    ({'id', 'path', 'submitted_at'}); the script submits it to the interactive
+    lane and calls complete(request, result) when the worker is done.
+    """
+
+    def __init__(self, spool_dir: str, on_request: Callable[[Dict], None], info: Optional[Dict] = None,
+                 latency_target: float = INTERACTIVE_LATENCY_TARGET):
+        self.paths = _spool_paths(spool_dir)
+        self.on_request = on_request
+        self.info = info or {}
+        self.latency_target = latency_target
+        self.latencies = []
+        self.failed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.paths["requests"], exist_ok=True)
+        os.makedirs(self.paths["results"], exist_ok=True)
+        self._heartbeat()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _heartbeat(self):
+        _write_json_atomic(self.paths["heartbeat"], {
+            "pid": os.getpid(), "updated_at": time.time(),
+            "latency_target": self.latency_target, **self.info,
+        })
+
+    def _run(self):
+        last_beat = time.time()
+        while not self._stop.wait(SPOOL_POLL_INTERVAL):
+            if time.time() - last_beat >= HEARTBEAT_INTERVAL:
+                last_beat = time.time()
+                try:
+                    self._heartbeat()
+                except OSError as e:
+                    print(f"WARNING: Could not update interactive heartbeat: {e}")
+            try:
+                names = sorted(n for n in os.listdir(self.paths["requests"]) if n.endswith('.json'))
+            except OSError:
+                continue
+            for name in names:
+                request_path = os.path.join(self.paths["requests"], name)
+                try:
+                    with open(request_path, 'r', encoding='utf-8') as f:
+                        request = json.load(f)
+                    os.remove(request_path)
+                except (OSError, ValueError):
+                    continue
+                request["received_at"] = time.time()
+                request["output_path"] = os.path.join(self.paths["results"], f"{request['id']}.md")
+                try:
+                    self.on_request(request)
+                except Exception as e:
+                    self.complete(request, {"success": False, "error": f"{type(e).__name__}: {e}"})
+
+    def complete(self, request: Dict, result: Dict) -> float:
+        """
+        Publish the result to the waiting client
+
+        Returns:
+            Latency in seconds (client submit -> result written)
+        """
+        response = {
+            "id": request["id"],
+            "success": bool(result.get("success")),
+            "error": result.get("error"),
+            "content_path": request["output_path"] if result.get("success") else None,
+            "route": result.get("route"),
+            "pages": result.get("pages"),
+            "elapsed": result.get("elapsed"),
+        }
+        latency = time.time() - request.get("submitted_at", request["received_at"])
+        response["latency"] = round(latency, 3)
+        _write_json_atomic(os.path.join(self.paths["results"], f"{request['id']}.json"), response)
+        self.latencies.append(latency)
+        if not response["success"]:
+            self.failed += 1
+        return latency
+
+    def report(self) -> List[str]:
+        if not self.latencies:
+            return ["no interactive requests"]
+        over = sum(1 for t in self.latencies if t > self.latency_target)
+        return [f"{len(self.latencies)} requests ({self.failed} failed), latency p50 "
+                f"{percentile(self.latencies, 0.5):.1f}s, p95 {percentile(self.latencies, 0.95):.1f}s, "
+                f"max {max(self.latencies):.1f}s, {over} over the {self.latency_target:.0f}s target"]
+
+    def stop(self):
+        """Stop accepting: clients fall back to their own conversion"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        try:
+            os.remove(self.paths["heartbeat"])
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+
+def submit(path: str, spool_dir: str = INTERACTIVE_SPOOL, timeout: float = CLIENT_TIMEOUT) -> Optional[Dict]:
+    """
+    Client: convert one document through the running batch's interactive lane
+
+    Returns:
+        Result dict (with 'content' on success), or None if no scheduler is running
+        or it doesn't handle this file type
+    """
+    status = scheduler_status(spool_dir)
+    if status is None:
+        return None
+    if "extensions" in status and os.path.splitext(path)[1].lower() not in status["extensions"]:
+        # Format the running batch doesn't convert (e.g. the PDF-only batch)
+        return None
+    paths = _spool_paths(spool_dir)
+    request = {"id": uuid.uuid4().hex, "path": os.path.abspath(path), "submitted_at": time.time()}
+    _write_json_atomic(os.path.join(paths["requests"], f"{request['id']}.json"), request)
+
+    result_path = os.path.join(paths["results"], f"{request['id']}.json")
+    deadline = time.time() + timeout
+    while not os.path.exists(result_path):
+        if time.time() > deadline:
+            return {"success": False, "error": f"No result after {timeout:.0f}s"}
+        if scheduler_status(spool_dir) is None:
+            # Batch ended while we were waiting
+            if os.path.exists(result_path):
+                break
+            return None
+        time.sleep(SPOOL_POLL_INTERVAL / 2)
+
+    with open(result_path, 'r', encoding='utf-8') as f:
+        result = json.load(f)
+    os.remove(result_path)
+    if result.get("content_path"):
+        with open(result["content_path"], 'r', encoding='utf-8') as f:
+            result["content"] = f.read()
+        os.remove(result["content_path"])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert one document through the batch's interactive lane")
+    parser.add_argument('file')
+    parser.add_argument('--spool', default=os.environ.get('QSM_INTERACTIVE_SPOOL', INTERACTIVE_SPOOL))
+    parser.add_argument('--timeout', type=float, default=CLIENT_TIMEOUT)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    result = submit(args.file, args.spool, args.timeout)
+    if result is None:
+        print(json.dumps({"status": "error", "error": "No batch scheduler is accepting interactive requests",
+                          "error_type": "SchedulerNotRunning"}))
+        sys.exit(EXIT_NO_SCHEDULER)
+
+    # Same shape as DoclingResult (src/services/doclingService.ts)
+    if not result["success"]:
+        print(json.dumps({"status": "error", "error": result.get("error"), "error_type": "ConversionError"},
+                         ensure_ascii=False))
+        sys.exit(EXIT_CONVERSION_FAILED)
+    table_count = sum(1 for line in result["content"].splitlines() if line.startswith("|") and "---" in line)
+    print(json.dumps({
+        "status": "success",
+        "content": result["content"],
+        "metadata": {
+            "pages": result.get("pages") or 0,
+            "has_tables": table_count > 0,
+            "table_count": table_count,
+            "processing_time": round(time.time() - start_time, 3),
+            "file_size": os.path.getsize(args.file),
+            "route": result.get("route"),
+            "queued_at": datetime.fromtimestamp(start_time).isoformat(),
+        },
+    }, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
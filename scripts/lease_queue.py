@@ -0,0 +1,374 @@
+"""
+Shared-Filesystem Lease Queue (multi-node)
+==========================================
+
+Nhiều máy cùng mount share Documents chạy batch_rag_universal với cùng
+DISTRIBUTED_QUEUE; không cần broker, chỉ cần file trên share:
+- Mỗi document = 1 item, key = hash(đường dẫn tương đối so với root + size +
+  mtime) -> giống nhau trên mọi node dù mount ở ổ/đường dẫn khác; file bị sửa
+  = item mới
+- Claim = tạo leases/<key>.<gen> bằng O_CREAT|O_EXCL (atomic trên SMB/NFS,
+  SQLite trên share thì không khóa đáng tin cậy). Lease ghi expires_at, node
+  đang giữ renew định kỳ trên 1 thread
+- Node chết -> lease hết hạn -> node khác tạo <key>.<gen+1> (chỉ 1 node thắng);
+  quá LEASE_MAX_CLAIMS lần thì item bị bỏ (file làm chết worker ở mọi node)
+- Xong -> done/<key> (completed / failed / abandoned) rồi mới xóa lease, node
+  khác thấy done thì bỏ qua
+- Clock giữa các node chỉ cần lệch ít hơn nhiều so với LEASE_SECONDS
+
+Chạy thử nhiều node trên 1 máy: vài process cùng DISTRIBUTED_QUEUE = thư mục tạm.
+Xem tiến độ chung / thả các item failed cho lần chạy sau:
+    python lease_queue.py QUEUE_DIR [--retry-failed]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import argparse
+import threading
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+LEASE_SECONDS = 300.0  # A lease not renewed for this long belongs to a dead node
+LEASE_RENEW_INTERVAL = 60.0
+LEASE_MAX_CLAIMS = 3  # Claims (first + reclaims) before an item is abandoned
+LEASE_RECHECK_INTERVAL = 15.0  # Seconds between passes over items leased by other nodes
+CAPACITY_POLL_INTERVAL = 0.2
+
+DONE_STATUSES = ('completed', 'failed', 'abandoned')
+
+
+def node_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _read_json(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json_atomic(path: str, data: Dict):
+    tmp_path = f"{path}.{socket.gethostname()}-{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class LeaseQueue:
+    """
+    One node's view of the shared queue
+
+    claimed(paths) yields the paths this node won; complete(path, status) is
+    called once a path reaches a final state (hook it to ProgressJournal.on_record).
+    """
+
+    def __init__(self, queue_dir: str, root_dir: str, node: Optional[str] = None,
+                 lease_seconds: float = LEASE_SECONDS, renew_interval: float = LEASE_RENEW_INTERVAL,
+                 max_claims: int = LEASE_MAX_CLAIMS):
+        self.queue_dir = queue_dir
+        self.root_dir = os.path.abspath(root_dir)
+        self.node = node or node_id()
+        self.lease_seconds = lease_seconds
+        self.renew_interval = renew_interval
+        self.max_claims = max_claims
+        self.leases_dir = os.path.join(queue_dir, "leases")
+        self.done_dir = os.path.join(queue_dir, "done")
+        self.held = {}  # path -> (key, gen)
+        self.lost = set()  # paths whose lease another node took over
+        self.stats = {"claimed": 0, "reclaimed": 0, "done_elsewhere": 0, "leased_elsewhere": 0,
+                      "abandoned": 0, "lost": 0, "released": 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.leases_dir, exist_ok=True)
+        os.makedirs(self.done_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._renew_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    # Keys / files
+
+    def item_key(self, path: str) -> str:
+        """Same on every node: path relative to the shared root + size + mtime (seconds)"""
+        abs_path = os.path.abspath(path)
+        try:
+            rel_path = os.path.relpath(abs_path, self.root_dir)
+        except ValueError:
+            rel_path = abs_path  # Other drive (Windows)
+        st = os.stat(abs_path)
+        identity = f"{rel_path.replace(os.sep, '/')}|{st.st_size}|{int(st.st_mtime)}"
+        return hashlib.sha1(identity.encode('utf-8')).hexdigest()
+
+    def _lease_path(self, key: str, gen: int) -> str:
+        return os.path.join(self.leases_dir, f"{key}.{gen}")
+
+    def _done_path(self, key: str) -> str:
+        return os.path.join(self.done_dir, key)
+
+    def _lease_record(self, path: str, gen: int) -> Dict:
+        now = time.time()
+        return {"node": self.node, "path": path, "gen": gen, "renewed_at": now,
+                "expires_at": now + self.lease_seconds}
+
+    def _expired(self, lease_path: str) -> bool:
+        try:
+            lease = _read_json(lease_path)
+            if lease is None:
+                # Created but not written yet, or torn: trust the file time
+                return time.time() - os.path.getmtime(lease_path) > self.lease_seconds
+        except FileNotFoundError:
+            return True
+        return time.time() > lease.get("expires_at", 0)
+
+    # Claiming
+
+    def try_claim(self, path: str) -> str:
+        """
+        Try to take the lease for one document
+
+        Returns:
+            'claimed', 'done' (finished by some node) or 'leased' (another node is on it)
+        """
+        key = self.item_key(path)
+        if os.path.exists(self._done_path(key)):
+            return 'done'
+
+        gen = 1
+        while True:
+            lease_path = self._lease_path(key, gen)
+            try:
+                fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._expired(lease_path):
+                    return 'leased'
+                gen += 1
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._lease_record(path, gen), f)
+            break
+
+        # A finisher writes done/ before deleting its leases: check again now that we hold one
+        if os.path.exists(self._done_path(key)):
+            self._remove_leases(key, gen)
+            return 'done'
+        if gen > self.max_claims:
+            # Every node that tried it died (worker crash loop, node killed mid-file)
+            self._finish(key, gen, path, 'abandoned', f"lease expired {gen - 1} times")
+            self.stats["abandoned"] += 1
+            print(f"WARNING: Lease queue gave up on {os.path.basename(path)} after {gen - 1} expired claims")
+            return 'done'
+
+        with self._lock:
+            self.held[path] = (key, gen)
+        self.stats["claimed"] += 1
+        if gen > 1:
+            self.stats["reclaimed"] += 1
+            print(f"  RECLAIMED: {os.path.basename(path)} (lease of a dead node expired)")
+        return 'claimed'
+
+    def claimed(self, paths: Iterable[str], has_capacity: Optional[Callable[[], bool]] = None,
+                on_skip: Optional[Callable[[str], None]] = None) -> Iterator[str]:
+        """
+        Yield the paths this node wins, in input order
+
+        Paths leased by other nodes are retried every LEASE_RECHECK_INTERVAL and
+        after the input ends, until each one is done somewhere or reclaimed here.
+        has_capacity() (e.g. free pool slots) is awaited before each claim so a
+        node only holds what it is about to convert; on_skip(path) is called for
+        paths another node finished.
+        """
+        deferred = []
+        last_recheck = time.time()
+
+        def attempt(path):
+            if has_capacity is not None:
+                while not has_capacity() and not self._stop.is_set():
+                    time.sleep(CAPACITY_POLL_INTERVAL)
+            try:
+                outcome = self.try_claim(path)
+            except FileNotFoundError:
+                outcome = 'done'  # Source deleted meanwhile
+            if outcome == 'done':
+                self.stats["done_elsewhere"] += 1
+                if on_skip is not None:
+                    on_skip(path)
+            return outcome
+
+        for path in paths:
+            outcome = attempt(path)
+            if outcome == 'claimed':
+                yield path
+            elif outcome == 'leased':
+                self.stats["leased_elsewhere"] += 1
+                deferred.append(path)
+            if deferred and time.time() - last_recheck >= LEASE_RECHECK_INTERVAL:
+                last_recheck = time.time()
+                yield from self._recheck(deferred, attempt)
+
+        while deferred and not self._stop.is_set():
+            self._stop.wait(LEASE_RECHECK_INTERVAL)
+            yield from self._recheck(deferred, attempt)
+
+    def _recheck(self, deferred, attempt):
+        still_leased = []
+        for path in deferred:
+            outcome = attempt(path)
+            if outcome == 'claimed':
+                yield path
+            elif outcome == 'leased':
+                still_leased.append(path)
+        deferred[:] = still_leased
+
+    # Holding / finishing
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.renew_interval):
+            with self._lock:
+                held = list(self.held.items())
+            for path, (key, gen) in held:
+                if os.path.exists(self._lease_path(key, gen + 1)):
+                    # We stalled past expiry and another node took over
+                    if path not in self.lost:
+                        self.lost.add(path)
+                        self.stats["lost"] += 1
+                        print(f"WARNING: Lease on {os.path.basename(path)} was taken over by another node")
+                    continue
+                # Re-check under the lock and write while holding it: complete() / release_all()
+                # pop the entry under the same lock before deleting the lease, so a renewal
+                # can never recreate a lease file after it was removed
+                with self._lock:
+                    if self.held.get(path) != (key, gen):
+                        continue
+                    try:
+                        _write_json_atomic(self._lease_path(key, gen), self._lease_record(path, gen))
+                    except OSError as e:
+                        print(f"WARNING: Could not renew lease on {os.path.basename(path)}: {e}")
+
+    def _remove_leases(self, key: str, upto_gen: int):
+        # Highest first: a node probing meanwhile never ends up below a leftover lease
+        for gen in range(upto_gen, 0, -1):
+            try:
+                os.remove(self._lease_path(key, gen))
+            except OSError:
+                pass
+
+    def _finish(self, key: str, gen: int, path: str, status: str, error: Optional[str] = None):
+        record = {"path": path, "node": self.node, "status": status, "finished_at": time.time()}
+        if error:
+            record["error"] = error[:500]
+        _write_json_atomic(self._done_path(key), record)
+        self._remove_leases(key, gen)
+
+    def complete(self, path: str, status: str):
+        """Final state of a held document: publish it and drop the lease (no-op if not held)"""
+        with self._lock:
+            entry = self.held.pop(path, None)
+        if entry is None:
+            return
+        key, gen = entry
+        try:
+            self._finish(key, gen, path, status)
+        except OSError as e:
+            print(f"WARNING: Could not record {os.path.basename(path)} in the lease queue: {e}")
+
+    def release_all(self):
+        """Give unfinished leases back (clean shutdown / Ctrl+C) so other nodes pick them up now"""
+        with self._lock:
+            held = list(self.held.items())
+            self.held.clear()
+        for path, (key, gen) in held:
+            self._remove_leases(key, gen)
+            self.stats["released"] += 1
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.release_all()
+
+    def summary(self) -> str:
+        s = self.stats
+        return (f"node {self.node}: {s['claimed']} claimed ({s['reclaimed']} reclaimed from dead nodes), "
+                f"{s['done_elsewhere']} done elsewhere, {s['leased_elsewhere']} found leased, "
+                f"{s['lost']} leases lost, {s['abandoned']} abandoned, {s['released']} released at exit")
+
+
+def queue_status(queue_dir: str) -> Dict:
+    """Counts over the whole queue (all nodes)"""
+    status = {s: 0 for s in DONE_STATUSES}
+    nodes = {}
+    done_dir = os.path.join(queue_dir, "done")
+    for name in os.listdir(done_dir) if os.path.isdir(done_dir) else []:
+        if name.endswith('.tmp'):
+            continue
+        try:
+            record = _read_json(os.path.join(done_dir, name)) or {}
+        except FileNotFoundError:
+            continue
+        state = record.get("status", "completed")
+        status[state] = status.get(state, 0) + 1
+        nodes[record.get("node", "?")] = nodes.get(record.get("node", "?"), 0) + 1
+    active = {}
+    leases_dir = os.path.join(queue_dir, "leases")
+    now = time.time()
+    for name in os.listdir(leases_dir) if os.path.isdir(leases_dir) else []:
+        if name.endswith('.tmp'):
+            continue
+        try:
+            lease = _read_json(os.path.join(leases_dir, name))
+        except FileNotFoundError:
+            continue
+        if lease and lease.get("expires_at", 0) > now:
+            active[lease["node"]] = active.get(lease["node"], 0) + 1
+    return {"done": status, "finished_by_node": nodes, "active_leases": active}
+
+
+def retry_failed(queue_dir: str) -> int:
+    """Drop failed/abandoned markers so the next run converts those documents again"""
+    done_dir = os.path.join(queue_dir, "done")
+    removed = 0
+    for name in os.listdir(done_dir) if os.path.isdir(done_dir) else []:
+        path = os.path.join(done_dir, name)
+        try:
+            record = _read_json(path) if not name.endswith('.tmp') else None
+        except FileNotFoundError:
+            continue
+        if record and record.get("status") in ('failed', 'abandoned'):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Status of a shared lease queue")
+    parser.add_argument('queue_dir')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help="release failed / abandoned documents for the next run")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.queue_dir):
+        print(f"ERROR: Queue not found: {args.queue_dir}")
+        sys.exit(1)
+    if args.retry_failed:
+        print(f"Released {retry_failed(args.queue_dir)} failed/abandoned documents")
+    status = queue_status(args.queue_dir)
+    done = status["done"]
+    print(f"Done: {done['completed']} completed, {done['failed']} failed, {done['abandoned']} abandoned")
+    for node, count in sorted(status["finished_by_node"].items()):
+        print(f"  {node}: {count} finished")
+    print(f"Active leases: {sum(status['active_leases'].values())}")
+    for node, count in sorted(status["active_leases"].items()):
+        print(f"  {node}: {count}")
+
+
+if __name__ == "__main__":
+    main()
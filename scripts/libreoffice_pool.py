@@ -0,0 +1,517 @@
+"""
+Pooled Headless LibreOffice (Legacy .doc/.xls/.ppt)
+===================================================
+
+File Office 97-2003 được nâng cấp lên OOXML (.docx/.xlsx/.pptx) trước khi
+trích xuất, dùng một pool cố định các instance `soffice --headless` chạy lâu:
+- Số instance cố định = giới hạn đồng thời, instance được dùng lại giữa các file
+  (khởi động soffice mới là chi phí chính)
+- Mỗi instance có profile riêng (-env:UserInstallation) và port UNO riêng
+- Timeout cho từng file: quá hạn -> kill instance, lần sau khởi động lại
+- Instance được restart sau MAX_CONVERSIONS_PER_INSTANCE file (LibreOffice rò bộ nhớ)
+Python của venv không có module `uno` -> mỗi instance được điều khiển bởi một
+process phụ chạy bằng Python đi kèm LibreOffice (program\python.exe), chính file
+này với --serve; venv gửi yêu cầu qua pipe stdin/stdout (JSON từng dòng), soffice
+vẫn warm giữa các file (mode "bridge").
+Không tìm được Python nào có `uno` -> fallback cuối cùng `soffice --convert-to`
+cho từng file (chậm, có cảnh báo), vẫn giới hạn đồng thời + timeout.
+"""
+
+import os
+import sys
+import json
+import queue
+import signal
+import shutil
+import tempfile
+import threading
+import subprocess
+import time
+from typing import Optional
+
+LEGACY_TARGETS = {
+    '.doc': ('.docx', 'MS Word 2007 XML'),
+    '.xls': ('.xlsx', 'Calc MS Excel 2007 XML'),
+    '.ppt': ('.pptx', 'Impress MS PowerPoint 2007 XML'),
+}
+
+SOFFICE_CANDIDATES = [
+    r"C:\Program Files\LibreOffice\program\soffice.exe",
+    r"C:\Program Files (x86)\LibreOffice\program\soffice.exe",
+    "soffice",
+    "libreoffice",
+]
+
+# Python that can import uno, tried when the current interpreter cannot
+OFFICE_PYTHON_CANDIDATES = [
+    "python.exe",  # Windows: bundled in LibreOffice\program
+    "python",  # Linux tarball / macOS: program/python or Resources/python
+    os.path.join("..", "Resources", "python"),
+]
+SYSTEM_PYTHON_CANDIDATES = ["python3", "/usr/bin/python3"]  # Linux distros: python3-uno
+
+BASE_PORT = 2202
+STARTUP_TIMEOUT = 60  # seconds for a fresh instance to accept UNO connections
+MAX_CONVERSIONS_PER_INSTANCE = 200
+
+
+class LegacyConversionError(Exception):
+    """A legacy file could not be upgraded (timeout, crash, unreadable)"""
+
+
+class LegacyConversionTimeout(LegacyConversionError):
+    """LibreOffice did not finish the file within the pool's timeout"""
+
+
+def find_soffice() -> Optional[str]:
+    """Path of the soffice executable, or None if LibreOffice is not installed"""
+    for candidate in SOFFICE_CANDIDATES:
+        if os.path.isabs(candidate):
+            if os.path.exists(candidate):
+                return candidate
+        else:
+            found = shutil.which(candidate)
+            if found:
+                return found
+    return None
+
+
+def find_office_python(soffice: str) -> Optional[str]:
+    """A Python that can import uno: LibreOffice's bundled one first, then the system's"""
+    program_dir = os.path.dirname(os.path.realpath(soffice))
+    candidates = [os.path.join(program_dir, name) for name in OFFICE_PYTHON_CANDIDATES]
+    candidates += [shutil.which(name) for name in SYSTEM_PYTHON_CANDIDATES]
+    for candidate in candidates:
+        if not candidate or not os.path.isfile(candidate):
+            continue
+        try:
+            subprocess.run([candidate, "-c", "import uno"], stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, timeout=30, check=True)
+        except (OSError, subprocess.SubprocessError):
+            continue
+        return candidate
+    return None
+
+
+def _file_url(path: str) -> str:
+    import uno
+    return uno.systemPathToFileUrl(os.path.abspath(path))
+
+
+def _props(**values):
+    from com.sun.star.beans import PropertyValue
+    props = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+
+class SofficeInstance:
+    """One long-lived soffice process with its own profile and UNO port"""
+
+    def __init__(self, soffice: str, index: int, work_dir: str):
+        self.soffice = soffice
+        self.index = index
+        self.port = BASE_PORT + index
+        self.profile_dir = os.path.join(work_dir, f"profile{index}")
+        self.process = None
+        self.desktop = None
+        self.conversions = 0
+        self.starts = 0
+
+    def _profile_url(self) -> str:
+        return "file:///" + os.path.abspath(self.profile_dir).replace("\\", "/").lstrip("/")
+
+    def _binary(self) -> str:
+        """soffice.bin next to the launcher, so kill() reaches the real process"""
+        directory = os.path.dirname(os.path.realpath(self.soffice))
+        for name in ("soffice.bin", "soffice.bin.exe"):
+            candidate = os.path.join(directory, name)
+            if os.path.exists(candidate):
+                return candidate
+        return self.soffice
+
+    def start(self):
+        import uno
+
+        self.process = subprocess.Popen(
+            [self._binary(), "--headless", "--invisible", "--nologo", "--norestore",
+             "--nodefault", "--nolockcheck", f"-env:UserInstallation={self._profile_url()}",
+             f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        self.starts += 1
+        self.conversions = 0
+
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            try:
+                ctx = resolver.resolve(
+                    f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext")
+                break
+            except Exception:
+                if self.process.poll() is not None or time.time() > deadline:
+                    self.kill()
+                    raise LegacyConversionError(f"LibreOffice instance {self.index} did not start")
+                time.sleep(0.5)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None and self.desktop is not None
+
+    def convert(self, src: str, dst: str, filter_name: str):
+        """Load hidden, store as OOXML, close (runs in the caller's timeout thread)"""
+        document = self.desktop.loadComponentFromURL(
+            _file_url(src), "_blank", 0, _props(Hidden=True, ReadOnly=True))
+        if document is None:
+            raise LegacyConversionError("LibreOffice could not open the file")
+        try:
+            document.storeToURL(_file_url(dst), _props(FilterName=filter_name, Overwrite=True))
+        finally:
+            document.close(True)
+        self.conversions += 1
+
+    def kill(self):
+        self.desktop = None
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait(timeout=10)
+        self.process = None
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+        self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                pass
+        self.kill()
+
+
+class BridgeInstance:
+    """
+    One warm soffice driven over UNO by a helper process (serve(), LibreOffice's Python)
+
+    The venv talks to the helper through its stdin/stdout, one JSON line per
+    request / reply. The helper restarts its soffice after MAX_CONVERSIONS_PER_INSTANCE.
+    """
+
+    def __init__(self, python: str, soffice: str, index: int, work_dir: str):
+        self.python = python
+        self.soffice = soffice
+        self.index = index
+        self.work_dir = work_dir
+        self.helper = None
+        self.soffice_pid = None
+        self.replies = None
+        self.starts = 0
+
+    def start(self):
+        self.helper = subprocess.Popen(
+            [self.python, os.path.abspath(__file__), "--serve", "--soffice", self.soffice,
+             "--index", str(self.index), "--work-dir", self.work_dir],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8', bufsize=1,
+        )
+        self.starts += 1
+        # Pipes cannot be polled with a timeout on Windows: a reader thread queues the replies
+        self.replies = queue.Queue()
+        threading.Thread(target=self._read, args=(self.helper, self.replies), daemon=True).start()
+
+        reply = self._reply(STARTUP_TIMEOUT + 10)
+        if reply is None or not reply["ok"]:
+            self.kill()
+            reason = reply["error"] if reply else "timed out"
+            raise LegacyConversionError(f"LibreOffice instance {self.index} did not start: {reason}")
+        self.soffice_pid = reply.get("pid")
+
+    @staticmethod
+    def _read(helper, replies):
+        for line in helper.stdout:
+            try:
+                replies.put(json.loads(line))
+            except ValueError:
+                continue
+        replies.put({"ok": False, "error": "LibreOffice helper exited"})
+
+    def _reply(self, timeout: float) -> Optional[dict]:
+        try:
+            return self.replies.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def alive(self) -> bool:
+        return self.helper is not None and self.helper.poll() is None
+
+    def convert(self, src: str, dst: str, filter_name: str, timeout: float) -> bool:
+        """Convert one file; returns True if the helper restarted soffice for it"""
+        try:
+            self.helper.stdin.write(json.dumps({"src": src, "dst": dst, "filter": filter_name}) + "\n")
+            self.helper.stdin.flush()
+        except OSError as e:
+            self.kill()
+            raise LegacyConversionError(f"LibreOffice helper is gone: {e}")
+
+        reply = self._reply(timeout)
+        if reply is None:
+            # Hung on this file: kill soffice and the helper, restarted for the next one
+            self.kill()
+            raise LegacyConversionTimeout(f"LibreOffice timed out after {timeout:.0f}s")
+        self.soffice_pid = reply.get("pid", self.soffice_pid)
+        if not reply["ok"]:
+            if not self.alive():
+                self.kill()
+            raise LegacyConversionError(reply["error"])
+        return reply.get("restarted", False)
+
+    def kill(self):
+        if self.soffice_pid is not None:
+            try:
+                os.kill(self.soffice_pid, signal.SIGTERM)
+            except OSError:
+                pass
+            self.soffice_pid = None
+        if self.helper is not None and self.helper.poll() is None:
+            self.helper.kill()
+            self.helper.wait(timeout=10)
+        self.helper = None
+
+    def stop(self):
+        if self.helper is not None:
+            # EOF on stdin: the helper terminates soffice and exits
+            try:
+                self.helper.stdin.close()
+                self.helper.wait(timeout=15)
+                self.soffice_pid = None
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+        self.kill()
+
+
+class LibreOfficePool:
+    """
+    Bounded pool of headless LibreOffice instances (thread-safe)
+
+    upgrade(path) blocks until an instance is free, so at most `size` legacy
+    files are converted at once no matter how many threads call it.
+    """
+
+    def __init__(self, size: int = 2, timeout: float = 120, soffice: Optional[str] = None,
+                 work_dir: Optional[str] = None):
+        self.soffice = soffice or find_soffice()
+        if self.soffice is None:
+            raise LegacyConversionError("LibreOffice (soffice) not found")
+        self.size = size
+        self.timeout = timeout
+        self.work_dir = work_dir or tempfile.mkdtemp(prefix="qsm_soffice_")
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        self.python = None
+        try:
+            import uno  # noqa: F401  (only importable from LibreOffice's Python / python3-uno)
+            self.mode = "uno"
+        except ImportError:
+            self.python = find_office_python(self.soffice)
+            self.mode = "bridge" if self.python else "cli"
+
+        self._free = queue.Queue()
+        for index in range(size):
+            if self.mode == "bridge":
+                self._free.put(BridgeInstance(self.python, self.soffice, index, self.work_dir))
+            else:
+                self._free.put(SofficeInstance(self.soffice, index, self.work_dir))
+        self._counter = 0
+        self._lock = threading.Lock()
+        self.stats = {"upgraded": 0, "failed": 0, "timeouts": 0, "restarts": 0, "seconds": 0.0}
+
+    def _output_path(self, path: str, target_ext: str) -> str:
+        with self._lock:
+            self._counter += 1
+            counter = self._counter
+        out_dir = os.path.join(self.work_dir, f"out{counter}")
+        os.makedirs(out_dir, exist_ok=True)
+        return os.path.join(out_dir, os.path.splitext(os.path.basename(path))[0] + target_ext)
+
+    def upgrade(self, path: str) -> str:
+        """
+        Convert a .doc/.xls/.ppt to OOXML in the pool's work dir
+
+        Returns:
+            Path of the upgraded file (delete it with discard() when done)
+        """
+        target_ext, filter_name = LEGACY_TARGETS[os.path.splitext(path)[1].lower()]
+        dst = self._output_path(path, target_ext)
+        start_time = time.time()
+
+        instance = self._free.get()
+        try:
+            if self.mode == "uno":
+                self._upgrade_uno(instance, path, dst, filter_name)
+            elif self.mode == "bridge":
+                self._upgrade_bridge(instance, path, dst, filter_name)
+            else:
+                self._upgrade_cli(instance, path, dst, target_ext, filter_name)
+            if not os.path.exists(dst):
+                raise LegacyConversionError("LibreOffice produced no output")
+        except Exception:
+            self._count("failed")
+            self.discard(dst)
+            raise
+        finally:
+            self._free.put(instance)
+
+        self._count("upgraded")
+        self._count("seconds", time.time() - start_time)
+        return dst
+
+    def _count(self, key: str, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _upgrade_uno(self, instance: SofficeInstance, src: str, dst: str, filter_name: str):
+        if not instance.alive() or instance.conversions >= MAX_CONVERSIONS_PER_INSTANCE:
+            if instance.starts:
+                self._count("restarts")
+            instance.stop()
+            instance.start()
+
+        error = []
+
+        def run():
+            try:
+                instance.convert(src, dst, filter_name)
+            except Exception as e:
+                error.append(e)
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        worker.join(self.timeout)
+        if worker.is_alive():
+            # Hung on this file: kill the instance, it is restarted for the next one
+            self._count("timeouts")
+            instance.kill()
+            raise LegacyConversionTimeout(f"LibreOffice timed out after {self.timeout:.0f}s")
+        if error:
+            if not instance.alive():
+                instance.kill()
+            raise LegacyConversionError(f"{type(error[0]).__name__}: {error[0]}")
+
+    def _upgrade_bridge(self, instance: BridgeInstance, src: str, dst: str, filter_name: str):
+        if not instance.alive():
+            if instance.starts:
+                self._count("restarts")
+            instance.start()
+        try:
+            if instance.convert(os.path.abspath(src), os.path.abspath(dst), filter_name, self.timeout):
+                self._count("restarts")
+        except LegacyConversionTimeout:
+            self._count("timeouts")
+            raise
+
+    def _upgrade_cli(self, instance: SofficeInstance, src: str, dst: str, target_ext: str, filter_name: str):
+        """Last resort, one soffice start per file (no Python with uno), still bounded by the pool"""
+        try:
+            subprocess.run(
+                [self.soffice, "--headless", "--norestore", "--nolockcheck",
+                 f"-env:UserInstallation={instance._profile_url()}",
+                 "--convert-to", f"{target_ext[1:]}:{filter_name}",
+                 "--outdir", os.path.dirname(dst), src],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                timeout=self.timeout, check=True,
+            )
+        except subprocess.TimeoutExpired:
+            self._count("timeouts")
+            raise LegacyConversionTimeout(f"LibreOffice timed out after {self.timeout:.0f}s")
+        except subprocess.CalledProcessError as e:
+            raise LegacyConversionError(f"soffice exited with code {e.returncode}")
+
+    def discard(self, upgraded_path: str):
+        """Remove an upgraded file and its per-file directory"""
+        shutil.rmtree(os.path.dirname(upgraded_path), ignore_errors=True)
+
+    def summary(self) -> str:
+        s = self.stats
+        avg = s["seconds"] / max(s["upgraded"], 1)
+        return (f"{s['upgraded']} upgraded ({avg:.1f}s avg), {s['failed']} failed, "
+                f"{s['timeouts']} timeouts, {s['restarts']} restarts, {self.size} instances ({self.mode})")
+
+    def close(self):
+        """Stop all instances and remove profiles / leftovers"""
+        while True:
+            try:
+                instance = self._free.get_nowait()
+            except queue.Empty:
+                break
+            instance.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def serve(soffice: str, index: int, work_dir: str):
+    """
+    Helper side of BridgeInstance (runs under a Python that has uno)
+
+    Requests {'src', 'dst', 'filter'} on stdin, replies {'ok', 'error', 'pid',
+    'restarted'} on stdout; EOF on stdin stops soffice.
+    """
+    replies = sys.stdout
+    sys.stdout = sys.stderr  # Nothing else may write to the reply pipe
+
+    def reply(**values):
+        replies.write(json.dumps(values) + "\n")
+        replies.flush()
+
+    instance = SofficeInstance(soffice, index, work_dir)
+    try:
+        instance.start()
+    except Exception as e:
+        reply(ok=False, error=f"{type(e).__name__}: {e}")
+        return
+    reply(ok=True, pid=instance.process.pid)
+
+    try:
+        for line in sys.stdin:
+            request = json.loads(line)
+            restarted = False
+            try:
+                if not instance.alive() or instance.conversions >= MAX_CONVERSIONS_PER_INSTANCE:
+                    instance.stop()
+                    instance.start()
+                    restarted = True
+                instance.convert(request["src"], request["dst"], request["filter"])
+                reply(ok=True, pid=instance.process.pid, restarted=restarted)
+            except Exception as e:
+                if not instance.alive():
+                    instance.kill()
+                reply(ok=False, error=f"{type(e).__name__}: {e}",
+                      pid=instance.process.pid if instance.process else None, restarted=restarted)
+    finally:
+        instance.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="LibreOffice UNO helper for LibreOfficePool (bridge mode)")
+    parser.add_argument('--serve', action='store_true', required=True)
+    parser.add_argument('--soffice', required=True)
+    parser.add_argument('--index', type=int, required=True)
+    parser.add_argument('--work-dir', required=True)
+    args = parser.parse_args()
+    serve(args.soffice, args.index, args.work_dir)
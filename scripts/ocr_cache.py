@@ -0,0 +1,269 @@
+"""
+Perceptual-Hash OCR Cache
+=========================
+
+Chạy lại ocr_image_to_word.py trên cùng ảnh chụp, hay scan lặp lại tiêu đề /
+con dấu / trang biểu mẫu -> OCR lại từ đầu. Cache trên đĩa, key gồm:
+- hash cảm nhận của ảnh ĐÃ chuẩn hóa (sau image_preprocess): lưới block-mean
+  ô HASH_CELL px (1/8 chiều cao dòng chữ TARGET_TEXT_HEIGHT), ngưỡng có mực /
+  không mực. Lưới cố định theo số cột hay pHash 64 bit như dedup.py quá thô:
+  trang 2000 px chia 128 cột -> ô 16 px, "1.250.000" và "1.850.000" trùng key
+  Khớp chính xác trên lưới, không so Hamming: nhiễu nén JPEG và một chữ số bị
+  sửa làm lệch cùng cỡ số ô -> khớp gần đúng sẽ trả nhầm text
+- fingerprint tùy chọn OCR (engine, ngôn ngữ, pipeline options)
+Hai loại entry: page (cả ảnh, CachedOcrConverter) và region (dòng chữ được
+tier accurate đọc lại, TieredOcrConverter). Hit -> bỏ qua nhận dạng hoàn toàn.
+
+Giới hạn dung lượng, xóa entry ít dùng nhất (LRU theo mtime) như ConversionCache.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from conversion_cache import options_fingerprint
+from image_preprocess import TARGET_TEXT_HEIGHT, to_gray, with_reports
+
+OCR_CACHE = os.environ.get('QSM_OCR_CACHE', "1") != "0"
+OCR_CACHE_DIR = os.environ.get('QSM_OCR_CACHE_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".ocr_cache"))
+OCR_CACHE_MAX_BYTES = 256 * 1024 ** 2  # 256 MB of JSON text, LRU eviction above this
+# Hash grid cell size in px: a digit on a normalized page (TARGET_TEXT_HEIGHT high) spans ~8x5 cells
+HASH_CELL = max(1, TARGET_TEXT_HEIGHT // 8)
+MAX_HASH_WIDTH = 1024  # Grid columns cap for huge un-normalized images (cells grow instead)
+INK_LEVEL = 192  # Grid cell counts as ink when its mean gray is below this
+
+KINDS = ("page", "region")
+
+
+def image_key(image) -> str:
+    """Perceptual key of a normalized image: block-mean ink grid of HASH_CELL px cells, aspect-preserving"""
+    from PIL import Image
+
+    gray = to_gray(image)
+    height, width = gray.shape
+    grid_width = max(1, min(-(-width // HASH_CELL), MAX_HASH_WIDTH))
+    grid_height = max(1, round(height * grid_width / width))
+    cells = np.asarray(Image.fromarray(gray).resize((grid_width, grid_height), Image.BOX))
+    bits = np.packbits(cells < INK_LEVEL)
+    return hashlib.sha1(f"{grid_width}x{grid_height}:".encode() + bits.tobytes()).hexdigest()
+
+
+class OcrCache:
+    """On-disk OCR results: <cache_dir>/<kind>/<key[:2]>/<key>-<fingerprint>.json"""
+
+    def __init__(self, cache_dir: str = OCR_CACHE_DIR, max_bytes: int = OCR_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {kind: {"hits": 0, "misses": 0, "saved": 0.0} for kind in KINDS}
+        self.stats["stores"] = 0
+        self.stats["evicted"] = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _entry_path(self, kind: str, key: str, fingerprint: str) -> str:
+        return os.path.join(self.cache_dir, kind, key[:2], f"{key}-{fingerprint}.json")
+
+    def _entries(self):
+        """Yield (path, size, mtime) for every cached entry"""
+        for root, dirs, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def get(self, kind: str, key: str, fingerprint: str) -> Optional[Dict]:
+        """Cached {'text', 'confidence', 'seconds'} for this image + options, or None"""
+        path = self._entry_path(kind, key, fingerprint)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.stats[kind]["misses"] += 1
+            return None
+
+        # Touch for LRU ordering
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.stats[kind]["hits"] += 1
+        self.stats[kind]["saved"] += entry.get("seconds", 0.0)
+        return entry
+
+    def put(self, kind: str, key: str, fingerprint: str, entry: Dict):
+        """Store an entry (atomic write), then evict if over the size cap"""
+        path = self._entry_path(kind, key, fingerprint)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        self.total_bytes += os.path.getsize(path) - old_size
+        self.stats["stores"] += 1
+
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Delete least-recently-used entries until under 90% of the cap"""
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self.total_bytes = sum(size for _, size, _ in entries)
+
+        for path, size, _ in entries:
+            if self.total_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_bytes -= size
+            self.stats["evicted"] += 1
+
+
+_cache = None
+
+
+def open_cache() -> Optional[OcrCache]:
+    """Process-wide OcrCache (None when OCR_CACHE is off or the directory is unusable)"""
+    global _cache
+    if _cache is None and OCR_CACHE:
+        try:
+            _cache = OcrCache()
+        except OSError as e:
+            print(f"WARNING: OCR cache disabled ({OCR_CACHE_DIR}): {e}")
+    return _cache
+
+
+class CachedResult:
+    """The part of a docling ConversionResult that the OCR tools read"""
+
+    def __init__(self, text: str, confidence: Optional[float]):
+        self.text = text
+        self.tiers = None
+        self.errors = []
+        self.document = self
+        self.pages = {1: None}
+        if confidence is not None:
+            self.confidence = SimpleNamespace(mean_grade=SimpleNamespace(value=confidence))
+
+    def export_to_markdown(self) -> str:
+        return self.text
+
+
+def _confidence(result) -> Optional[float]:
+    try:
+        return float(result.confidence.mean_grade.value)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class CachedOcrConverter:
+    """
+    Page-level cache in front of an image converter (DocumentConverter or TieredOcrConverter)
+
+    Sits inside PreprocessingConverter, so the key is computed on the normalized
+    image. Results carry result.cache = {'page_hit', 'saved', 'region_hits',
+    'region_lookups', 'region_saved'} (region counts from the tiered engine);
+    converted results are wrapped (ReportedResult), never mutated.
+    """
+
+    def __init__(self, converter, cache: OcrCache, *options):
+        self.converter = converter
+        self.cache = cache
+        self.fingerprint = options_fingerprint(*options)
+
+    def _lookup(self, image_path):
+        from PIL import Image
+
+        with Image.open(str(image_path)) as img:
+            key = image_key(img)
+        entry = self.cache.get("page", key, self.fingerprint)
+        if entry is None:
+            return key, None
+        result = CachedResult(entry["text"], entry.get("confidence"))
+        result.cache = {"page_hit": True, "saved": entry.get("seconds", 0.0),
+                        "region_hits": 0, "region_lookups": 0, "region_saved": 0.0}
+        return key, result
+
+    def _store(self, key: str, result, seconds: float):
+        """Cache a fresh result; returns it wrapped with its cache report"""
+        tiers = getattr(result, 'tiers', None) or {}
+        report = {"page_hit": False, "saved": 0.0,
+                  "region_hits": tiers.get("cache_hits", 0),
+                  "region_lookups": tiers.get("cache_lookups", 0),
+                  "region_saved": tiers.get("cache_saved", 0.0)}
+        if not getattr(result, 'errors', None):
+            self.cache.put("page", key, self.fingerprint,
+                           {"text": result.document.export_to_markdown(),
+                            "confidence": _confidence(result), "seconds": round(seconds, 3)})
+        return with_reports(result, cache=report)
+
+    def convert(self, image_path, **kwargs):
+        key, result = self._lookup(image_path)
+        if result is not None:
+            return result
+        start = time.perf_counter()
+        result = self.converter.convert(image_path, **kwargs)
+        return self._store(key, result, time.perf_counter() - start)
+
+    def convert_all(self, image_paths, **kwargs):
+        # One image at a time: hits never reach the inner converter
+        for image_path in image_paths:
+            key, result = self._lookup(image_path)
+            if result is None:
+                start = time.perf_counter()
+                result = next(iter(self.converter.convert_all([image_path], **kwargs)))
+                result = self._store(key, result, time.perf_counter() - start)
+            yield result
+
+
+def cached_converter(converter, *options):
+    """Wrap converter in the page cache when OCR_CACHE is on"""
+    cache = open_cache()
+    return CachedOcrConverter(converter, cache, *options) if cache is not None else converter
+
+
+class CacheStats:
+    """Totals over a run from the per-image result.cache reports"""
+
+    def __init__(self):
+        self.pages = 0
+        self.page_hits = 0
+        self.region_lookups = 0
+        self.region_hits = 0
+        self.saved = 0.0
+
+    def add(self, report: Optional[Dict]):
+        if not report:
+            return
+        self.pages += 1
+        self.page_hits += report["page_hit"]
+        self.region_lookups += report["region_lookups"]
+        self.region_hits += report["region_hits"]
+        self.saved += report["saved"] + report["region_saved"]
+
+    def report(self) -> List[str]:
+        if not self.pages:
+            return ["no lookups"]
+        line = f"pages {self.page_hits}/{self.pages} hits ({self.page_hits / self.pages:.0%})"
+        if self.region_lookups:
+            line += (f", regions {self.region_hits}/{self.region_lookups} hits "
+                     f"({self.region_hits / self.region_lookups:.0%})")
+        return [f"{line}, {self.saved:.1f}s OCR saved"]
@@ -0,0 +1,355 @@
+"""
+Tiered Multi-Engine OCR
+=======================
+
+research_vietnamese_ocr_optimization.py đề xuất "Multi-Engine Fallback". Lớp
+engine ở đây hiện thực nó:
+- tier fast:     RapidOCR (onnxruntime, CPU) detect + nhận dạng MỌI dòng
+- tier accurate: dòng có confidence < FALLBACK_CONFIDENCE được cắt ra và nhận
+                 dạng lại bằng EasyOCR vi/en (chậm hơn, dấu tiếng Việt chuẩn);
+                 giữ kết quả có confidence cao hơn
+Model mặc định của RapidOCR là ch/en: không có dấu tiếng Việt mà confidence vẫn
+cao -> khi chưa cấu hình RAPIDOCR_REC_MODEL (model rec Latin/Vietnamese), dòng
+chữ Latin không dấu cũng được chuyển sang tier accurate, gần như mọi dòng ->
+chậm hơn Docling. Vì vậy "auto" chỉ chọn tiered khi đã có model rec tiếng Việt;
+không thì phải bật rõ ràng (QSM_OCR_ENGINE=tiered). Tiered không có layout /
+bảng như Docling (do_table_structure): output là các đoạn văn theo thứ tự đọc.
+
+Engine mới: subclass OcrEngine + thêm vào ENGINES. TieredOcrConverter có cùng
+giao diện convert()/convert_all() như DocumentConverter cho các tool OCR ảnh;
+TierStats đếm tỉ lệ dòng và thời gian theo tier.
+"""
+
+import os
+import re
+import abc
+import time
+import importlib.util
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from conversion_cache import options_fingerprint
+from ocr_cache import image_key
+
+# docling = EasyOCR inside Docling (layout + tables), tiered = RapidOCR -> EasyOCR (no tables),
+# auto = tiered only when both are installed AND a Vietnamese rec model (RAPIDOCR_REC_MODEL) is set
+OCR_ENGINE = os.environ.get('QSM_OCR_ENGINE', "auto")
+FAST_ENGINE = "rapidocr"
+ACCURATE_ENGINE = "easyocr"
+ENGINES_BY_TIER = {"fast": FAST_ENGINE, "accurate": ACCURATE_ENGINE}
+FALLBACK_CONFIDENCE = 0.85  # Fast-tier lines below this are re-recognized
+RECHECK_MIN_CONFIDENCE = 0.3  # Plain-Latin recheck: accurate reading kept unless below this
+OCR_LANGUAGES = ["vi", "en"]
+RAPIDOCR_REC_MODEL = os.environ.get('QSM_RAPIDOCR_REC_MODEL')  # Latin/Vietnamese rec .onnx (None = bundled ch/en)
+RAPIDOCR_REC_KEYS = os.environ.get('QSM_RAPIDOCR_REC_KEYS')  # Character dictionary of that model
+CROP_PAD = 4  # px around a line box when it is cropped for the accurate tier
+PARAGRAPH_GAP = 1.5  # Vertical gap (x median line height) that starts a new paragraph
+
+_PLAIN_LATIN_WORD = re.compile(r"[A-Za-z]{2,}")
+_VIETNAMESE_CHARS = re.compile(r"[À-ỹđĐ]")
+
+
+class OcrEngine(abc.ABC):
+    """
+    One OCR engine: read() = detection + recognition on a page image,
+    recognize() = recognition of a single cropped line
+    """
+
+    name = ""
+    vietnamese = True  # Recognizer outputs Vietnamese diacritics
+
+    @classmethod
+    def available(cls) -> bool:
+        return False
+
+    @abc.abstractmethod
+    def read(self, image: np.ndarray) -> List[Dict]:
+        """Lines as {'box': (x0, y0, x1, y1), 'text': str, 'confidence': float}"""
+
+    @abc.abstractmethod
+    def recognize(self, crop: np.ndarray) -> Tuple[str, float]:
+        """Text and confidence of one cropped line"""
+
+
+def _box(points) -> Tuple[int, int, int, int]:
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return int(min(xs)), int(min(ys)), int(max(xs)), int(max(ys))
+
+
+class RapidOcrEngine(OcrEngine):
+    name = "rapidocr"
+
+    def __init__(self):
+        from rapidocr_onnxruntime import RapidOCR
+        kwargs = {}
+        if RAPIDOCR_REC_MODEL:
+            kwargs["rec_model_path"] = RAPIDOCR_REC_MODEL
+            if RAPIDOCR_REC_KEYS:
+                kwargs["rec_keys_path"] = RAPIDOCR_REC_KEYS
+        self.engine = RapidOCR(**kwargs)
+        self.vietnamese = bool(RAPIDOCR_REC_MODEL)
+
+    @classmethod
+    def available(cls) -> bool:
+        return importlib.util.find_spec("rapidocr_onnxruntime") is not None
+
+    def read(self, image: np.ndarray) -> List[Dict]:
+        result, _ = self.engine(image)
+        return [{"box": _box(points), "text": text, "confidence": float(score)}
+                for points, text, score in (result or [])]
+
+    def recognize(self, crop: np.ndarray) -> Tuple[str, float]:
+        result, _ = self.engine(crop, use_det=False, use_cls=False, use_rec=True)
+        if not result:
+            return "", 0.0
+        text, score = result[0]
+        return text, float(score)
+
+
+class EasyOcrEngine(OcrEngine):
+    name = "easyocr"
+
+    def __init__(self, detector: bool = True):
+        import easyocr
+        self.reader = easyocr.Reader(OCR_LANGUAGES, gpu=False, detector=detector, verbose=False)
+
+    @classmethod
+    def available(cls) -> bool:
+        return importlib.util.find_spec("easyocr") is not None
+
+    def read(self, image: np.ndarray) -> List[Dict]:
+        return [{"box": _box(points), "text": text, "confidence": float(score)}
+                for points, text, score in self.reader.readtext(image)]
+
+    def recognize(self, crop: np.ndarray) -> Tuple[str, float]:
+        gray = crop if crop.ndim == 2 else np.ascontiguousarray(crop[..., :3].mean(axis=2).astype(np.uint8))
+        result = self.reader.recognize(gray)
+        if not result:
+            return "", 0.0
+        _, text, score = result[0]
+        return text, float(score)
+
+
+ENGINES = {RapidOcrEngine.name: RapidOcrEngine, EasyOcrEngine.name: EasyOcrEngine}
+
+
+def tiered_available() -> bool:
+    return ENGINES[FAST_ENGINE].available() and ENGINES[ACCURATE_ENGINE].available()
+
+
+_resolved = {}
+
+
+def use_tiered(engine: str = OCR_ENGINE) -> bool:
+    """
+    Resolve OCR_ENGINE: True = TieredOcrConverter, False = Docling's EasyOCR pipeline
+
+    "auto" picks tiered only with a Vietnamese rec model: with the bundled ch/en
+    model almost every line is re-read by EasyOCR, slower than Docling alone.
+    Resolved once per process (the warning is printed once).
+    """
+    if engine not in _resolved:
+        if engine == "tiered":
+            if not tiered_available():
+                print(f"WARNING: tiered OCR needs {FAST_ENGINE} + {ACCURATE_ENGINE} "
+                      f"(pip install rapidocr_onnxruntime easyocr), using Docling")
+            _resolved[engine] = tiered_available()
+        elif engine == "auto":
+            _resolved[engine] = bool(RAPIDOCR_REC_MODEL) and tiered_available()
+        else:
+            _resolved[engine] = False
+    return _resolved[engine]
+
+
+def needs_fallback(line: Dict, fast_vietnamese: bool, threshold: float) -> bool:
+    if line["confidence"] < threshold:
+        return True
+    # Recognizer without a Vietnamese charset: diacritic-free words may be wrong at high confidence
+    return (not fast_vietnamese and _PLAIN_LATIN_WORD.search(line["text"]) is not None
+            and _VIETNAMESE_CHARS.search(line["text"]) is None)
+
+
+def lines_to_markdown(lines: List[Dict]) -> str:
+    """Reading order: rows of vertically overlapping boxes, paragraphs split on large gaps"""
+    if not lines:
+        return ""
+    lines = sorted(lines, key=lambda l: (l["box"][1], l["box"][0]))
+    heights = sorted(l["box"][3] - l["box"][1] for l in lines)
+    median_height = max(heights[len(heights) // 2], 1)
+
+    rows = []
+    for line in lines:
+        center = (line["box"][1] + line["box"][3]) / 2
+        if rows and rows[-1]["top"] <= center <= rows[-1]["bottom"]:
+            rows[-1]["lines"].append(line)
+            rows[-1]["bottom"] = max(rows[-1]["bottom"], line["box"][3])
+        else:
+            rows.append({"top": line["box"][1], "bottom": line["box"][3], "lines": [line]})
+
+    paragraphs = []
+    previous_bottom = None
+    for row in rows:
+        text = " ".join(l["text"] for l in sorted(row["lines"], key=lambda l: l["box"][0]) if l["text"])
+        if not text:
+            continue
+        if previous_bottom is None or row["top"] - previous_bottom > PARAGRAPH_GAP * median_height:
+            paragraphs.append([text])
+        else:
+            paragraphs[-1].append(text)
+        previous_bottom = row["bottom"]
+    return "\n\n".join("\n".join(p) for p in paragraphs)
+
+
+class TierStats:
+    """Lines and seconds per tier over a run"""
+
+    def __init__(self):
+        self.images = 0
+        self.lines = {"fast": 0, "accurate": 0}
+        self.seconds = {"fast": 0.0, "accurate": 0.0}
+        self.improved = 0  # Re-recognized lines where the accurate tier's result was kept
+
+    def add(self, tiers: Optional[Dict]):
+        if not tiers:
+            return
+        self.images += 1
+        for tier in ("fast", "accurate"):
+            self.lines[tier] += tiers["lines"][tier]
+            self.seconds[tier] += tiers["seconds"][tier]
+        self.improved += tiers.get("improved", 0)
+
+    def report(self) -> List[str]:
+        total = sum(self.lines.values())
+        if not total:
+            return ["no lines recognized"]
+        return [f"{tier} ({ENGINES_BY_TIER[tier]}): {self.lines[tier]}/{total} lines "
+                f"({self.lines[tier] / total:.0%}), {self.seconds[tier]:.1f}s"
+                for tier in ("fast", "accurate")] + \
+               [f"accurate tier kept for {self.improved}/{self.lines['accurate']} re-recognized lines"]
+
+
+def describe_tiers(tiers: Dict) -> str:
+    """One log line for an image"""
+    return (f"{tiers['lines']['fast']} lines {FAST_ENGINE} ({tiers['seconds']['fast']:.1f}s), "
+            f"{tiers['lines']['accurate']} re-read by {ACCURATE_ENGINE} ({tiers['seconds']['accurate']:.1f}s)")
+
+
+class TieredResult:
+    """The part of a docling ConversionResult that the OCR tools read"""
+
+    def __init__(self, text: str, confidence: Optional[float], tiers: Dict):
+        self.text = text
+        self.tiers = tiers
+        self.errors = []
+        self.document = self
+        self.pages = {1: None}
+        if confidence is not None:
+            self.confidence = SimpleNamespace(mean_grade=SimpleNamespace(value=confidence))
+
+    def export_to_markdown(self) -> str:
+        return self.text
+
+
+class TieredOcrConverter:
+    """
+    Drop-in for DocumentConverter.convert()/convert_all() on image files
+
+    The accurate engine is loaded on the first low-confidence line, so pages
+    the fast tier reads cleanly never pay for it. With an OcrCache, lines it
+    re-reads are cached as regions (repeated letterheads, stamps, form labels).
+    """
+
+    def __init__(self, fast: str = FAST_ENGINE, accurate: str = ACCURATE_ENGINE,
+                 threshold: float = FALLBACK_CONFIDENCE, stats: Optional[TierStats] = None, cache=None):
+        self.fast = ENGINES[fast]()
+        self.fast_name = fast
+        self.accurate_name = accurate
+        self._accurate = None
+        self.threshold = threshold
+        self.stats = stats or TierStats()
+        self.cache = cache
+        self.region_fingerprint = options_fingerprint({"engine": accurate, "languages": OCR_LANGUAGES})
+
+    def options(self) -> Dict:
+        """What the page-cache fingerprint depends on"""
+        return {"fast": self.fast_name, "accurate": self.accurate_name, "threshold": self.threshold,
+                "rec_model": RAPIDOCR_REC_MODEL, "languages": OCR_LANGUAGES}
+
+    @property
+    def accurate(self) -> OcrEngine:
+        if self._accurate is None:
+            engine = ENGINES[self.accurate_name]
+            self._accurate = engine(detector=False) if engine is EasyOcrEngine else engine()
+        return self._accurate
+
+    def recognize_region(self, crop: np.ndarray, tiers: Dict) -> Tuple[str, float]:
+        """Accurate-tier reading of one line crop, through the region cache"""
+        if self.cache is None:
+            return self.accurate.recognize(crop)
+        key = image_key(crop)
+        tiers["cache_lookups"] += 1
+        entry = self.cache.get("region", key, self.region_fingerprint)
+        if entry is not None:
+            tiers["cache_hits"] += 1
+            tiers["cache_saved"] += entry.get("seconds", 0.0)
+            return entry["text"], entry["confidence"]
+        start = time.perf_counter()
+        text, confidence = self.accurate.recognize(crop)
+        self.cache.put("region", key, self.region_fingerprint,
+                       {"text": text, "confidence": confidence, "seconds": round(time.perf_counter() - start, 4)})
+        return text, confidence
+
+    def ocr(self, image: np.ndarray) -> Tuple[List[Dict], Dict]:
+        tiers = {"lines": {"fast": 0, "accurate": 0}, "seconds": {"fast": 0.0, "accurate": 0.0}, "improved": 0,
+                 "cache_hits": 0, "cache_lookups": 0, "cache_saved": 0.0}
+
+        start = time.perf_counter()
+        lines = self.fast.read(image)
+        tiers["seconds"]["fast"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        height, width = image.shape[:2]
+        for line in lines:
+            if not needs_fallback(line, self.fast.vietnamese, self.threshold):
+                tiers["lines"]["fast"] += 1
+                continue
+            tiers["lines"]["accurate"] += 1
+            low_confidence = line["confidence"] < self.threshold
+            x0, y0, x1, y1 = line["box"]
+            crop = image[max(0, y0 - CROP_PAD):min(height, y1 + CROP_PAD),
+                         max(0, x0 - CROP_PAD):min(width, x1 + CROP_PAD)]
+            if crop.size == 0:
+                continue
+            text, confidence = self.recognize_region(crop, tiers)
+            # Confidences of two engines are not comparable: a plain-Latin recheck (fast tier
+            # cannot output diacritics) keeps the accurate reading unless it is near-garbage
+            if text and confidence >= (line["confidence"] if low_confidence else RECHECK_MIN_CONFIDENCE):
+                line["text"], line["confidence"] = text, confidence
+                tiers["improved"] += 1
+        tiers["seconds"]["accurate"] = time.perf_counter() - start
+        return lines, tiers
+
+    def convert(self, image_path, **kwargs) -> TieredResult:
+        from PIL import Image
+
+        with Image.open(str(image_path)) as img:
+            image = np.asarray(img.convert("RGB"))
+        lines, tiers = self.ocr(image)
+        self.stats.add(tiers)
+        confidence = float(np.mean([l["confidence"] for l in lines])) if lines else None
+        return TieredResult(lines_to_markdown(lines), confidence, tiers)
+
+    def convert_all(self, image_paths, raises_on_error: bool = True, **kwargs):
+        for image_path in image_paths:
+            try:
+                yield self.convert(image_path)
+            except Exception as e:
+                if raises_on_error:
+                    raise
+                result = TieredResult("", None, None)
+                result.errors = [e]
+                result.pages = {}
+                yield result
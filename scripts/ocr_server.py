@@ -0,0 +1,297 @@
+"""
+Warm OCR Server (localhost HTTP)
+================================
+
+Mỗi lần chạy ocr_image_to_word.py (ocr-quick.bat / .ps1) phải import docling
+và load model EasyOCR vi/en -> vài chục giây cho ảnh 1 trang. Server này giữ
+converter + model warm:
+- python scripts/ocr_server.py  (ocr-server.bat) -> lắng nghe OCR_SERVER_URL
+- Khởi động: OCR 1 ảnh trắng nhỏ để pipeline và model load xong trước request đầu
+- Ảnh được tiền xử lý (image_preprocess.py) trước OCR nếu pipeline yêu cầu;
+  engine tiered (ocr_engines.py) nếu được bật, không thì Docling EasyOCR; cache
+  OCR (ocr_cache.py) theo ảnh đã chuẩn hóa
+- POST /ocr {"path": ..., "pipeline": {"preprocess", "table_structure"}}
+  -> {"success", "text", "confidence", "preprocess", "tiers", "cache", "time", "error"}
+  GET /health -> trạng thái
+- Mỗi tool gửi pipeline của nó (ocr_image_to_word: có bảng + tiền xử lý,
+  ocr-images-to-doc: theo PREPROCESS_IMAGES): output giống hệt OCR in-process.
+  Một converter warm cho mỗi pipeline (tạo ở request đầu tiên), model OCR dùng
+  chung giữa các pipeline chỉ khác bước tiền xử lý
+- Request được xử lý lần lượt (lock)
+
+Client (OcrClient) chỉ dùng thư viện chuẩn: CLI khởi động nhanh, không có
+server thì caller tự setup() converter như cũ.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+OCR_SERVER_URL = os.environ.get('QSM_OCR_SERVER_URL', "http://127.0.0.1:8766")
+HEALTH_TIMEOUT = 0.3  # Seconds: a client gives up on the server this fast when it isn't running
+REQUEST_TIMEOUT = 600.0
+OCR_LANGUAGES = ["vi", "en"]
+# ocr_image_to_word.setup(); table_structure None = Docling's default
+DEFAULT_PIPELINE = {"preprocess": True, "table_structure": True}
+
+
+class OcrServerUnavailable(Exception):
+    """Server not running (or died): caller falls back to in-process OCR"""
+
+
+def build_ocr_converter(table_structure: Optional[bool] = True):
+    """OCR behind the page cache: tiered OCR, or Docling EasyOCR vi/en (full-page OCR)"""
+    from ocr_engines import TieredOcrConverter, use_tiered
+    from ocr_cache import cached_converter, open_cache
+    if use_tiered():
+        tiered = TieredOcrConverter(cache=open_cache())
+        return cached_converter(tiered, tiered.options())
+
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions, EasyOcrOptions
+
+    opts = PdfPipelineOptions()
+    opts.do_ocr = True
+    if table_structure is not None:
+        opts.do_table_structure = table_structure
+    opts.ocr_options = EasyOcrOptions(lang=OCR_LANGUAGES, force_full_page_ocr=True)
+    converter = DocumentConverter(format_options={InputFormat.IMAGE: PdfFormatOption(pipeline_options=opts)})
+    return cached_converter(converter, opts)
+
+
+def build_converter(preprocess: bool = True, table_structure: Optional[bool] = True):
+    """An OCR tool's image pipeline: preprocessing (optional), then build_ocr_converter()"""
+    from image_preprocess import PreprocessingConverter
+    converter = build_ocr_converter(table_structure)
+    return PreprocessingConverter(converter) if preprocess else converter
+
+
+def warm_up(converter):
+    """First convert builds the image pipeline and loads the OCR models"""
+    from PIL import Image
+
+    # Innermost converter: preprocessing is not needed and a cache hit would skip the load
+    while hasattr(converter, 'converter'):
+        converter = converter.converter
+    fd, path = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    try:
+        Image.new("RGB", (200, 60), "white").save(path)
+        converter.convert(path)
+    finally:
+        os.remove(path)
+    # Tiered OCR loads its accurate engine on the first low-confidence line: load it now
+    if hasattr(converter, 'accurate'):
+        converter.accurate
+
+
+def pipeline_key(pipeline: Optional[Dict]) -> Tuple[bool, Optional[bool]]:
+    pipeline = {**DEFAULT_PIPELINE, **(pipeline or {})}
+    return bool(pipeline["preprocess"]), pipeline["table_structure"]
+
+
+class OcrService:
+    def __init__(self, ocr_converter, tiered: bool = False):
+        self.tiered = tiered
+        # Tiered OCR has no table structure: every pipeline shares one OCR converter
+        self.ocr_converters = {self._ocr_key(DEFAULT_PIPELINE["table_structure"]): ocr_converter}
+        self.converters = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.requests = 0
+        self.busy_seconds = 0.0
+
+    def _ocr_key(self, table_structure: Optional[bool]) -> Optional[bool]:
+        return None if self.tiered else table_structure
+
+    def converter(self, pipeline: Optional[Dict]):
+        """Warm converter for a tool's pipeline, built on first use (call under self.lock)"""
+        from image_preprocess import PreprocessingConverter
+
+        key = pipeline_key(pipeline)
+        if key not in self.converters:
+            preprocess, table_structure = key
+            ocr_key = self._ocr_key(table_structure)
+            if ocr_key not in self.ocr_converters:
+                print(f"Loading OCR pipeline (table_structure={table_structure})...")
+                self.ocr_converters[ocr_key] = build_ocr_converter(table_structure)
+            ocr_converter = self.ocr_converters[ocr_key]
+            self.converters[key] = PreprocessingConverter(ocr_converter) if preprocess else ocr_converter
+        return self.converters[key]
+
+    def ocr(self, path: str, pipeline: Optional[Dict] = None) -> Dict:
+        if not os.path.isfile(path):
+            return {"success": False, "error": f"Not found: {path}"}
+        with self.lock:
+            start_time = time.time()
+            try:
+                r = self.converter(pipeline).convert(path)
+                text = r.document.export_to_markdown()
+                confidence = None
+                if hasattr(r, 'confidence') and hasattr(r.confidence, 'mean_grade'):
+                    confidence = float(r.confidence.mean_grade.value)
+                result = {"success": True, "text": text, "confidence": confidence,
+                          "preprocess": getattr(r, 'preprocess', None), "tiers": getattr(r, 'tiers', None),
+                          "cache": getattr(r, 'cache', None)}
+            except Exception as e:
+                result = {"success": False, "error": f"{type(e).__name__}: {e}"}
+            result["time"] = time.time() - start_time
+            self.requests += 1
+            self.busy_seconds += result["time"]
+        return result
+
+    def health(self) -> Dict:
+        return {"status": "ok", "pid": os.getpid(), "languages": OCR_LANGUAGES,
+                "engine": "tiered" if self.tiered else "docling",
+                "pipelines": [{"preprocess": p, "table_structure": t} for p, t in self.converters],
+                "uptime": round(time.time() - self.started_at, 1),
+                "requests": self.requests, "busy_seconds": round(self.busy_seconds, 1)}
+
+
+def make_handler(service: OcrService):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, code: int, payload: Dict):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, service.health())
+            else:
+                self._send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/ocr":
+                self._send(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                path = request["path"]
+                pipeline = request.get("pipeline")
+                pipeline_key(pipeline)
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {"success": False, "error": f"Bad request: {e}"})
+                return
+            result = service.ocr(path, pipeline)
+            print(f"[*] {os.path.basename(path)}: "
+                  + (f"{len(result['text'].split())} words in {result['time']:.1f}s" if result["success"]
+                     else f"[ERROR] {result['error']}"))
+            self._send(200, result)
+
+        def log_message(self, format, *args):
+            pass  # One line per OCR request is printed above
+
+    return Handler
+
+
+class RemoteResult:
+    """Mirrors the part of a docling ConversionResult that the OCR CLIs read"""
+
+    def __init__(self, payload: Dict):
+        self.text = payload.get("text", "")
+        self.server_time = payload.get("time", 0.0)
+        self.preprocess = payload.get("preprocess")
+        self.tiers = payload.get("tiers")
+        self.cache = payload.get("cache")
+        self.document = self
+        if payload.get("confidence") is not None:
+            self.confidence = SimpleNamespace(mean_grade=SimpleNamespace(value=payload["confidence"]))
+
+    def export_to_markdown(self) -> str:
+        return self.text
+
+
+class OcrClient:
+    """
+    Drop-in for DocumentConverter.convert() backed by the warm server
+
+    convert() raises OcrServerUnavailable if the server went away; OCR errors
+    are raised as RuntimeError like a local conversion failure.
+    """
+
+    def __init__(self, url: str = OCR_SERVER_URL, pipeline: Optional[Dict] = None, status: Optional[Dict] = None):
+        self.url = url.rstrip('/')
+        self.pipeline = pipeline
+        self.status = status or {}
+
+    def convert(self, path: str) -> RemoteResult:
+        data = json.dumps({"path": os.path.abspath(str(path)), "pipeline": self.pipeline}).encode('utf-8')
+        request = urllib.request.Request(f"{self.url}/ocr", data=data,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+                payload = json.loads(response.read())
+        except (urllib.error.URLError, ConnectionError, socket.timeout) as e:
+            raise OcrServerUnavailable(str(e))
+        if not payload.get("success"):
+            raise RuntimeError(payload.get("error", "OCR failed"))
+        return RemoteResult(payload)
+
+
+def server_status(url: str = OCR_SERVER_URL, timeout: float = HEALTH_TIMEOUT) -> Optional[Dict]:
+    """/health of a running server, None if none answers"""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/health", timeout=timeout) as response:
+            return json.loads(response.read())
+    except (urllib.error.URLError, ConnectionError, socket.timeout, ValueError):
+        return None
+
+
+def connect(url: str = OCR_SERVER_URL, pipeline: Optional[Dict] = None) -> Optional[OcrClient]:
+    """
+    OcrClient if a server is running, else None
+
+    pipeline: the calling tool's {'preprocess', 'table_structure'} (None = DEFAULT_PIPELINE),
+    so results match its in-process OCR.
+    """
+    status = server_status(url)
+    return OcrClient(url, pipeline, status) if status is not None else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep the OCR converter and EasyOCR models warm for the OCR tools")
+    parser.add_argument('--url', default=OCR_SERVER_URL, help="listen address (localhost only)")
+    args = parser.parse_args()
+
+    parsed = urlparse(args.url)
+    host, port = parsed.hostname or "127.0.0.1", parsed.port or 8766
+    if server_status(args.url) is not None:
+        print(f"[!] An OCR server is already running at {args.url}")
+        sys.exit(1)
+
+    from ocr_engines import use_tiered
+
+    print("Loading OCR models...")
+    start_time = time.time()
+    ocr_converter = build_ocr_converter(DEFAULT_PIPELINE["table_structure"])
+    warm_up(ocr_converter)
+    print(f"Ready in {time.time() - start_time:.1f}s - listening on http://{host}:{port} (Ctrl+C to stop)")
+
+    server = ThreadingHTTPServer((host, port), make_handler(OcrService(ocr_converter, use_tiered())))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[!] Stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
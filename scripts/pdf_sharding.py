@@ -0,0 +1,262 @@
+"""
+PDF Page-Range Sharding
+=======================
+
+Chia PDF lớn (scan pháp lý 400 trang...) thành các đoạn trang để nhiều worker
+convert song song, sau đó ghép markdown lại theo đúng thứ tự trang.
+
+- Ngưỡng cắt theo số trang HOẶC dung lượng file
+- Mỗi shard ghi ra file tạm <output>.partNNNN.md
+- Khi đủ shard: ghép theo thứ tự (boundary_join), xóa file tạm
+- Checkpoint (tùy chọn): shard xong được ghi vào <output>.shards.ckpt, lần chạy
+  sau (sau Ctrl+C / reboot) chỉ convert các shard còn thiếu rồi ghép
+
+Ghép nhiều đoạn trang KHÔNG giống hệt export của cả file: Docling chỉ gộp những
+gì nằm trong cùng một lần convert. boundary_join (dùng chung cho shard, streaming
+export và các đoạn text layer / OCR của text_layer) nối lại list và đoạn văn bị
+cắt ngang ranh giới, nhưng:
+- bảng vắt qua ranh giới -> 2 bảng
+- đoạn văn bị cắt mà dòng sau viết hoa / bắt đầu bằng số -> 2 đoạn
+- header / footer trang, caption và cấp heading được quyết định theo từng đoạn
+Khác biệt chỉ ở ranh giới đoạn; nội dung và thứ tự trang giữ nguyên.
+"""
+
+import os
+import re
+import json
+from typing import Dict, List, Optional, Tuple
+
+# Defaults (scripts override via their own config)
+SHARD_MIN_PAGES = 60  # Shard PDFs with at least this many pages
+SHARD_MIN_BYTES = 50 * 1024 * 1024  # ...or at least this many bytes
+SHARD_PAGES = 25  # Pages per shard
+
+MARKDOWN_JOIN = "\n\n"
+
+_LIST_ITEM = re.compile(r"^(\s*)([-*+]|\d+[.)])\s")
+_BLOCK_START = re.compile(r"^(#|\||<!--|```|>|!\[)")
+_SENTENCE_END = ".!?:;\"')]…"
+
+
+def boundary_join(tail: str, head: str) -> str:
+    """
+    Separator between the last line of one page range's markdown and the first line of the next
+
+    - list item followed by list item -> same list ("\\n")
+    - paragraph cut at the boundary (no closing punctuation, next line lowercase)
+      -> one paragraph (" "), as Docling merges paragraphs across pages
+    - otherwise MARKDOWN_JOIN
+    """
+    if _LIST_ITEM.match(tail) and _LIST_ITEM.match(head):
+        return "\n"
+    if (tail and head and not _BLOCK_START.match(tail) and not _BLOCK_START.match(head)
+            and not _LIST_ITEM.match(head) and tail[-1] not in _SENTENCE_END and head[0].islower()):
+        return " "
+    return MARKDOWN_JOIN
+
+
+def join_markdown(parts: List[str]) -> str:
+    """Markdown of consecutive page ranges as one document (empty parts dropped)"""
+    joined = ""
+    for part in parts:
+        part = part.strip('\n')
+        if not part:
+            continue
+        if joined:
+            joined += boundary_join(joined.rsplit('\n', 1)[-1], part.split('\n', 1)[0])
+        joined += part
+    return joined
+
+
+def get_pdf_page_count(pdf_path: str) -> Optional[int]:
+    """Read page count with pypdfium2 (cheap, no rendering). None if unreadable."""
+    try:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    except Exception:
+        pass
+
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(pdf_path).pages)
+    except Exception:
+        return None
+
+
+def should_shard(page_count: Optional[int], size_bytes: int,
+                 min_pages: int = SHARD_MIN_PAGES,
+                 min_bytes: int = SHARD_MIN_BYTES,
+                 pages_per_shard: int = SHARD_PAGES) -> bool:
+    """Decide whether a PDF is big enough to be split across workers"""
+    if not page_count or page_count <= pages_per_shard:
+        return False
+    return page_count >= min_pages or size_bytes >= min_bytes
+
+
+def plan_shards(page_count: int, pages_per_shard: int = SHARD_PAGES) -> List[Tuple[int, int]]:
+    """
+    Split [1, page_count] into page ranges
+
+    Returns:
+        List of (first_page, last_page) tuples, 1-based and inclusive
+        (same convention as DocumentConverter.convert(page_range=...))
+    """
+    return [
+        (start, min(start + pages_per_shard - 1, page_count))
+        for start in range(1, page_count + 1, pages_per_shard)
+    ]
+
+
+def shard_part_path(output_path: str, shard_index: int) -> str:
+    """Temporary markdown file for one shard"""
+    return f"{output_path}.part{shard_index:04d}.md"
+
+
+def build_shard_tasks(path: str, output_path: str, page_count: int,
+                      pages_per_shard: int = SHARD_PAGES) -> List[Dict]:
+    """Create one pool task per page range"""
+    ranges = plan_shards(page_count, pages_per_shard)
+    return [
+        {
+            "path": path,
+            "page_range": page_range,
+            "shard_index": index,
+            "shard_count": len(ranges),
+            "part_path": shard_part_path(output_path, index),
+        }
+        for index, page_range in enumerate(ranges)
+    ]
+
+
+def merge_shard_outputs(part_paths: List[str], output_path: str, cleanup: bool = True) -> int:
+    """
+    Concatenate shard markdown files in page order (boundary_join between shards, no
+    trailing newline, like a whole-document export)
+
+    Returns:
+        Number of characters written
+    """
+    written = 0
+    tail = None
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as out:
+        for part_path in part_paths:
+            with open(part_path, 'r', encoding='utf-8') as f:
+                content = f.read().strip('\n')
+            if not content:
+                continue
+            if tail is not None:
+                separator = boundary_join(tail, content.split('\n', 1)[0])
+                out.write(separator)
+                written += len(separator)
+            out.write(content)
+            written += len(content)
+            tail = content.rsplit('\n', 1)[-1]
+    os.replace(tmp_path, output_path)
+
+    if cleanup:
+        for part_path in part_paths:
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+
+    return written
+
+
+def shard_checkpoint_path(output_path: str) -> str:
+    """Completed-shard list of a file, kept until the merge"""
+    return f"{output_path}.shards.ckpt"
+
+
+def _shard_key(path: str, tasks: List[Dict]) -> Dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "ranges": [list(t["page_range"]) for t in tasks]}
+
+
+def _save_shard_checkpoint(entry: Dict):
+    tmp_path = f"{entry['checkpoint_path']}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"key": entry["checkpoint_key"], "done": sorted(entry["done"])}, f)
+    os.replace(tmp_path, entry["checkpoint_path"])
+
+
+def register_sharded_file(shard_state: Dict, path: str, output_path: str, tasks: List[Dict],
+                          checkpoint: bool = False) -> List[Dict]:
+    """
+    Remember which shards belong to a file so the parent can merge them later
+
+    Args:
+        checkpoint: record finished shards on disk; shards finished by an
+            interrupted earlier run (same file, same page ranges) are skipped
+
+    Returns:
+        The tasks that still have to run
+    """
+    entry = {
+        "output_path": output_path,
+        "part_paths": [t["part_path"] for t in tasks],
+        "errors": [],
+        "elapsed": 0.0,
+        "done": set(),
+    }
+    pending = tasks
+    if checkpoint:
+        entry["checkpoint_path"] = shard_checkpoint_path(output_path)
+        entry["checkpoint_key"] = _shard_key(path, tasks)
+        try:
+            with open(entry["checkpoint_path"], 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get("key") == entry["checkpoint_key"]:
+                entry["done"] = {i for i in saved.get("done", []) if os.path.exists(tasks[i]["part_path"])}
+        except (OSError, ValueError, IndexError, TypeError):
+            pass
+        pending = [t for t in tasks if t["shard_index"] not in entry["done"]]
+        if not pending:
+            # Interrupted between the last shard and the merge: redo one shard so the merge runs
+            entry["done"].discard(tasks[-1]["shard_index"])
+            pending = tasks[-1:]
+    entry["remaining"] = len(pending)
+    shard_state[path] = entry
+    return pending
+
+
+def record_shard_result(shard_state: Dict, task: Dict, result: Dict) -> Optional[Dict]:
+    """
+    Account for one finished shard
+
+    Returns:
+        None while shards are still running, otherwise the file-level result
+        ({'success', 'elapsed', 'error'}) after merging (or failing) the file
+    """
+    entry = shard_state[task["path"]]
+    entry["remaining"] -= 1
+    entry["elapsed"] += result.get("elapsed", 0.0)
+    if not result.get("success"):
+        first, last = task["page_range"]
+        entry["errors"].append(f"pages {first}-{last}: {result.get('error')}")
+    elif "checkpoint_path" in entry:
+        entry["done"].add(task["shard_index"])
+        _save_shard_checkpoint(entry)
+
+    if entry["remaining"] > 0:
+        return None
+
+    del shard_state[task["path"]]
+
+    if entry["errors"]:
+        for index, part_path in enumerate(entry["part_paths"]):
+            # Checkpointed shards are kept for the retry
+            if index not in entry["done"] and os.path.exists(part_path):
+                os.remove(part_path)
+        return {"success": False, "elapsed": entry["elapsed"], "error": "; ".join(entry["errors"])}
+
+    merge_shard_outputs(entry["part_paths"], entry["output_path"])
+    if "checkpoint_path" in entry and os.path.exists(entry["checkpoint_path"]):
+        os.remove(entry["checkpoint_path"])
+    return {"success": True, "elapsed": entry["elapsed"], "error": None}
@@ -0,0 +1,301 @@
+"""
+SQLite Progress Journal
+=======================
+
+Thay cho file JSON progress (list 'completed'/'failed'):
+- Mỗi file xong = 1 row commit riêng (WAL), crash chỉ mất file đang xử lý
+- Lookup theo path / hash có index, lọc 50k+ file còn lại trong vài ms
+- Mỗi thread một connection, đọc/ghi đồng thời an toàn
+- Tự import file JSON cũ ở lần chạy đầu
+- Quarantine: file làm treo / crash worker nhiều lần bị bỏ qua cho tới khi được xóa
+- Signature dedup (SHA-256 / MinHash / pHash) + nhóm trùng (document_duplicates)
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    file_hash TEXT,
+    ext TEXT,
+    status TEXT NOT NULL,          -- completed, failed
+    error TEXT,
+    elapsed REAL,
+    updated_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(file_hash);
+CREATE INDEX IF NOT EXISTS idx_documents_status ON documents(status);
+CREATE TABLE IF NOT EXISTS strikes (
+    path TEXT PRIMARY KEY,
+    count INTEGER NOT NULL,
+    last_reason TEXT,
+    quarantined INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS signatures (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    signature TEXT NOT NULL        -- JSON, see dedup.document_signature
+);
+-- Same layout as database/schema_organization.sql; ids are source paths here
+CREATE TABLE IF NOT EXISTS document_duplicates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    original_id TEXT NOT NULL,
+    duplicate_id TEXT NOT NULL,
+    detection_type TEXT DEFAULT 'hash', -- hash, content, fuzzy
+    similarity_score REAL,
+    hash_match BOOLEAN DEFAULT 0,
+    content_match BOOLEAN DEFAULT 0,
+    size_diff INTEGER,
+    status TEXT DEFAULT 'pending',
+    reviewed BOOLEAN DEFAULT 0,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    reviewed_at DATETIME,
+    UNIQUE(original_id, duplicate_id)
+);
+CREATE INDEX IF NOT EXISTS idx_duplicates_original ON document_duplicates(original_id);
+CREATE INDEX IF NOT EXISTS idx_duplicates_duplicate ON document_duplicates(duplicate_id);
+"""
+
+
+class ProgressJournal:
+    """Journaled progress store backed by SQLite in WAL mode"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self.on_record = None  # Optional callable(path, status) after each commit (e.g. LeaseQueue.complete)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _record(self, path: str, status: str, file_hash: Optional[str] = None,
+                error: Optional[str] = None, elapsed: Optional[float] = None):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO documents (path, file_hash, ext, status, error, elapsed, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    file_hash = COALESCE(excluded.file_hash, documents.file_hash),
+                    status = excluded.status,
+                    error = excluded.error,
+                    elapsed = COALESCE(excluded.elapsed, documents.elapsed),
+                    updated_at = excluded.updated_at
+                """,
+                (path, file_hash, os.path.splitext(path)[1].lower(), status,
+                 error, elapsed, datetime.now().isoformat()),
+            )
+            if status == 'completed':
+                conn.execute("DELETE FROM strikes WHERE path = ?", (path,))
+        if self.on_record is not None:
+            self.on_record(path, status)
+
+    def mark_completed(self, path: str, file_hash: Optional[str] = None,
+                       elapsed: Optional[float] = None):
+        """Commit one finished document (and forget earlier strikes)"""
+        self._record(path, 'completed', file_hash=file_hash, elapsed=elapsed)
+
+    def mark_failed(self, path: str, error: str, file_hash: Optional[str] = None):
+        """Commit one failed document"""
+        self._record(path, 'failed', file_hash=file_hash, error=error)
+
+    def forget(self, paths: Iterable[str]):
+        """Drop entries (source modified or deleted) so they are processed again"""
+        rows = [(p,) for p in paths]
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM documents WHERE path = ?", rows)
+            conn.executemany("DELETE FROM signatures WHERE path = ?", rows)
+            conn.executemany("DELETE FROM document_duplicates WHERE duplicate_id = ?", rows)
+
+    def add_strike(self, path: str, reason: str, quarantine_after: int) -> bool:
+        """
+        Record a timeout / worker crash for a file
+
+        Returns:
+            True if the file is now quarantined (skipped by later runs)
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO strikes (path, count, last_reason, quarantined, updated_at)
+                VALUES (?, 1, ?, 0, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    count = strikes.count + 1,
+                    last_reason = excluded.last_reason,
+                    updated_at = excluded.updated_at
+                """,
+                (path, reason, datetime.now().isoformat()),
+            )
+            conn.execute("UPDATE strikes SET quarantined = 1 WHERE path = ? AND count >= ?",
+                         (path, quarantine_after))
+        row = conn.execute("SELECT quarantined FROM strikes WHERE path = ?", (path,)).fetchone()
+        return bool(row[0])
+
+    def quarantined_paths(self) -> set:
+        rows = self._conn().execute("SELECT path FROM strikes WHERE quarantined = 1")
+        return {r[0] for r in rows}
+
+    def list_quarantine(self) -> List[tuple]:
+        """(path, strikes, last_reason, updated_at) of quarantined files"""
+        return self._conn().execute(
+            "SELECT path, count, last_reason, updated_at FROM strikes WHERE quarantined = 1 ORDER BY updated_at"
+        ).fetchall()
+
+    def clear_quarantine(self, paths: Optional[Iterable[str]] = None) -> int:
+        """Release quarantined files (all if paths is None) so the next run retries them"""
+        conn = self._conn()
+        with conn:
+            if paths is None:
+                cursor = conn.execute("DELETE FROM strikes WHERE quarantined = 1")
+            else:
+                cursor = conn.executemany("DELETE FROM strikes WHERE path = ?", [(p,) for p in paths])
+        return cursor.rowcount
+
+    def is_completed(self, path: str) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM documents WHERE path = ? AND status = 'completed'", (path,)
+        ).fetchone()
+        return row is not None
+
+    def find_by_hash(self, file_hash: str) -> List[str]:
+        """Completed documents with this content hash"""
+        rows = self._conn().execute(
+            "SELECT path FROM documents WHERE file_hash = ? AND status = 'completed'", (file_hash,)
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def completed_paths(self) -> set:
+        rows = self._conn().execute("SELECT path FROM documents WHERE status = 'completed'")
+        return {r[0] for r in rows}
+
+    def filter_remaining(self, paths: Iterable[str]) -> List[str]:
+        """Paths not yet completed (single indexed query + set lookups)"""
+        completed = self.completed_paths()
+        return [p for p in paths if p not in completed]
+
+    def load_signature(self, path: str, size: int, mtime_ns: int) -> Optional[Dict]:
+        """Stored dedup signature, None if missing or the file changed since"""
+        row = self._conn().execute(
+            "SELECT signature FROM signatures WHERE path = ? AND size = ? AND mtime_ns = ?",
+            (path, size, mtime_ns),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save_signature(self, path: str, size: int, mtime_ns: int, signature: Dict):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO signatures (path, size, mtime_ns, signature) VALUES (?, ?, ?, ?)",
+                (path, size, mtime_ns, json.dumps(signature)),
+            )
+
+    def completed_signatures(self) -> List[tuple]:
+        """(path, signature) of completed documents that are not themselves duplicates"""
+        rows = self._conn().execute(
+            "SELECT s.path, s.signature FROM signatures s "
+            "JOIN documents d ON d.path = s.path AND d.status = 'completed' "
+            "WHERE s.path NOT IN (SELECT duplicate_id FROM document_duplicates)"
+        ).fetchall()
+        return [(path, json.loads(signature)) for path, signature in rows]
+
+    def record_duplicate(self, original: str, duplicate: str, detection_type: str, score: float,
+                         hash_match: bool, content_match: bool, size_diff: int):
+        """One row of document_duplicates (status 'pending' until reviewed in the app)"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                """
+                INSERT INTO document_duplicates (original_id, duplicate_id, detection_type, similarity_score,
+                                                 hash_match, content_match, size_diff)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(original_id, duplicate_id) DO UPDATE SET
+                    detection_type = excluded.detection_type,
+                    similarity_score = excluded.similarity_score,
+                    hash_match = excluded.hash_match,
+                    content_match = excluded.content_match,
+                    size_diff = excluded.size_diff
+                """,
+                (original, duplicate, detection_type, score, int(hash_match), int(content_match), size_diff),
+            )
+
+    def duplicate_count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM document_duplicates").fetchone()[0]
+
+    def recent_timings(self, limit: int = 500) -> List[tuple]:
+        """(path, elapsed) of the most recent timed conversions (cost model calibration)"""
+        rows = self._conn().execute(
+            "SELECT path, elapsed FROM documents WHERE status = 'completed' AND elapsed > 0 "
+            "ORDER BY updated_at DESC LIMIT ?", (limit,)
+        )
+        return rows.fetchall()
+
+    def count(self, status: str) -> int:
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM documents WHERE status = ?", (status,)
+        ).fetchone()
+        return row[0]
+
+    def by_format(self) -> Dict[str, Dict[str, int]]:
+        """{'.pdf': {'success': n, 'failed': m}, ...}"""
+        result = {}
+        rows = self._conn().execute("SELECT ext, status, COUNT(*) FROM documents GROUP BY ext, status")
+        for ext, status, count in rows:
+            counts = result.setdefault(ext, {'success': 0, 'failed': 0})
+            counts['success' if status == 'completed' else 'failed'] += count
+        return result
+
+    def import_json(self, progress_file: str) -> int:
+        """
+        One-time migration from the old JSON progress file
+
+        Returns:
+            Number of imported entries (0 if the journal already has data)
+        """
+        if not os.path.exists(progress_file) or self.count('completed') or self.count('failed'):
+            return 0
+
+        with open(progress_file, 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+
+        now = datetime.now().isoformat()
+        completed = set(progress.get('completed', []))
+        rows = [(p, os.path.splitext(p)[1].lower(), 'completed', None, now) for p in completed]
+        rows += [(p, os.path.splitext(p)[1].lower(), 'failed', 'imported from JSON progress', now)
+                 for p in set(progress.get('failed', [])) - completed]
+
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO documents (path, ext, status, error, updated_at) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
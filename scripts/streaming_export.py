@@ -0,0 +1,162 @@
+"""
+Streaming Markdown Export
+=========================
+
+convert() + export_to_markdown() giữ cùng lúc DoclingDocument, ảnh trang và
+chuỗi markdown của CẢ file -> PDF 1000 trang ngốn RAM theo số trang.
+Streaming export convert từng đoạn trang (page_range), ghi markdown của đoạn
+đó ra file ngay, rồi bỏ kết quả (ảnh trang, cấu trúc trung gian) trước khi
+sang đoạn tiếp theo -> peak memory ~ hằng số theo STREAM_CHUNK_PAGES.
+
+Ranh giới giữa hai đoạn được nối bằng pdf_sharding.boundary_join (list và đoạn
+văn bị cắt ngang được nối lại). Output KHÔNG giống hệt từng byte export của cả
+file: bảng vắt qua ranh giới đoạn thành 2 bảng, header/footer và cấp heading
+được quyết định theo từng đoạn (chi tiết: pdf_sharding.py). Vì vậy script batch
+mặc định STREAM_EXPORT_PAGES = None (export cả file); chỉ bật khi thiếu RAM.
+Như export cả file, output không có newline ở cuối (merge_shard_outputs cũng vậy).
+
+Checkpoint (resume=True): markdown các trang đã xong nằm trong {output}.partial,
+vị trí + trang tiếp theo ghi trong {output}.ckpt sau mỗi đoạn. Bị ngắt (Ctrl+C,
+reboot, worker bị kill) -> lần chạy sau tiếp tục từ trang chưa xong rồi ghép
+vào file cuối. Checkpoint bị bỏ nếu file nguồn đổi (size/mtime) hoặc đổi cỡ đoạn.
+"""
+
+import gc
+import json
+import os
+from typing import Callable, Dict, Optional, Tuple
+
+from conversion_metrics import export_markdown
+from pdf_sharding import boundary_join, plan_shards
+
+STREAM_CHUNK_PAGES = 10
+# Smaller page ranges are exported in one piece; kept below pdf_sharding.SHARD_PAGES so
+# the shards of a sharded PDF stream too
+STREAM_MIN_PAGES = 20
+
+
+def checkpoint_paths(output_path: str) -> Tuple[str, str]:
+    """(partial markdown, checkpoint state) files kept next to the output"""
+    return f"{output_path}.partial", f"{output_path}.ckpt"
+
+
+def discard_checkpoint(output_path: str):
+    """Remove the checkpoint of an output (source deleted or finished)"""
+    for path in checkpoint_paths(output_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _source_key(source_path: str, first_page: int, last_page: int, chunk_pages: int) -> Dict:
+    stat = os.stat(source_path)
+    return {"source": os.path.abspath(source_path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "pages": [first_page, last_page], "chunk_pages": chunk_pages}
+
+
+def load_checkpoint(output_path: str, key: Dict) -> Optional[Dict]:
+    """Saved state if it belongs to this exact source/page layout and its partial file is intact"""
+    partial_path, state_path = checkpoint_paths(output_path)
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get("key") != key or os.path.getsize(partial_path) < state["offset"]:
+            return None
+        return state
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _save_checkpoint(state_path: str, state: Dict):
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, state_path)
+
+
+def export_streaming(convert_chunk: Callable[[Tuple[int, int]], str], output_path: str,
+                     first_page: int, last_page: int,
+                     chunk_pages: int = STREAM_CHUNK_PAGES,
+                     on_chunk: Optional[Callable[[Tuple[int, int], int], None]] = None,
+                     source_path: Optional[str] = None) -> int:
+    """
+    Convert pages [first_page, last_page] chunk by chunk, appending to output_path
+
+    Args:
+        convert_chunk: (first, last) -> markdown of those pages; must not keep
+            references to the conversion result
+        on_chunk: optional callback(page_range, chars) after each chunk is on disk
+        source_path: enables checkpoints; an interrupted export of the same
+            source resumes after its last completed chunk
+
+    Returns:
+        Number of characters written
+    """
+    chunks = [(start + first_page - 1, end + first_page - 1)
+              for start, end in plan_shards(last_page - first_page + 1, chunk_pages)]
+    written = 0
+    tail = None
+    state = None
+
+    if source_path is not None:
+        tmp_path, state_path = checkpoint_paths(output_path)
+        key = _source_key(source_path, first_page, last_page, chunk_pages)
+        state = load_checkpoint(output_path, key)
+        if state is not None:
+            written, tail = state["chars"], state["tail"]
+            chunks = [c for c in chunks if c[0] >= state["next_page"]]
+            print(f"   Resuming {os.path.basename(source_path)} at page {state['next_page']} "
+                  f"({state['next_page'] - first_page}/{last_page - first_page + 1} pages checkpointed)")
+        else:
+            state = {"key": key, "offset": 0, "chars": 0, "tail": None, "next_page": first_page}
+    else:
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+
+    finished = False
+    try:
+        with open(tmp_path, 'r+' if state and state["offset"] else 'w', encoding='utf-8') as out:
+            if state is not None:
+                # Drop anything written after the last checkpoint (chunk cut off mid-write)
+                out.seek(state["offset"])
+                out.truncate()
+            for page_range in chunks:
+                markdown = convert_chunk(page_range).strip('\n')
+                if markdown:
+                    if tail is not None:
+                        separator = boundary_join(tail, markdown.split('\n', 1)[0])
+                        out.write(separator)
+                        written += len(separator)
+                    out.write(markdown)
+                    written += len(markdown)
+                    tail = markdown.rsplit('\n', 1)[-1]
+                out.flush()
+                del markdown
+                if state is not None:
+                    os.fsync(out.fileno())
+                    state.update(offset=out.tell(), chars=written, tail=tail, next_page=page_range[1] + 1)
+                    _save_checkpoint(state_path, state)
+                # Page images / predictions of the chunk are only referenced from cycles
+                gc.collect()
+                if on_chunk is not None:
+                    on_chunk(page_range, written)
+        os.replace(tmp_path, output_path)
+        finished = True
+    finally:
+        if state is None:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        elif finished:
+            discard_checkpoint(output_path)
+    return written
+
+
+def docling_chunk_converter(converter, path: str) -> Callable[[Tuple[int, int]], str]:
+    """convert_chunk for a plain DocumentConverter (result dropped right after export)"""
+    def convert_chunk(page_range):
+        result = converter.convert(path, page_range=page_range)
+        try:
+            return export_markdown(result)
+        finally:
+            del result
+    return convert_chunk
@@ -30,6 +30,8 @@ except ImportError as e:
     print("Run: D:\\Work\\Coding\\QSM\\python\\venv\\Scripts\\pip.exe install docling")
     sys.exit(1)
 
+from conversion_metrics import StageMetrics, enable_pipeline_timings, export_markdown, measure
+
 # Configuration
 DOCUMENTS_ROOT = r"D:\Work\Coding\archi-query-master\Documents"
 SAMPLE_SIZE = 20
@@ -38,6 +40,7 @@ RESULT_FILE = r"D:\Work\Coding\QSM\sample_test_results.json"
 def setup_docling():
     """Setup Docling converter"""
     print("⚙️  Setting up Docling converter (CPU mode)...")
+    enable_pipeline_timings()
     
     pipeline_options = PdfPipelineOptions()
     pipeline_options.do_ocr = True
@@ -114,8 +117,10 @@ def process_pdf(pdf_path, converter):
         start_time = time.time()
         
         # Convert
-        doc_result = converter.convert(pdf_path)
-        markdown = doc_result.document.export_to_markdown()
+        with measure(pdf_path) as metrics:
+            doc_result = converter.convert(pdf_path)
+            markdown = export_markdown(doc_result)
+            del doc_result
         
         # Save output
         output_path = pdf_path.replace('.pdf', '.md')
@@ -127,8 +132,13 @@ def process_pdf(pdf_path, converter):
         result["success"] = True
         result["time_seconds"] = round(elapsed, 2)
         result["output_length"] = len(markdown)
+        result["metrics"] = metrics.event("docling", elapsed, output_path)
         
-        print(f"   ✅ Success - {elapsed:.1f}s - {len(markdown):,} chars")
+        stages = sorted(result["metrics"]["stages"].items(), key=lambda kv: -kv[1])
+        top = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in stages if name != "pipeline_total")[:100]
+        print(f"   ✅ Success - {elapsed:.1f}s - {len(markdown):,} chars - {metrics.pages} pages")
+        if top:
+            print(f"      ⏱️  {top}")
         
     except Exception as e:
         result["error"] = str(e)
@@ -162,6 +172,15 @@ def analyze_results(results):
         print(f"   Max: {max_time:.2f}s")
         print()
         
+        # Where the time goes
+        stage_metrics = StageMetrics()
+        for r in successful:
+            stage_metrics.add(r.get("metrics"))
+        print(f"⏱️  STAGE TIMINGS:")
+        for line in stage_metrics.report():
+            print(f"   {line}")
+        print()
+        
         # Size vs speed correlation
         print(f"📊 SIZE vs SPEED:")
         for r in sorted(successful, key=lambda x: x["size_mb"]):
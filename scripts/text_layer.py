@@ -0,0 +1,226 @@
+"""
+Per-Page Text-Layer Detection
+=============================
+
+force_full_page_ocr=True bắt EasyOCR chạy lại trên MỌI trang, kể cả PDF
+born-digital đã có text layer sạch. Pre-pass này đọc text layer của từng trang
+bằng pypdfium2 (không render) rồi quyết định:
+- text:  đủ ký tự hợp lệ + vùng glyph đủ lớn -> dùng text layer, OCR chỉ chạy
+         trên các vùng ảnh (force_full_page_ocr=False)
+- ocr:   trang scan / text layer rỗng hoặc rác / ảnh phủ gần hết trang
+         (scan có text ẩn) -> full-page OCR như cũ
+Các trang liên tiếp cùng quyết định được convert chung một lần (page_range).
+Có scan_converter: trang scan được render + tiền xử lý (image_preprocess.py)
+rồi OCR từng trang như ảnh.
+"""
+
+import os
+
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from conversion_metrics import export_markdown, record_stage
+from pdf_sharding import join_markdown
+
+TEXT_MIN_CHARS = 50  # Usable (alphanumeric) characters for a page to count as text
+TEXT_MIN_COVERAGE = 0.02  # Text-rect area / page area
+MAX_GARBLED_RATIO = 0.10  # Share of U+FFFD / control characters tolerated in the text layer
+SCANNED_IMAGE_COVERAGE = 0.85  # A single image covering this much of the page = scan (hidden OCR text)
+
+
+def _page_decision(page, index: int) -> Dict:
+    """Text-layer statistics and OCR decision for one pypdfium2 page"""
+    import pypdfium2.raw as pdfium_c
+
+    width, height = page.get_size()
+    page_area = max(width * height, 1.0)
+
+    textpage = page.get_textpage()
+    try:
+        text = textpage.get_text_range()
+        glyph_area = 0.0
+        for i in range(textpage.count_rects()):
+            left, bottom, right, top = textpage.get_rect(i)
+            glyph_area += max(right - left, 0) * max(top - bottom, 0)
+    finally:
+        textpage.close()
+
+    usable = sum(1 for ch in text if ch.isalnum())
+    garbled = sum(1 for ch in text if ch == '\ufffd' or (ord(ch) < 32 and ch not in '\r\n\t'))
+    coverage = min(glyph_area / page_area, 1.0)
+
+    image_coverage = 0.0
+    for obj in page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE,)):
+        # pypdfium2 >= 5 renamed get_pos() to get_bounds()
+        bounds = obj.get_bounds() if hasattr(obj, 'get_bounds') else obj.get_pos()
+        left, bottom, right, top = bounds
+        image_coverage = max(image_coverage, (right - left) * (top - bottom) / page_area)
+
+    if usable < TEXT_MIN_CHARS:
+        reason = "no text layer" if usable == 0 else f"sparse text ({usable} chars)"
+    elif garbled > MAX_GARBLED_RATIO * max(len(text), 1):
+        reason = "garbled text layer"
+    elif coverage < TEXT_MIN_COVERAGE:
+        reason = f"low glyph coverage ({coverage:.1%})"
+    elif image_coverage >= SCANNED_IMAGE_COVERAGE:
+        reason = "full-page image (scan with text layer)"
+    else:
+        reason = None
+
+    return {
+        "page": index + 1,
+        "chars": usable,
+        "coverage": round(coverage, 4),
+        "image_coverage": round(min(image_coverage, 1.0), 4),
+        "ocr": reason is not None,
+        "reason": reason or "text layer",
+    }
+
+
+def analyze_pages(pdf_path: str, page_range: Optional[Tuple[int, int]] = None) -> Optional[List[Dict]]:
+    """
+    Decide per page whether OCR is needed
+
+    Args:
+        page_range: (first, last), 1-based inclusive; whole document if None
+
+    Returns:
+        One decision dict per page, or None if the PDF can't be read
+        (caller should fall back to full OCR)
+    """
+    try:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(pdf_path)
+    except Exception:
+        return None
+
+    try:
+        first, last = page_range or (1, len(pdf))
+        decisions = []
+        for index in range(first - 1, min(last, len(pdf))):
+            page = pdf[index]
+            try:
+                decisions.append(_page_decision(page, index))
+            except Exception as e:
+                decisions.append({"page": index + 1, "chars": 0, "coverage": 0.0, "image_coverage": 0.0,
+                                  "ocr": True, "reason": f"analysis failed: {e}"})
+            finally:
+                page.close()
+        return decisions
+    finally:
+        pdf.close()
+
+
+def page_runs(decisions: List[Dict]) -> List[Tuple[int, int, bool]]:
+    """Group consecutive pages with the same decision: [(first, last, needs_ocr), ...]"""
+    runs = []
+    for d in decisions:
+        if runs and runs[-1][2] == d["ocr"] and runs[-1][1] == d["page"] - 1:
+            runs[-1] = (runs[-1][0], d["page"], d["ocr"])
+        else:
+            runs.append((d["page"], d["page"], d["ocr"]))
+    return runs
+
+
+def format_pages(pages: List[int]) -> str:
+    """[1, 2, 3, 7] -> '1-3, 7'"""
+    spans = []
+    for page in pages:
+        if spans and spans[-1][1] == page - 1:
+            spans[-1][1] = page
+        else:
+            spans.append([page, page])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in spans)
+
+
+def summarize_decisions(decisions: Optional[List[Dict]]) -> str:
+    """One log line: how many pages skip OCR and which pages still need it"""
+    if decisions is None:
+        return "text layer unreadable, full OCR"
+    ocr_pages = [d["page"] for d in decisions if d["ocr"]]
+    text_count = len(decisions) - len(ocr_pages)
+    if not ocr_pages:
+        return f"{text_count} text-layer pages, OCR skipped"
+    return f"{text_count} text-layer pages, OCR on {len(ocr_pages)}: {format_pages(ocr_pages)}"
+
+
+def log_page_decisions(log_path: str, pdf_path: str, decisions: Optional[List[Dict]]):
+    """Append per-page decisions as one JSON line per page"""
+    if not log_path or not decisions:
+        return
+    timestamp = datetime.now().isoformat()
+    try:
+        with open(log_path, 'a', encoding='utf-8') as f:
+            for d in decisions:
+                f.write(json.dumps({"time": timestamp, "path": pdf_path, **d}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"WARNING: Could not write page decision log: {e}")
+
+
+class PageRoutedConverter:
+    """
+    Two Docling converters behind one call: text-layer pages go to a converter
+    without forced OCR, scanned pages to the forced full-page OCR converter.
+
+    Docling builds each pipeline lazily, so a worker that only sees born-digital
+    PDFs never loads the forced-OCR pipeline.
+
+    With a scan_converter (image-input converter), scanned pages are rendered at
+    a text-height-normalized DPI, deskewed / binarized / cropped and OCR'd one
+    page image at a time instead of going through ocr_converter.
+    """
+
+    def __init__(self, text_converter, ocr_converter, scan_converter=None):
+        self.text_converter = text_converter
+        self.ocr_converter = ocr_converter
+        self.scan_converter = scan_converter
+
+    def convert_scanned_pages(self, pdf_path: str, first: int, last: int) -> List[str]:
+        """Markdown of 1-based pages first..last via preprocessed page images"""
+        import pypdfium2 as pdfium
+        from image_preprocess import render_scan_page, save_png
+
+        parts = []
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            for index in range(first - 1, last):
+                image, report = render_scan_page(pdf, index)
+                for step, seconds in report["steps"].items():
+                    record_stage(f"preprocess_{step}", seconds)
+                image_path = save_png(image)
+                try:
+                    parts.append(export_markdown(self.scan_converter.convert(image_path)))
+                finally:
+                    os.remove(image_path)
+        finally:
+            pdf.close()
+        return parts
+
+    def convert_to_markdown(self, pdf_path: str,
+                            page_range: Optional[Tuple[int, int]] = None) -> Tuple[str, Optional[List[Dict]]]:
+        """
+        Returns:
+            (markdown, per-page decisions or None when the pre-pass failed)
+        """
+        decisions = analyze_pages(pdf_path, page_range)
+        if decisions is None:
+            runs = [(page_range or (None, None)) + (True,)]
+        else:
+            runs = page_runs(decisions)
+
+        parts = []
+        for first, last, needs_ocr in runs:
+            if needs_ocr and self.scan_converter is not None and first is not None:
+                parts.extend(self.convert_scanned_pages(pdf_path, first, last))
+                continue
+            converter = self.ocr_converter if needs_ocr else self.text_converter
+            if first is None:
+                result = converter.convert(pdf_path)
+            else:
+                result = converter.convert(pdf_path, page_range=(first, last))
+            parts.append(export_markdown(result))
+
+        if len(parts) == 1:
+            return parts[0], decisions
+        return join_markdown(parts), decisions
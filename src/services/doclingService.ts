@@ -62,12 +62,17 @@ export interface DoclingResult {
 export class DoclingService {
   private pythonPath: string;
   private scriptPath: string;
+  private interactiveClientPath: string;
+  private interactiveSpool: string;
   private isAvailable: boolean = false;
 
   constructor() {
     // Detect Python interpreter
     this.pythonPath = this.detectPython();
     this.scriptPath = path.join(__dirname, '../../python/docling_processor.py');
+    // Interactive lane of a running batch (scripts/interactive_lane.py)
+    this.interactiveClientPath = path.join(__dirname, '../../scripts/interactive_lane.py');
+    this.interactiveSpool = process.env.QSM_INTERACTIVE_SPOOL || 'D:\\Work\\Coding\\QSM\\interactive_spool';
   }
 
   /**
@@ -139,6 +144,52 @@ export class DoclingService {
     });
   }
 
+  /**
+   * Convert through the interactive lane of a running batch (warm worker, no model loading)
+   *
+   * Returns null when no batch is accepting requests for this file, or the batch
+   * failed to convert it (timeout, quarantine, worker crash), so the caller
+   * converts it itself.
+   */
+  private async processInteractive(filePath: string): Promise<DoclingResult | null> {
+    const heartbeat = path.join(this.interactiveSpool, 'scheduler.json');
+    if (!(await fs.pathExists(heartbeat)) || !(await fs.pathExists(this.interactiveClientPath))) {
+      return null;
+    }
+
+    return new Promise((resolve) => {
+      const client = spawn(this.pythonPath, [
+        this.interactiveClientPath,
+        filePath,
+        '--spool', this.interactiveSpool
+      ]);
+
+      let stdout = '';
+
+      client.stdout.on('data', (data) => {
+        stdout += data.toString();
+      });
+
+      client.on('close', (code) => {
+        // Exit code 2: no scheduler (or it doesn't handle this format), 1: the batch failed to convert it
+        if (code !== 0) {
+          resolve(null);
+          return;
+        }
+        try {
+          const result: DoclingResult = JSON.parse(stdout);
+          resolve(result.status === 'error' ? null : result);
+        } catch {
+          resolve(null);
+        }
+      });
+
+      client.on('error', () => {
+        resolve(null);
+      });
+    });
+  }
+
   /**
    * Process a document using Docling
    */
@@ -156,6 +207,21 @@ export class DoclingService {
       };
     }
 
+    // A running batch converts with its own pipeline options: only for requests with every option at its default
+    const defaultOptions = !options.enableOcr
+      && options.enableTables !== false
+      && !options.enableFormulas
+      && !options.enableCode
+      && !options.forceOcr
+      && !(options.ocrLanguages && options.ocrLanguages.length > 0)
+      && (options.outputFormat || 'markdown') === 'markdown';
+    if (defaultOptions) {
+      const interactiveResult = await this.processInteractive(filePath);
+      if (interactiveResult) {
+        return interactiveResult;
+      }
+    }
+
     // Check Docling availability
     if (!this.isAvailable) {
       const available = await this.checkAvailability();